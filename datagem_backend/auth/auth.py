@@ -38,9 +38,10 @@ async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)
 ):
     """Log in a user and return a JWT access token."""
-    user = crud.get_user_by_email(db, email=form_data.username) # username is the email
+    user = crud.get_cached_user_by_email(db, email=form_data.username) # username is the email
     
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    # bcrypt runs on the password pool, not the event loop
+    if not user or not await security.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -1,8 +1,13 @@
+from datetime import timedelta
+
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from database import database, crud, models
+from database import async_crud, async_database, models, user_cache
 from pydantic import BaseModel, EmailStr
 
+from auth import security
+
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 class UserCreate(BaseModel):
@@ -14,55 +19,56 @@ class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+def _session(user) -> dict:
+    """Login/signup response: a signed access token plus the user's profile."""
+    access_token = security.create_access_token(
+        data={"sub": user.email}, expires_delta=timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user": {
+            "id": user.id,
+            "email": user.email,
+            "full_name": user.full_name
+        }
+    }
+
 @router.post("/signup")
-def signup(user_data: UserCreate, db: Session = Depends(database.get_db)):
+async def signup(user_data: UserCreate, db: Session | AsyncSession = Depends(async_database.get_chat_db)):
     # Check if user already exists
-    db_user = crud.get_user_by_email(db, email=user_data.email)
+    db_user = await async_crud.get_cached_user_by_email(db, email=user_data.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Create the user object
+    # Create the user object (bcrypt runs on the password pool, not the event loop)
     new_user = models.User(
         email=user_data.email,
         full_name=user_data.full_name,
-        hashed_password=user_data.password 
+        hashed_password=await security.get_password_hash_async(user_data.password)
     )
-    user = crud.create_user(db=db, user=new_user)
+    user = await async_crud.call("create_user", db, user=new_user)
     
     # Return token AND user data immediately
-    return {
-        "access_token": f"session_{user.id}", 
-        "token_type": "bearer",
-        "user": {
-            "id": user.id,
-            "email": user.email,
-            "full_name": user.full_name
-        }
-    }
+    return _session(user)
 
 @router.post("/login")
-def login(credentials: UserLogin, db: Session = Depends(database.get_db)):
-    user = crud.get_user_by_email(db, email=credentials.email)
+async def login(credentials: UserLogin, db: Session | AsyncSession = Depends(async_database.get_chat_db)):
+    user = await async_crud.get_cached_user_by_email(db, email=credentials.email)
     
-    if not user or user.hashed_password != credentials.password:
+    if not user or not await security.check_password_async(credentials.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    return {
-        "access_token": f"session_{user.id}", 
-        "token_type": "bearer",
-        "user": {
-            "id": user.id,
-            "email": user.email,
-            "full_name": user.full_name
-        }
-    }
+    if not security.is_password_hash(user.hashed_password):
+        # Account from before passwords were hashed: replace the plain password
+        hashed_password = await security.get_password_hash_async(credentials.password)
+        await async_crud.call("set_password_hash", db, user_id=user.id, hashed_password=hashed_password)
+    
+    return _session(user)
 
 @router.get("/me")
-def get_me(db: Session = Depends(database.get_db)):
-    # Simple logic to find the current session user
-    user = db.query(models.User).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def get_me(user: user_cache.CachedUser = Depends(security.get_current_active_user)):
+    # The user the bearer token belongs to (token check and lookup are cached)
     return {
         "id": user.id,
         "email": user.email, 
@@ -1,16 +1,23 @@
+import asyncio
+import hmac
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import bcrypt
 
 # --- THIS IS THE FIX ---
 # We changed `..database` to `database` to make it an absolute import
-from database import crud, database, models as db_models
+from database import async_crud, async_database, user_cache, models as db_models
 # --- END FIX ---
 
 # =====================
@@ -22,8 +29,32 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 # =====================
 
+# bcrypt cost factor (2^rounds iterations). 12 takes ~250 ms per hash;
+# lower it for development/test environments, never below 10 in production.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
 # Setup for "scrambling" passwords
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# =====================
+# Password hashing runs only on its own small thread pool: never on the
+# event loop (a single bcrypt call would stall every stream for ~250 ms),
+# and never more than PASSWORD_HASH_WORKERS at once, so a burst of logins
+# cannot take all the CPU. Callers queue beyond that, up to
+# PASSWORD_HASH_MAX_PENDING; after that they get a 503 straight away.
+# =====================
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_pending = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+# Verified JWTs (token -> (email, cache expiry)), so hot endpoints skip the
+# decode and signature check for a token they have already accepted
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+_token_cache: OrderedDict[str, tuple[str, float]] = OrderedDict()
+_token_cache_lock = threading.Lock()
 
 # This tells FastAPI what "login door" to check for a key
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
@@ -32,8 +63,7 @@ class TokenData(BaseModel):
     """The 'data' we will hide inside our 'keys' (tokens)."""
     email: str | None = None
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Check if the typed-in password matches the scrambled one."""
+def _verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
         return pwd_context.verify(plain_password, hashed_password)
     except Exception:
@@ -42,16 +72,65 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         hashed_bytes = hashed_password.encode('utf-8')
         return bcrypt.checkpw(password_bytes, hashed_bytes)
 
-def get_password_hash(password: str) -> str:
-    """Turn a plain password into a scrambled (hashed) one."""
+def _get_password_hash(password: str) -> str:
     try:
         return pwd_context.hash(password)
     except Exception:
         # Fallback to bcrypt directly if passlib fails
         password_bytes = password.encode('utf-8')
-        hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+        hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
         return hashed.decode('utf-8')
 
+def _admit():
+    if not _hash_pending.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-ins in progress, please retry",
+            headers={"Retry-After": "1"},
+        )
+
+def _run_hash_job(fn, *args):
+    """Run a bcrypt job on the password pool (from any thread) and wait for it."""
+    _admit()
+    try:
+        return _hash_executor.submit(fn, *args).result()
+    finally:
+        _hash_pending.release()
+
+async def _run_hash_job_async(fn, *args):
+    """Run a bcrypt job on the password pool without blocking the event loop."""
+    _admit()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_pending.release()
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Check if the typed-in password matches the scrambled one (blocking; use from sync code)."""
+    return _run_hash_job(_verify_password, plain_password, hashed_password)
+
+def get_password_hash(password: str) -> str:
+    """Turn a plain password into a scrambled (hashed) one (blocking; use from sync code)."""
+    return _run_hash_job(_get_password_hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password for async handlers."""
+    return await _run_hash_job_async(_verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash for async handlers."""
+    return await _run_hash_job_async(_get_password_hash, password)
+
+def is_password_hash(stored: str) -> bool:
+    """True for a bcrypt hash; accounts from before hashing hold the plain password."""
+    return stored.startswith(("$2a$", "$2b$", "$2y$"))
+
+async def check_password_async(plain_password: str, stored: str) -> bool:
+    """Check a password against a stored bcrypt hash (or a not yet upgraded plain password)."""
+    if is_password_hash(stored):
+        return await verify_password_async(plain_password, stored)
+    return hmac.compare_digest(plain_password.encode("utf-8"), stored.encode("utf-8"))
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     """Create a new 'key' (JWT token) for a user."""
     to_encode = data.copy()
@@ -64,9 +143,37 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_token_subject(token: str) -> str | None:
+    """
+    The `sub` (email) of a valid token, or None. Verified tokens are cached
+    until they expire (at most TOKEN_CACHE_TTL_SECONDS), so repeat requests
+    skip the JWT decode.
+    """
+    now = time.time()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is not None:
+            if entry[1] > now:
+                _token_cache.move_to_end(token)
+                return entry[0]
+            del _token_cache[token]
+    try:
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    email = payload.get("sub")
+    if email is None:
+        return None
+    cache_until = min(float(payload.get("exp", now)), now + TOKEN_CACHE_TTL_SECONDS)
+    with _token_cache_lock:
+        _token_cache[token] = (email, cache_until)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return email
+
 async def get_current_user(
-    db: Session = Depends(database.get_db), token: str = Depends(oauth2_scheme)
-) -> db_models.User:
+    db: Session | AsyncSession = Depends(async_database.get_chat_db), token: str = Depends(oauth2_scheme)
+) -> user_cache.CachedUser:
     """
     This is the "bouncer" for our API. It checks the user's "key" (token).
     It will raise an error if the key is bad:
@@ -78,23 +185,20 @@ Token Expired: This 'key' is too old.
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
-    except JWTError:
+    email = decode_token_subject(token)
+    if email is None:
         raise credentials_exception
-    
-    user = crud.get_user_by_email(db, email=token_data.email)
+    token_data = TokenData(email=email)
+
+    # Cache misses load the user without blocking the event loop
+    user = await async_crud.get_cached_user_by_email(db, email=token_data.email)
     if user is None:
         raise credentials_exception
     return user
 
 async def get_current_active_user(
-    current_user: db_models.User = Depends(get_current_user),
-) -> db_models.User:
+    current_user: user_cache.CachedUser = Depends(get_current_user),
+) -> user_cache.CachedUser:
     """
     A helper function to check if the user is not (for example)
     banned or deactivated. We don't use this, but it's good practice.
@@ -0,0 +1,124 @@
+"""
+Benchmark: concurrent chat turns, DB access on the event loop (old sync
+CRUD) vs the async engine (database/async_crud.py) vs the sync CRUD in
+worker threads (the fallback when no async driver is installed).
+
+Each turn does what /chat does around the model call: look up the user,
+save the prompt, load recent history, wait for the "model", save the
+answer. Reports turns/s and event-loop lag (how late a 5 ms timer fires
+while the turns run), which is what other streams feel.
+Runs on a temporary SQLite file; set BENCH_POSTGRES_URL to also run
+against PostgreSQL (needs psycopg2 and asyncpg).
+Run from datagem_backend/:  python -m benchmarks.bench_async_db
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import async_crud, crud, models as db_models
+from database.async_database import to_async_url
+from database.database import Base
+
+CONCURRENT_TURNS = [1, 16, 64]
+TURNS_PER_WORKER = 10
+MODEL_SECONDS = 0.02  # simulated time-to-answer between the two writes
+EMAIL = "bench@datagem.ai"
+
+
+def seed(url: str) -> None:
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        crud.create_user(db, db_models.User(email=EMAIL, hashed_password="x"))
+    engine.dispose()
+
+
+async def turn_on_loop(db, i: int) -> None:
+    user = crud.get_user_by_email(db, EMAIL)
+    crud.save_chat_message(db, user.id, "user", f"question {i}")
+    crud.get_chat_history(db, user.id, limit=11)
+    await asyncio.sleep(MODEL_SECONDS)
+    crud.save_chat_message(db, user.id, "model", f"answer {i}")
+
+
+async def turn_via_call(db, i: int) -> None:
+    user = await async_crud.call("get_user_by_email", db, email=EMAIL)
+    await async_crud.call("save_chat_message", db, user_id=user.id, role="user", content=f"question {i}")
+    await async_crud.call("get_chat_history", db, user_id=user.id, limit=11)
+    await asyncio.sleep(MODEL_SECONDS)
+    await async_crud.call("save_chat_message", db, user_id=user.id, role="model", content=f"answer {i}")
+
+
+async def measure_lag(stop: asyncio.Event, lags: list[float]) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append(time.perf_counter() - start - 0.005)
+
+
+async def run(mode: str, url: str, concurrency: int) -> dict:
+    options = {"pool_size": concurrency, "max_overflow": 0}  # one connection per concurrent turn
+    if mode == "async":
+        engine = create_async_engine(to_async_url(url), **options)
+        make_session = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+    else:
+        engine = create_engine(url, **options)
+        make_session = sessionmaker(bind=engine, autoflush=False)
+    turn = turn_on_loop if mode == "sync on loop" else turn_via_call
+
+    async def worker(w: int):
+        for n in range(TURNS_PER_WORKER):
+            if mode == "async":
+                async with make_session() as db:
+                    await turn(db, w * TURNS_PER_WORKER + n)
+            else:
+                db = make_session()
+                try:
+                    await turn(db, w * TURNS_PER_WORKER + n)
+                finally:
+                    db.close()
+
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    if mode == "async":
+        await engine.dispose()
+    else:
+        engine.dispose()
+    lags.sort()
+    return {
+        "turns_s": concurrency * TURNS_PER_WORKER / elapsed,
+        "lag_p50_ms": lags[len(lags) // 2] * 1000,
+        "lag_max_ms": lags[-1] * 1000,
+    }
+
+
+def main():
+    targets = []
+    with tempfile.TemporaryDirectory() as tmp:
+        targets.append(("sqlite", f"sqlite:///{os.path.join(tmp, 'bench.db')}"))
+        if os.getenv("BENCH_POSTGRES_URL"):
+            targets.append(("postgres", os.environ["BENCH_POSTGRES_URL"]))
+        print(f"{TURNS_PER_WORKER} turns per worker, {MODEL_SECONDS * 1000:.0f} ms simulated model time")
+        print(f"{'db':<9} {'mode':<16} {'workers':>7} {'turns/s':>9} {'lag p50 ms':>11} {'lag max ms':>11}")
+        for db_name, url in targets:
+            for concurrency in CONCURRENT_TURNS:
+                for mode in ("sync on loop", "sync in thread", "async"):
+                    seed(url)
+                    r = asyncio.run(run(mode, url, concurrency))
+                    print(f"{db_name:<9} {mode:<16} {concurrency:>7} {r['turns_s']:>9.1f} "
+                          f"{r['lag_p50_ms']:>11.2f} {r['lag_max_ms']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: logins vs concurrent chat streams, with bcrypt verification on
+the event loop vs on the password pool, as /auth/login and /auth/signup do
+(security.verify_password_async). Also times token validation with and
+without the verified-token cache.
+
+A burst of logins runs while simulated chat streams send a chunk every
+10 ms; reports login throughput and the worst gap between chunks, which is
+what users watching a stream see.
+Run from datagem_backend/:  python -m benchmarks.bench_auth_offload
+(set BCRYPT_ROUNDS to try other cost factors)
+"""
+import asyncio
+import time
+from datetime import timedelta
+
+from jose import jwt
+
+from auth import security
+
+N_LOGINS = 24
+N_STREAMS = 20
+CHUNK_INTERVAL = 0.01
+N_TOKEN_CHECKS = 20000
+
+
+async def stream(stop: asyncio.Event, gaps: list[float]) -> None:
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(CHUNK_INTERVAL)
+        now = time.perf_counter()
+        gaps.append(now - last - CHUNK_INTERVAL)
+        last = now
+
+
+async def login(hashed: str, offloaded: bool) -> bool:
+    if offloaded:
+        return await security.verify_password_async("correct horse", hashed)
+    return security._verify_password("correct horse", hashed)
+
+
+async def run(offloaded: bool, hashed: str) -> dict:
+    stop, gaps = asyncio.Event(), []
+    streams = [asyncio.create_task(stream(stop, gaps)) for _ in range(N_STREAMS)]
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login(hashed, offloaded) for _ in range(N_LOGINS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*streams)
+    assert all(results)
+    gaps.sort()
+    return {
+        "logins_s": N_LOGINS / elapsed,
+        "gap_p99_ms": gaps[int(len(gaps) * 0.99)] * 1000,
+        "gap_max_ms": gaps[-1] * 1000,
+    }
+
+
+def bench_tokens() -> tuple[float, float]:
+    token = security.create_access_token({"sub": "user@datagem.ai"}, expires_delta=timedelta(minutes=30))
+    start = time.perf_counter()
+    for _ in range(N_TOKEN_CHECKS):
+        jwt.decode(token, security.JWT_SECRET_KEY, algorithms=[security.ALGORITHM])
+    uncached = (time.perf_counter() - start) / N_TOKEN_CHECKS
+    start = time.perf_counter()
+    for _ in range(N_TOKEN_CHECKS):
+        security.decode_token_subject(token)
+    cached = (time.perf_counter() - start) / N_TOKEN_CHECKS
+    return uncached * 1e6, cached * 1e6
+
+
+def main():
+    hashed = security._get_password_hash("correct horse")
+    print(f"bcrypt rounds {security.BCRYPT_ROUNDS}, pool of {security.PASSWORD_HASH_WORKERS}; "
+          f"{N_LOGINS} logins during {N_STREAMS} streams (chunk every {CHUNK_INTERVAL * 1000:.0f} ms)")
+    print(f"{'bcrypt':<16} {'logins/s':>9} {'stream gap p99 ms':>18} {'max ms':>8}")
+    for label, offloaded in (("on event loop", False), ("password pool", True)):
+        r = asyncio.run(run(offloaded, hashed))
+        print(f"{label:<16} {r['logins_s']:>9.1f} {r['gap_p99_ms']:>18.1f} {r['gap_max_ms']:>8.1f}")
+    uncached, cached = bench_tokens()
+    print(f"token check: jwt.decode {uncached:.1f} us, verified-token cache {cached:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark: concurrent writers and readers on the old engine setup (defaults
+plus pool_pre_ping) vs the engine profiles in database/profiles.py.
+
+Worker threads run chat turns: read the latest history page, then save a
+message into their conversation (insert + conversation update, one commit).
+Reports turns/s, save and read latency, and failed saves ("database is
+locked" and the like).
+SQLite modes: old defaults (rollback journal), WAL settings only, and WAL
+plus the single-writer engine. Runs on a temporary SQLite file; set
+BENCH_POSTGRES_URL to also compare the old and profiled PostgreSQL pools.
+Run from datagem_backend/:  python -m benchmarks.bench_concurrent_writers
+"""
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import crud, profiles, models as db_models
+from database.database import Base
+
+THREADS = [8, 32]
+TURNS_PER_THREAD = 50
+
+
+def seed(url: str, threads: int) -> None:
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(db_models.User.__table__.insert().values(id=1, email="bench@datagem.ai", hashed_password="x"))
+        conn.execute(db_models.Conversation.__table__.insert(), [{"id": t + 1, "user_id": 1} for t in range(threads)])
+    engine.dispose()
+
+
+def make_sessions(url: str, mode: str):
+    """Session factory and engines for one mode."""
+    if mode == "old defaults":
+        engine = create_engine(url, pool_pre_ping=True)
+        return sessionmaker(bind=engine, autoflush=False), [engine]
+    engine = create_engine(url, **profiles.engine_options(url))
+    profiles.configure_engine(engine)
+    writer = None
+    if mode == "WAL + single writer":
+        writer = create_engine(url, **profiles.writer_engine_options(url))
+        profiles.configure_engine(writer)
+    factory = sessionmaker(bind=engine, autoflush=False, class_=profiles.session_class(writer))
+    return factory, [e for e in (engine, writer) if e is not None]
+
+
+def run(url: str, mode: str, threads: int) -> dict:
+    make_session, engines = make_sessions(url, mode)
+    saves, reads, errors = [], [], []
+    lock = threading.Lock()
+
+    def worker(n: int):
+        conversation_id = n + 1
+        for turn in range(TURNS_PER_THREAD):
+            db = make_session()
+            try:
+                start = time.perf_counter()
+                crud.get_chat_history_page(db, user_id=1, before=None, limit=20, conversation_id=conversation_id)
+                db.rollback()
+                read_done = time.perf_counter()
+                crud.save_chat_message(
+                    db, user_id=1, role="model", content=f"answer {n}-{turn} " * 20, conversation_id=conversation_id
+                )
+                saved = time.perf_counter()
+                with lock:
+                    reads.append(read_done - start)
+                    saves.append(saved - read_done)
+            except Exception as e:
+                db.rollback()
+                with lock:
+                    errors.append(type(e).__name__)
+            finally:
+                db.close()
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    for engine in engines:
+        engine.dispose()
+
+    saves.sort()
+    reads.sort()
+    pct = lambda values, p: values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float("nan")
+    return {
+        "turns_s": len(saves) / elapsed,
+        "save_p50_ms": pct(saves, 0.5),
+        "save_p99_ms": pct(saves, 0.99),
+        "read_p99_ms": pct(reads, 0.99),
+        "errors": len(errors),
+    }
+
+
+def main():
+    targets = []
+    with tempfile.TemporaryDirectory() as tmp:
+        targets.append(("sqlite", f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                        ("old defaults", "WAL", "WAL + single writer")))
+        if os.getenv("BENCH_POSTGRES_URL"):
+            targets.append(("postgres", os.environ["BENCH_POSTGRES_URL"], ("old defaults", "profile")))
+        print(f"{TURNS_PER_THREAD} turns per thread (read a page, save a message)")
+        print(f"{'db':<9} {'mode':<20} {'threads':>7} {'turns/s':>8} {'save p50 ms':>12} "
+              f"{'save p99 ms':>12} {'read p99 ms':>12} {'errors':>7}")
+        for db_name, url, modes in targets:
+            for threads in THREADS:
+                for mode in modes:
+                    seed(url, threads)
+                    r = run(url, mode, threads)
+                    print(f"{db_name:<9} {mode:<20} {threads:>7} {r['turns_s']:>8.0f} {r['save_p50_ms']:>12.2f} "
+                          f"{r['save_p99_ms']:>12.2f} {r['read_p99_ms']:>12.2f} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
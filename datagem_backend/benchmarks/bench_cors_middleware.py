@@ -0,0 +1,138 @@
+"""
+Benchmark: streaming throughput and per-request overhead of the CORS
+middleware, old BaseHTTPMiddleware version vs the pure-ASGI one in cors.py.
+
+Each variant serves (a) a StreamingResponse of many small chunks, as /chat
+does, and (b) a small JSON GET, driven directly over ASGI so no network or
+server overhead is included. Also times the origin check itself.
+Run from datagem_backend/:  python -m benchmarks.bench_cors_middleware
+"""
+import asyncio
+import time
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from cors import CORSOptionsMiddleware, OriginMatcher, CORS_ALLOWED_ORIGINS
+
+N_CHUNKS = 5000
+CHUNK = b"x" * 256
+N_SMALL_REQUESTS = 2000
+ORIGIN = "https://datagemakshit.vercel.app"
+
+
+class OldCORSOptionsMiddleware(BaseHTTPMiddleware):
+    """The previous main.py middleware (startswith chain per request)."""
+
+    async def dispatch(self, request: Request, call_next):
+        origin = request.headers.get("origin", "")
+        is_allowed = (
+            origin.endswith(".vercel.app") or
+            origin.startswith("http://localhost:") or
+            origin.startswith("http://127.0.0.1:") or
+            origin.startswith("http://192.168.") or
+            origin.startswith("http://10.") or
+            origin.startswith("http://172.")
+        )
+        if request.method == "OPTIONS":
+            response = Response()
+            response.headers["Access-Control-Allow-Origin"] = origin if is_allowed else "https://datagemakshit.vercel.app"
+            return response
+        response = await call_next(request)
+        if is_allowed:
+            response.headers["Access-Control-Allow-Origin"] = origin
+            response.headers["Access-Control-Allow-Credentials"] = "true"
+            response.headers["Cache-Control"] = "no-cache"
+            response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+
+def make_app(middleware) -> FastAPI:
+    app = FastAPI()
+    if middleware is not None:
+        app.add_middleware(middleware)
+
+    @app.get("/stream")
+    async def stream():
+        async def body():
+            for _ in range(N_CHUNKS):
+                yield CHUNK
+        return StreamingResponse(body(), media_type="text/plain")
+
+    @app.get("/small")
+    async def small():
+        return {"status": "ok"}
+
+    return app
+
+
+async def request(app, path: str) -> tuple[int, int]:
+    """Run one GET over ASGI; returns (body messages, body bytes)."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "headers": [(b"origin", ORIGIN.encode())], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    finished = asyncio.Event()
+    request_sent = False
+    counts = [0, 0]
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            counts[0] += 1
+            counts[1] += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return counts[0], counts[1]
+
+
+async def run(app) -> dict:
+    start = time.perf_counter()
+    _, nbytes = await request(app, "/stream")
+    stream_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(N_SMALL_REQUESTS):
+        await request(app, "/small")
+    small_s = time.perf_counter() - start
+    return {"mb_s": nbytes / stream_s / 1e6, "stream_ms": stream_s * 1000, "small_us": small_s / N_SMALL_REQUESTS * 1e6}
+
+
+def bench_matcher():
+    origins = [ORIGIN, "http://localhost:5173", "http://192.168.1.20:3000", "http://evil.example"] * 25000
+    matcher = OriginMatcher(CORS_ALLOWED_ORIGINS)
+    start = time.perf_counter()
+    for origin in origins:
+        matcher(origin)
+    return (time.perf_counter() - start) / len(origins) * 1e9
+
+
+def main():
+    print(f"stream: {N_CHUNKS} x {len(CHUNK)} B chunks; small: {N_SMALL_REQUESTS} JSON GETs")
+    print(f"{'middleware':<28} {'stream MB/s':>12} {'stream ms':>10} {'small GET us':>13}")
+    for label, middleware in (
+        ("none", None),
+        ("BaseHTTPMiddleware (old)", OldCORSOptionsMiddleware),
+        ("pure ASGI (cors.py)", CORSOptionsMiddleware),
+    ):
+        app = make_app(middleware)
+        asyncio.run(run(app))  # warm-up
+        runs = [asyncio.run(run(app)) for _ in range(3)]
+        r = {key: (max if key == "mb_s" else min)(run_[key] for run_ in runs) for key in runs[0]}
+        print(f"{label:<28} {r['mb_s']:>12.1f} {r['stream_ms']:>10.1f} {r['small_us']:>13.1f}")
+    print(f"origin check (cached): {bench_matcher():.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
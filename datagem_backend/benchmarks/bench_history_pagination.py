@@ -0,0 +1,131 @@
+"""
+Benchmark: chat history queries at 1M rows, without and with the
+(user_id, timestamp, id) index, and deep pages with OFFSET vs keyset
+pagination (crud.get_chat_history_page).
+
+Most rows belong to one user, like the shared anonymous user in /chat.
+Prints the query plan and median latency of each query. Runs on a
+temporary SQLite file; set BENCH_POSTGRES_URL to also run against
+PostgreSQL (the tables there are dropped and recreated).
+Run from datagem_backend/:  python -m benchmarks.bench_history_pagination
+"""
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from database import crud, models as db_models
+from database.database import Base
+
+N_ROWS = 1_000_000
+N_USERS = 20
+MAIN_USER_SHARE = 0.9  # share of rows owned by user 1
+PAGE = 50
+DEEP_PAGE = 10_000  # page number for the "deep" queries
+INDEX_NAME = "ix_chat_history_user_timestamp"
+
+
+def seed(engine) -> None:
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(db_models.User), [
+            {"id": i, "email": f"user{i}@datagem.ai", "hashed_password": "x"} for i in range(1, N_USERS + 1)
+        ])
+        batch = []
+        for i in range(N_ROWS):
+            user_id = 1 if i % 10 < MAIN_USER_SHARE * 10 else 2 + i % (N_USERS - 1)
+            batch.append({
+                "user_id": user_id,
+                "role": "user" if i % 2 == 0 else "model",
+                "content": f"message {i} about revenue by region",
+                "timestamp": start + timedelta(seconds=i),
+            })
+            if len(batch) == 50_000:
+                conn.execute(insert(db_models.ChatHistory), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(db_models.ChatHistory), batch)
+
+
+def explain(engine, sql: str) -> str:
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql)).fetchall()
+            return " | ".join(row[-1] for row in rows)
+        rows = conn.execute(text("EXPLAIN " + sql)).fetchall()
+        return " | ".join(row[0].strip() for row in rows[:3])
+
+
+def timed(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def run(engine, label: str, repeats: int) -> None:
+    db = sessionmaker(bind=engine)()
+    ChatHistory = db_models.ChatHistory
+    order = (ChatHistory.timestamp.desc(), ChatHistory.id.desc())
+    depth = DEEP_PAGE * PAGE
+    # Cursor for the deep keyset page: the last row of the page before it
+    cursor = (
+        db.query(ChatHistory.id).filter(ChatHistory.user_id == 1)
+        .order_by(*order).offset(depth - 1).limit(1).scalar()
+    )
+
+    queries = {
+        "latest page": lambda: crud.get_chat_history(db, user_id=1, limit=PAGE),
+        f"page {DEEP_PAGE} OFFSET": lambda: (
+            db.query(ChatHistory).filter(ChatHistory.user_id == 1)
+            .order_by(*order).offset(depth).limit(PAGE).all()
+        ),
+        f"page {DEEP_PAGE} keyset": lambda: crud.get_chat_history_page(db, user_id=1, before=cursor, limit=PAGE),
+    }
+    sql = {
+        "latest page": f"SELECT * FROM chat_history WHERE user_id = 1 ORDER BY timestamp DESC, id DESC LIMIT {PAGE}",
+        f"page {DEEP_PAGE} OFFSET": f"SELECT * FROM chat_history WHERE user_id = 1 "
+                                    f"ORDER BY timestamp DESC, id DESC LIMIT {PAGE} OFFSET {depth}",
+        f"page {DEEP_PAGE} keyset": f"SELECT * FROM chat_history WHERE user_id = 1 AND (timestamp, id) < "
+                                    f"(SELECT timestamp, id FROM chat_history WHERE id = {cursor} AND user_id = 1) "
+                                    f"ORDER BY timestamp DESC, id DESC LIMIT {PAGE}",
+    }
+    for name, fn in queries.items():
+        fn()  # warm the cache
+        ms = timed(fn, repeats)
+        print(f"  {label:<10} {name:<20} {ms:>9.2f} ms   {explain(engine, sql[name])}")
+    db.close()
+
+
+def bench(name: str, url: str) -> None:
+    engine = create_engine(url)
+    print(f"{name}: seeding {N_ROWS:,} rows ...")
+    seed(engine)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX {INDEX_NAME}"))
+        conn.execute(text("ANALYZE"))
+    run(engine, "no index", repeats=3)
+    with engine.begin() as conn:
+        next(i for i in db_models.ChatHistory.__table__.indexes if i.name == INDEX_NAME).create(conn)
+        conn.execute(text("ANALYZE"))
+    run(engine, "index", repeats=20)
+    engine.dispose()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        bench("sqlite", f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+    if os.getenv("BENCH_POSTGRES_URL"):
+        bench("postgres", os.environ["BENCH_POSTGRES_URL"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark: history pages with large messages stored inline in
+chat_history.content (the old layout) vs split into message_blobs
+(database/blob_store.py).
+
+Every other model answer carries a base64 plot. Reports the time to read a
+page of history, the bytes it transfers, and the time to open one message
+with its full content.
+Runs on a temporary SQLite file; set BENCH_POSTGRES_URL to also run
+against PostgreSQL.
+Run from datagem_backend/:  python -m benchmarks.bench_message_blobs
+"""
+import os
+import random
+import string
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import blob_store, crud, models as db_models
+from database.database import Base
+
+N_MESSAGES = 4000
+PLOT_CHARS = 60_000
+PAGE_SIZE = 50
+N_PAGES = 200
+
+
+def fake_plot() -> str:
+    return "PLOT_IMG_BASE64:" + "".join(random.choices(string.ascii_letters + string.digits, k=PLOT_CHARS))
+
+
+def seed(url: str, split: bool) -> sessionmaker:
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    make_session = sessionmaker(bind=engine, autoflush=False)
+    with make_session() as db:
+        db.add(db_models.User(id=1, email="bench@datagem.ai", hashed_password="x"))
+        for n in range(N_MESSAGES):
+            role = "user" if n % 2 == 0 else "model"
+            content = f"message {n} " * 20
+            if n % 4 == 1:
+                content += "\n" + fake_plot()
+            if split:
+                message, blob = blob_store.prepare_message(1, role, content)
+                if blob is not None:
+                    blob_store.save_blobs(db, [blob])
+            else:
+                message = db_models.ChatHistory(user_id=1, role=role, content=content)
+            db.add(message)
+        db.commit()
+    return make_session
+
+
+def run(make_session: sessionmaker) -> dict:
+    start = time.perf_counter()
+    transferred = 0
+    with make_session() as db:
+        before = None
+        for _ in range(N_PAGES):
+            rows = crud.get_chat_history_page(db, user_id=1, before=before, limit=PAGE_SIZE)
+            transferred += sum(len(row.content) for row in rows)
+            before = rows[-1].id if len(rows) == PAGE_SIZE else None
+            db.expunge_all()
+    page_ms = (time.perf_counter() - start) / N_PAGES * 1000
+
+    with make_session() as db:
+        message = crud.get_chat_message(db, user_id=1, message_id=2)
+        start = time.perf_counter()
+        content = crud.get_message_content(db, message)
+        open_ms = (time.perf_counter() - start) * 1000
+    assert content.startswith("message 1 ")
+    return {"page_ms": page_ms, "page_kb": transferred / N_PAGES / 1024, "open_ms": open_ms}
+
+
+def main():
+    random.seed(7)
+    targets = []
+    with tempfile.TemporaryDirectory() as tmp:
+        targets.append(("sqlite", f"sqlite:///{os.path.join(tmp, 'bench.db')}"))
+        if os.getenv("BENCH_POSTGRES_URL"):
+            targets.append(("postgres", os.environ["BENCH_POSTGRES_URL"]))
+        print(f"{N_MESSAGES} messages, a {PLOT_CHARS // 1000} kB plot in every 4th; pages of {PAGE_SIZE}")
+        print(f"{'db':<9} {'layout':<8} {'page ms':>8} {'page kB':>8} {'open msg ms':>12}")
+        for db_name, url in targets:
+            for layout, split in (("inline", False), ("blobs", True)):
+                r = run(seed(url, split))
+                print(f"{db_name:<9} {layout:<8} {r['page_ms']:>8.2f} {r['page_kb']:>8.1f} {r['open_ms']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
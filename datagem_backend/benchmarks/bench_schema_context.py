@@ -0,0 +1,68 @@
+"""
+Benchmark: per-question cost and prompt size of the dataset context block.
+
+Compares the old approach (every column name in the prompt, numeric check
+over every column) with schema_context.SchemaIndex on a wide dataset.
+Run from datagem_backend/:  python -m benchmarks.bench_schema_context
+"""
+import random
+import time
+
+from chat import schema_context
+
+N_COLUMNS = 400
+N_ROWS = 5000
+QUESTIONS = [
+    "plot the distribution of customer_age",
+    "what is the correlation between revenue and marketing spend?",
+    "show churn rate by region",
+    "summarize the dataset",
+]
+
+
+def make_dataset():
+    random.seed(7)
+    words = ["customer", "age", "revenue", "region", "churn", "spend", "marketing", "score",
+             "visits", "orders", "returns", "tenure", "plan", "discount", "rating", "device"]
+    columns = [f"{random.choice(words)}_{random.choice(words)}_{i}" for i in range(N_COLUMNS - 4)]
+    columns += ["customer_age", "revenue", "marketing_spend", "region"]
+    rows = []
+    for r in range(N_ROWS):
+        row = {col: (random.random() * 100 if i % 3 else f"cat{r % 7}") for i, col in enumerate(columns)}
+        rows.append(row)
+    return rows
+
+
+def old_context(dataset, prompt):
+    columns = list(dataset[0].keys())
+    numeric_cols = []
+    for col in columns:
+        sample_values = [dataset[i].get(col, '') for i in range(min(5, len(dataset)))]
+        numeric_count = sum(1 for v in sample_values if isinstance(v, (int, float)) or (isinstance(v, str) and v.replace('.', '').replace('-', '').isdigit()))
+        if numeric_count >= 2:
+            numeric_cols.append(col)
+    return (f"- {len(dataset)} rows, {len(columns)} columns\n- All columns: {', '.join(columns)}\n"
+            f"- Numeric columns: {', '.join(numeric_cols)}")
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return (time.perf_counter() - start) / repeat * 1000, out
+
+
+def main():
+    dataset = make_dataset()
+    start = time.perf_counter()
+    index = schema_context.SchemaIndex(dataset)
+    print(f"SchemaIndex build: {(time.perf_counter() - start) * 1000:.2f} ms (once per dataset)")
+    print(f"{'question':<62} {'old ms':>8} {'old chars':>10} {'new ms':>8} {'new chars':>10}")
+    for q in QUESTIONS:
+        old_ms, old_text = timed(lambda: old_context(dataset, q))
+        new_ms, new_text = timed(lambda: index.describe(q))
+        print(f"{q:<62} {old_ms:>8.2f} {len(old_text):>10} {new_ms:>8.2f} {len(new_text):>10}")
+
+
+if __name__ == "__main__":
+    main()
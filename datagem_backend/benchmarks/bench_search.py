@@ -0,0 +1,118 @@
+"""
+Benchmark: chat history search with the full-text index
+(database/search.py) vs an unranked LIKE scan of chat_history.content, and
+the insert cost with the index maintained by triggers.
+
+Seeds BENCH_SEARCH_MESSAGES synthetic messages (default 200k) spread over
+a few users, then times ranked searches for rare, medium and common terms
+(first page and tenth page).
+Runs on a temporary SQLite file (FTS5); set BENCH_POSTGRES_URL to also run
+against PostgreSQL (tsvector + GIN).
+Run from datagem_backend/:  python -m benchmarks.bench_search
+"""
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from database import crud, models as db_models, search
+from database.database import Base
+
+N_MESSAGES = int(os.getenv("BENCH_SEARCH_MESSAGES", "200000"))
+N_USERS = 10
+BATCH = 10_000
+N_QUERIES = 20
+PAGE_SIZE = 20
+
+COMMON = "data column value table rows average total result plot chart".split()
+# A few hundred less common words, each in a few percent of the messages
+VOCAB = "revenue region customer monthly growth forecast segment cohort compute".split() + [
+    f"metric{n}" for n in range(300)
+]
+RARE = "churn seasonality heteroscedasticity".split()
+QUERIES = {
+    "rare": "where did I compute churn by region?",
+    "medium": "monthly revenue growth",
+    "common": "average value per column",
+    "no all": "churn forecast heteroscedasticity",  # no message has all three
+}
+
+
+def sentence(rng: random.Random) -> str:
+    words = rng.choices(COMMON, k=8) + rng.choices(VOCAB, k=8)
+    if rng.random() < 0.002:
+        words.append(rng.choice(RARE))
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def seed(url: str) -> tuple:
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS chat_history_fts"))
+            conn.execute(text("DROP VIEW IF EXISTS chat_history_fts_source"))
+    Base.metadata.create_all(engine)
+    search.ensure_search_index(engine)
+    rng = random.Random(7)
+    table = db_models.ChatHistory.__table__
+    with engine.begin() as conn:
+        conn.execute(db_models.User.__table__.insert(), [
+            {"id": u, "email": f"bench{u}@datagem.ai", "hashed_password": "x"} for u in range(1, N_USERS + 1)
+        ])
+    start = time.perf_counter()
+    for first in range(0, N_MESSAGES, BATCH):
+        rows = [
+            {"user_id": 1 + n % N_USERS, "role": "model" if n % 2 else "user", "content": sentence(rng)}
+            for n in range(first, min(first + BATCH, N_MESSAGES))
+        ]
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+    insert_us = (time.perf_counter() - start) / N_MESSAGES * 1e6
+    return engine, insert_us
+
+
+def time_query(engine, fn) -> tuple[float, int]:
+    with Session(engine) as db:
+        fn(db)  # warm up
+        start = time.perf_counter()
+        for _ in range(N_QUERIES):
+            hits = fn(db)
+        return (time.perf_counter() - start) / N_QUERIES * 1000, len(hits)
+
+
+def like_scan(db, query: str):
+    terms = search.query_terms(query)
+    clause = " OR ".join(f"content LIKE :t{i}" for i in range(len(terms)))
+    params = {f"t{i}": f"%{term}%" for i, term in enumerate(terms)}
+    sql = f"SELECT id, content FROM chat_history WHERE user_id = 1 AND ({clause}) ORDER BY id DESC LIMIT {PAGE_SIZE}"
+    return db.execute(text(sql), params).all()
+
+
+def main():
+    targets = []
+    with tempfile.TemporaryDirectory() as tmp:
+        targets.append(("sqlite", f"sqlite:///{os.path.join(tmp, 'bench.db')}"))
+        if os.getenv("BENCH_POSTGRES_URL"):
+            targets.append(("postgres", os.environ["BENCH_POSTGRES_URL"]))
+        print(f"{N_MESSAGES} messages over {N_USERS} users; searching one user, pages of {PAGE_SIZE}")
+        for db_name, url in targets:
+            engine, insert_us = seed(url)
+            print(f"{db_name} ({search.SEARCH_BACKEND}): {insert_us:.1f} us per inserted message (index included)")
+            print(f"{'query':<8} {'index ms':>9} {'hits':>5} {'page 10 ms':>11} {'LIKE ms':>9}")
+            for label, query in QUERIES.items():
+                indexed, hits = time_query(engine, lambda db: crud.search_chat_messages(db, 1, query, limit=PAGE_SIZE))
+                deep, _ = time_query(
+                    engine, lambda db: crud.search_chat_messages(db, 1, query, limit=PAGE_SIZE, offset=9 * PAGE_SIZE)
+                )
+                scan, _ = time_query(engine, lambda db: like_scan(db, query))
+                print(f"{label:<8} {indexed:>9.2f} {hits:>5} {deep:>11.2f} {scan:>9.2f}")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark: ASGI messages and CPU per streamed answer, with and without
+stream_coalescer.coalesce().
+
+A simulated Gemini answer (small text fragments arriving in bursts, with a
+code block in the middle) is streamed through a FastAPI StreamingResponse
+behind a BaseHTTPMiddleware, like /chat. Reports body messages per
+response, CPU per stream and the delay coalescing adds between a fragment
+being produced and its bytes being sent.
+Run from datagem_backend/:  python -m benchmarks.bench_stream_coalescing
+"""
+import asyncio
+import random
+import statistics
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from chat import stream_coalescer, stream_events
+
+N_STREAMS = 20
+N_FRAGMENTS = 1500
+# Share of fragments that arrive after a network gap (the rest come in the same read)
+GAP_PROBABILITY = 0.2
+GAP_SECONDS = (0.005, 0.04)
+
+
+class PassthroughMiddleware(BaseHTTPMiddleware):
+    """Same shape as the CORS middleware in main.py: call_next, then add headers."""
+
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+def make_script(seed: int) -> list[tuple[float, str]]:
+    rng = random.Random(seed)
+    words = ["the", "revenue", "column", "is", "strongly", "correlated", "with", "spend", "and", "region"]
+    script = []
+    for i in range(N_FRAGMENTS):
+        gap = rng.uniform(*GAP_SECONDS) if rng.random() < GAP_PROBABILITY else 0.0
+        if i == N_FRAGMENTS // 2:
+            script.append((gap, "\n```python\nprint(df.corr())\n```\n"))
+        else:
+            script.append((gap, " " + rng.choice(words)))
+    return script
+
+
+async def fake_agent(script, produced_at: list[float]):
+    for gap, delta in script:
+        if gap:
+            await asyncio.sleep(gap)
+        else:
+            await asyncio.sleep(0)
+        produced_at.append(time.perf_counter())
+        yield stream_events.text(delta)
+
+
+def make_app(coalesced: bool, scripts: dict, produced: dict) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(PassthroughMiddleware)
+
+    @app.get("/stream/{stream_id}")
+    async def stream(stream_id: int):
+        events = fake_agent(scripts[stream_id], produced[stream_id])
+        if coalesced:
+            events = stream_coalescer.coalesce(events)
+
+        async def body():
+            async for event in events:
+                yield stream_events.to_markdown(event)
+
+        return StreamingResponse(body(), media_type="text/plain")
+
+    return app
+
+
+async def run_stream(app, stream_id: int, sent: dict, messages: dict):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": f"/stream/{stream_id}", "raw_path": f"/stream/{stream_id}".encode(),
+        "query_string": b"", "headers": [], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    disconnect = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            messages[stream_id] += 1
+            body = message.get("body", b"")
+            if body:
+                sent[stream_id].append((time.perf_counter(), len(body.decode("utf-8"))))
+            if not message.get("more_body", False):
+                disconnect.set()
+
+    await app(scope, receive, send)
+
+
+def added_delays(produced_at: list[float], sent_log: list[tuple[float, int]], script) -> list[float]:
+    """Delay between each fragment being produced and the message carrying its last character."""
+    delays = []
+    produced_chars = 0
+    sent_index, sent_chars = 0, sent_log[0][1]
+    for produced, (_, delta) in zip(produced_at, script):
+        produced_chars += len(delta)
+        while sent_chars < produced_chars:
+            sent_index += 1
+            sent_chars += sent_log[sent_index][1]
+        delays.append(max(0.0, sent_log[sent_index][0] - produced))
+    return delays
+
+
+async def run(coalesced: bool) -> dict:
+    scripts = {i: make_script(i) for i in range(N_STREAMS)}
+    produced = {i: [] for i in range(N_STREAMS)}
+    sent = {i: [] for i in range(N_STREAMS)}
+    messages = {i: 0 for i in range(N_STREAMS)}
+    app = make_app(coalesced, scripts, produced)
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(run_stream(app, i, sent, messages) for i in range(N_STREAMS)))
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+    delays = []
+    for i in range(N_STREAMS):
+        delays += added_delays(produced[i], sent[i], scripts[i])
+    delays.sort()
+    return {
+        "messages": statistics.mean(messages.values()),
+        "cpu_ms": cpu / N_STREAMS * 1000,
+        "wall_s": wall,
+        "p50_ms": delays[len(delays) // 2] * 1000,
+        "p99_ms": delays[int(len(delays) * 0.99)] * 1000,
+        "max_ms": delays[-1] * 1000,
+    }
+
+
+def main():
+    print(f"{N_STREAMS} concurrent streams x {N_FRAGMENTS} fragments, "
+          f"window {stream_coalescer.STREAM_COALESCE_WINDOW_MS:.0f} ms, "
+          f"max {stream_coalescer.STREAM_COALESCE_MAX_CHARS} chars")
+    print(f"{'mode':<12} {'msgs/resp':>10} {'CPU ms/stream':>14} {'wall s':>8} "
+          f"{'delay p50 ms':>13} {'p99 ms':>8} {'max ms':>8}")
+    for label, coalesced in (("per-token", False), ("coalesced", True)):
+        r = asyncio.run(run(coalesced))
+        print(f"{label:<12} {r['messages']:>10.0f} {r['cpu_ms']:>14.1f} {r['wall_s']:>8.2f} "
+              f"{r['p50_ms']:>13.2f} {r['p99_ms']:>8.2f} {r['max_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
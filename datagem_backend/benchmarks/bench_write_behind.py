@@ -0,0 +1,118 @@
+"""
+Benchmark: chat message persistence under load, one commit per message
+(async_crud.save_chat_message) vs the write-behind queue
+(database/write_behind.py) with and without durable ack.
+
+Concurrent workers run chat turns (save the prompt, wait for the "model",
+save the answer). Reports messages/s, commits/s and commits per message,
+and how long callers wait for a save.
+Runs on a temporary SQLite file; set BENCH_POSTGRES_URL to also run
+against PostgreSQL (needs asyncpg).
+Run from datagem_backend/:  python -m benchmarks.bench_write_behind
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database import async_crud, models as db_models
+from database.async_database import to_async_url
+from database.database import Base
+from database.write_behind import WriteBehindQueue
+
+WORKERS = [16, 64]
+TURNS_PER_WORKER = 20
+MODEL_SECONDS = 0.01
+FLUSH_MS = 20
+
+
+def seed(url: str) -> None:
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(db_models.User.__table__.insert().values(id=1, email="bench@datagem.ai", hashed_password="x"))
+    engine.dispose()
+
+
+async def run(mode: str, url: str, workers: int) -> dict:
+    options = {} if url.startswith("sqlite") else {"pool_size": workers, "max_overflow": 0}
+    engine = create_async_engine(to_async_url(url), **options)
+    commits = [0]
+    event.listen(engine.sync_engine, "commit", lambda conn: commits.__setitem__(0, commits[0] + 1))
+    make_session = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+    queue = None
+    if mode != "per-message commit":
+        queue = WriteBehindQueue(
+            async_session_factory=make_session,
+            flush_interval=FLUSH_MS / 1000,
+            durable_ack=mode == "write-behind durable",
+        )
+        queue.start()
+    waits = []
+
+    async def save(role: str, content: str):
+        start = time.perf_counter()
+        if queue is not None:
+            await queue.save(1, role, content)
+        else:
+            async with make_session() as db:
+                await async_crud.save_chat_message(db, user_id=1, role=role, content=content)
+        waits.append(time.perf_counter() - start)
+
+    async def worker(w: int):
+        for n in range(TURNS_PER_WORKER):
+            await save("user", f"question {w}-{n}")
+            await asyncio.sleep(MODEL_SECONDS)
+            await save("model", f"answer {w}-{n} " * 20)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(workers)))
+    if queue is not None:
+        await queue.stop()
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+
+    messages = workers * TURNS_PER_WORKER * 2
+    waits.sort()
+    return {
+        "msgs_s": messages / elapsed,
+        "commits_s": commits[0] / elapsed,
+        "commits_per_msg": commits[0] / messages,
+        "wait_p50_ms": waits[len(waits) // 2] * 1000,
+        "wait_p99_ms": waits[int(len(waits) * 0.99)] * 1000,
+    }
+
+
+def stored_messages(url: str) -> int:
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        count = conn.execute(select(func.count()).select_from(db_models.ChatHistory)).scalar()
+    engine.dispose()
+    return count
+
+
+def main():
+    targets = []
+    with tempfile.TemporaryDirectory() as tmp:
+        targets.append(("sqlite", f"sqlite:///{os.path.join(tmp, 'bench.db')}"))
+        if os.getenv("BENCH_POSTGRES_URL"):
+            targets.append(("postgres", os.environ["BENCH_POSTGRES_URL"]))
+        print(f"{TURNS_PER_WORKER} turns per worker, {MODEL_SECONDS * 1000:.0f} ms model time, flush {FLUSH_MS} ms")
+        print(f"{'db':<9} {'mode':<24} {'workers':>7} {'msgs/s':>8} {'commits/s':>10} "
+              f"{'commits/msg':>12} {'wait p50 ms':>12} {'p99 ms':>8}")
+        for db_name, url in targets:
+            for workers in WORKERS:
+                for mode in ("per-message commit", "write-behind durable", "write-behind no-ack"):
+                    seed(url)
+                    r = asyncio.run(run(mode, url, workers))
+                    assert stored_messages(url) == workers * TURNS_PER_WORKER * 2, "messages lost"
+                    print(f"{db_name:<9} {mode:<24} {workers:>7} {r['msgs_s']:>8.0f} {r['commits_s']:>10.1f} "
+                          f"{r['commits_per_msg']:>12.3f} {r['wait_p50_ms']:>12.2f} {r['wait_p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,30 @@
+import asyncio
+import json
 import os
+import threading
 import time
 from typing import List, Optional
 
 from google import genai
 from google.genai import types as genai_types
 from PIL.Image import Image
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import traceback
 
 # Internal imports
-from database import crud, models as db_models
+from database import async_crud, crud, history_index, write_behind, models as db_models
+from database.database import SessionLocal
 from chat import models as chat_models
+from chat import context_cache
+from chat import intent
+from chat import metrics
+from chat import model_router
+from chat import output_condenser
+from chat import output_postprocessor
+from chat import response_cache
+from chat import schema_context
+from chat import stream_events
 from chat import tools
 
 Tool = genai_types.Tool
@@ -20,6 +34,7 @@ ToolConfig = genai_types.ToolConfig
 FunctionCallingConfig = genai_types.FunctionCallingConfig
 Content = genai_types.Content
 Part = genai_types.Part
+FunctionResponse = genai_types.FunctionResponse
 
 """
 GEMINI API KEY CONFIGURATION (google.genai)
@@ -85,6 +100,53 @@ def _try_switch_gemini_key() -> bool:
 _configure_gemini_client(CURRENT_KEY_INDEX)
 
 
+# =====================
+# HISTORY CONTEXT CONFIGURATION
+# =====================
+# Each turn sends the last few messages plus the earlier messages that are
+# most relevant to the new question, instead of a fixed "last 50" window.
+HISTORY_RECENT_MESSAGES = int(os.getenv("HISTORY_RECENT_MESSAGES", "6"))
+HISTORY_RELEVANT_TOP_K = int(os.getenv("HISTORY_RELEVANT_TOP_K", "4"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+
+
+# =====================
+# TOOL LOOP CONFIGURATION
+# =====================
+# Maximum model calls per data-analysis turn. The last allowed step is forced
+# to answer in text, so at least one tool step plus the answer is needed.
+AGENT_MAX_TOOL_STEPS = max(2, int(os.getenv("AGENT_MAX_TOOL_STEPS", "4")))
+# Tool calls of one turn that may run at the same time (one sandbox process
+# each); the limit is per turn, so a turn with many calls can't hold back others
+TOOL_MAX_PARALLEL = max(1, int(os.getenv("TOOL_MAX_PARALLEL", "4")))
+# Seconds between keep-alive heartbeats while sandbox code is running
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "10"))
+# Automatic fixes for crashing generated code, per turn
+CODE_REPAIR_MAX_ATTEMPTS = int(os.getenv("CODE_REPAIR_MAX_ATTEMPTS", "2"))
+CODE_REPAIR_TIME_BUDGET = float(os.getenv("CODE_REPAIR_TIME_BUDGET", "90"))
+
+
+def _event_parts(event) -> list:
+    """All content parts of a streamed chunk (empty for metadata-only chunks)."""
+    parts = []
+    for candidate in getattr(event, "candidates", None) or []:
+        content = getattr(candidate, "content", None)
+        if content and content.parts:
+            parts.extend(content.parts)
+    return parts
+
+
+# Marker appended to a reply that was cut short because the client went away
+TRUNCATED_MARKER = "\n\n_(response truncated: the client disconnected before it finished)_"
+
+_STREAM_END = object()
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)."""
+    return len(text or "") // 4 + 1
+
+
 # =====================
 # TOOL DEFINITIONS
 # =====================
@@ -190,6 +252,8 @@ google_search_tool_schema = Tool(
     ]
 )
 
+TOOL_DECLARATIONS = [run_python_tool_schema, google_search_tool_schema]
+
 
 # =====================
 # MAIN AGENT CLASS
@@ -198,12 +262,37 @@ google_search_tool_schema = Tool(
 class DataAnalystAgent:
     """Main DataGem AI Agent that handles Gemini interaction, tool calls, and chat history."""
 
-    def __init__(self, db: Session, user: db_models.User, dataset: list[dict] | None = None):
+    def __init__(
+        self,
+        db: Session | AsyncSession,
+        user: db_models.User,
+        dataset: list[dict] | None = None,
+        use_cache: bool = True,
+        cancel_event: threading.Event | None = None,
+        conversation_id: int | None = None,
+    ):
         self.db = db
         self.user = user
+        # History (context and saved messages) is scoped to this conversation
+        self.conversation_id = conversation_id
         self.dataset = dataset
+        self.use_cache = use_cache  # False skips response-cache reads (client opt-out)
+        self._fingerprint: Optional[str] = None
+        self._cacheable = True
+        self._response_text = ""
+        self._schema_index: Optional[schema_context.SchemaIndex] = None
+        self._use_context_cache = True
+        self._context_cache_name: Optional[str] = None
+        # True when the analysis prompt left the full schema to the cached prefix
+        self._schema_in_prefix = False
+        self._tools_executed = False
+        # Set once the turn's final answer has been handed to the database
+        self._final_save_started = False
+        # Set (e.g. by the /chat endpoint on client disconnect) to stop the turn
+        self.cancel_event = cancel_event or threading.Event()
+        self._turn_started = time.monotonic()
         self.client: Optional[genai.Client] = GENAI_CLIENT
-        self.model_name: str = "gemini-2.5-flash-lite"
+        self.model_name: str = model_router.ROUTER.pick("code")  # chosen per call by the router
         self.chat = None  # kept for backward compatibility (no longer used as a GenerativeModel chat)
         self.text_model = None  # no longer a separate model instance; we use config instead
         self._system_instruction = None
@@ -282,6 +371,16 @@ TEXT SUMMARY REQUIREMENTS:
 - NO redundancy - don't repeat information already shown in code output
 - Be direct and efficient - users want answers fast
 
+AFTER A TOOL RUNS:
+- Tool results come back to you as function responses in this conversation
+- You may call run_python_code again if you need more information (e.g. inspect first, then plot)
+- Once you have what you need, answer in text: first answer the question directly in 1-2 sentences
+- Then 3-5 concise bullet-point insights, each grounded in specific values from the output
+- When the user asks for "all columns", "unique values", etc., include a markdown table with proper headers
+- If a plot was produced, add a brief **Visualization:** line describing what it shows
+- If a model was trained, mention its target, main features and key metrics; do NOT repeat MODEL_FILE paths
+- If the code failed, briefly explain the error and suggest 1-2 next steps
+
 VISUALIZATION REQUIREMENTS:
 - ALWAYS create visualizations when asked
 - Use clear, informative titles and labels
@@ -338,49 +437,252 @@ CODE REQUIREMENTS:
             })
         return gemini_history
 
+    # ------------------------------------------------------------------
+    async def build_history_context(self, query: str) -> list[dict]:
+        """
+        Assemble the history sent with a turn: the most recent messages plus
+        the top-k earlier messages ranked by BM25 against `query`, kept
+        within HISTORY_TOKEN_BUDGET. Returned oldest first, Gemini format.
+        """
+        user_id = self.user.id
+        await write_behind.read_barrier()
+        recent = await async_crud.call(
+            "get_chat_history",
+            self.db,
+            user_id=user_id,
+            limit=HISTORY_RECENT_MESSAGES + 1,
+            conversation_id=self.conversation_id,
+        )
+
+        # The prompt for this turn is already saved; it is sent separately
+        exclude_ids = set()
+        if recent and recent[0].role == "user" and recent[0].content == query:
+            exclude_ids.add(recent[0].id)
+            recent = recent[1:]
+        recent = recent[:HISTORY_RECENT_MESSAGES]
+        exclude_ids.update(msg.id for msg in recent)
+
+        index_key = history_index.scope(user_id, self.conversation_id)
+        if not history_index.is_indexed(index_key):
+            all_messages = await async_crud.call(
+                "get_all_chat_messages",
+                self.db,
+                user_id=user_id,
+                conversation_id=self.conversation_id,
+                limit=history_index.HISTORY_INDEX_MAX_MESSAGES,
+            )
+            await asyncio.to_thread(history_index.build_user_index, index_key, all_messages)
+        relevant_ids = history_index.search(index_key, query, top_k=HISTORY_RELEVANT_TOP_K, exclude=exclude_ids)
+        relevant_messages = await async_crud.call(
+            "get_chat_messages_by_ids", self.db, user_id=user_id, message_ids=relevant_ids
+        )
+        relevant_by_id = {msg.id: msg for msg in relevant_messages}
+
+        # Spend the budget on recent turns first (newest to oldest), then on
+        # relevant earlier turns in rank order.
+        selected = []
+        budget = HISTORY_TOKEN_BUDGET
+        candidates = list(recent) + [relevant_by_id[i] for i in relevant_ids if i in relevant_by_id]
+        for msg in candidates:
+            cost = _estimate_tokens(msg.content)
+            if cost > budget:
+                continue
+            budget -= cost
+            selected.append(msg)
+
+        selected.sort(key=lambda msg: (msg.timestamp is None, msg.timestamp, msg.id), reverse=True)
+        print(f"🧠 History context: {len(selected)} messages ({HISTORY_TOKEN_BUDGET - budget} est. tokens)")
+        return self.convert_db_history_to_gemini(selected)
+
+    async def _has_earlier_history(self) -> bool:
+        """True when the history context holds messages besides this turn's prompt."""
+        await write_behind.read_barrier()
+        recent = await async_crud.call(
+            "get_chat_history", self.db, user_id=self.user.id, limit=2, conversation_id=self.conversation_id
+        )
+        return len(recent) > 1
+
+    # ------------------------------------------------------------------
+    def _dataset_fingerprint(self) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = response_cache.dataset_fingerprint(self.dataset)
+        return self._fingerprint
+
+    def _schema(self) -> schema_context.SchemaIndex:
+        """The dataset's column index, shared by all requests on the same dataset."""
+        if self._schema_index is None:
+            self._schema_index = schema_context.index_for(self.dataset, self._dataset_fingerprint())
+        return self._schema_index
+
+    # ------------------------------------------------------------------
+    def _is_cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    async def _iterate_in_thread(self, iterator):
+        """
+        Consume a blocking iterator (a Gemini stream) from a worker thread so
+        the event loop stays free; stops early once the turn is cancelled.
+        """
+        iterator = iter(iterator)
+        while not self._is_cancelled():
+            item = await asyncio.to_thread(next, iterator, _STREAM_END)
+            if item is _STREAM_END:
+                return
+            yield item
+        if hasattr(iterator, "close"):
+            iterator.close()
+
+    def _save_truncated(self, partial_text: str) -> None:
+        """Persist whatever was produced before the client disconnected."""
+        elapsed = time.monotonic() - self._turn_started
+        metrics.incr("cancelled_turns")
+        metrics.incr("cancelled_work_seconds", elapsed)
+        print(f"🔌 Turn cancelled after {elapsed:.1f}s; saving partial response")
+        self._cacheable = False
+        # Runs inside a cancelled task, where awaiting is not possible: queue
+        # it behind this turn's other messages, or save it from a worker
+        # thread (sync writes can't run on the event loop thread).
+        content = partial_text + TRUNCATED_MARKER
+        if write_behind.WRITE_BEHIND_ENABLED and write_behind.WRITER.running:
+            write_behind.WRITER.enqueue(self.user.id, "model", content, self.conversation_id)
+            return
+        asyncio.get_running_loop().run_in_executor(None, self._save_truncated_sync, content)
+
+    def _save_truncated_sync(self, content: str) -> None:
+        try:
+            with SessionLocal() as db:
+                crud.save_chat_message(
+                    db=db,
+                    user_id=self.user.id,
+                    conversation_id=self.conversation_id,
+                    role="model",
+                    content=content
+                )
+        except Exception as save_error:
+            print(f"❌ Failed to save truncated response: {save_error}")
+
+    # ------------------------------------------------------------------
+    def _schema_contents(self) -> list:
+        return [{"role": "user", "parts": [{"text": self._schema().full_schema()}]}] if self.dataset else []
+
+    def _cached_prefix(self, model: str) -> Optional[str]:
+        """Name of the provider cache holding the tool prompt prefix for `model`, if there is one."""
+        if not self._use_context_cache:
+            return None
+        return context_cache.CONTEXT_CACHE.get_or_create(
+            self.client,
+            CURRENT_KEY_INDEX,
+            model,
+            self._system_instruction,
+            TOOL_DECLARATIONS,
+            self._schema_contents(),
+        )
+
+    def _tool_generation_config(self, mode: str = "ANY", model: str | None = None) -> GenerateContentConfig:
+        """
+        Generation config for tool-enabled calls. The system instruction,
+        tool declarations and dataset schema are served from a provider-side
+        context cache when possible, and sent inline otherwise. The
+        function-calling mode is not part of the cache; it goes with the call.
+        """
+        tool_config = ToolConfig(function_calling_config=FunctionCallingConfig(mode=mode))
+
+        self._context_cache_name = None
+        if mode == "AUTO" or not context_cache.CONTEXT_CACHE.tool_config_rejected:
+            self._context_cache_name = self._cached_prefix(model or self.model_name)
+        if self._context_cache_name:
+            # AUTO is the provider's default mode
+            return GenerateContentConfig(
+                cached_content=self._context_cache_name,
+                tool_config=tool_config if mode != "AUTO" else None,
+            )
+
+        return GenerateContentConfig(
+            system_instruction=[self._system_instruction],
+            tools=TOOL_DECLARATIONS,
+            tool_config=tool_config,
+        )
+
+    def _inline_prefix(self) -> list:
+        """Schema to send with a step that runs without the cache the prompt was built for."""
+        if self._context_cache_name or not self._schema_in_prefix:
+            return []
+        return self._schema_contents()
+
     # ------------------------------------------------------------------
     async def stream_response(self, prompt: str, image: Image | None = None, max_iterations: int = 10):
         """Streams Gemini's response, handles tool calls, and saves messages to DB."""
         
         print(f"📨 Processing prompt: {prompt[:100]}...")
+        self._turn_started = time.monotonic()
+        if self._fingerprint is None and self.dataset:
+            # Hashes every row: once per turn, off the event loop
+            self._fingerprint = await asyncio.to_thread(response_cache.dataset_fingerprint, self.dataset)
 
-        crud.save_chat_message(
-            db=self.db,
+        await write_behind.save_chat_message(
+            self.db,
             user_id=self.user.id,
+            conversation_id=self.conversation_id,
             role="user",
             content=prompt
         )
 
-        # Check if prompt is conversational (improved detection)
-        prompt_lower = prompt.lower().strip()
-        # Single word greetings - always conversational
-        single_word_greetings = ["hey", "hi", "hello", "hey!", "hi!", "hello!"]
-        
-        # Multi-word conversational phrases
-        conversational_keywords = ["good morning", "good evening", "good afternoon", "good night",
-                                 "what can you do", "what all can you do", "who are you", "tell me about yourself",
-                                 "thanks", "thank you", "how are you", "what's up", "what's going on"]
-        
-        # Data analysis keywords - if present, it's NOT conversational
-        data_keywords = ["data", "dataset", "analyze", "analysis", "statistics", "visualize", "visualization",
-                        "plot", "chart", "graph", "correlation", "heatmap", "scatter", "box plot", "histogram",
-                        "create a", "show me", "display", "calculate", "find", "insights", "summary report",
-                        "pdf", "html", "model", "predict"]
-        
-        # Check if it's a single word greeting
-        is_single_greeting = prompt_lower in single_word_greetings
-        
-        # Check if it contains conversational keywords
-        has_conversational = any(keyword in prompt_lower for keyword in conversational_keywords)
-        
-        # Check if it contains data keywords
-        has_data_keywords = any(keyword in prompt_lower for keyword in data_keywords)
-        
-        # Mark as conversational if:
-        # 1. It's a single word greeting, OR
-        # 2. It has conversational keywords AND no data keywords
-        is_conversational = is_single_greeting or (has_conversational and not has_data_keywords)
-        
+        # Greetings / capability questions never need tools
+        is_conversational = intent.is_conversational(prompt)
+
+        if is_conversational and intent.LOCAL_RESPONDER is not None:
+            local_answer = intent.LOCAL_RESPONDER.respond(prompt, self.dataset)
+            if local_answer:
+                metrics.incr("local_responses")
+                yield stream_events.text(local_answer)
+                await write_behind.save_chat_message(
+                    self.db,
+                    user_id=self.user.id,
+                    conversation_id=self.conversation_id,
+                    role="model",
+                    content=local_answer
+                )
+                return
+
+        # Tier-1 cache: an identical opening question on the same dataset
+        # replays instantly. Follow-ups ("now plot it by month") depend on
+        # the conversation, so they always go to the model.
+        answer_cache_key = None
+        if response_cache.RESPONSE_CACHE_ENABLED and not await self._has_earlier_history():
+            answer_cache_key = response_cache.answer_key(prompt, self._dataset_fingerprint(), model_router.ROUTER.signature)
+            cached_answer = response_cache.ANSWER_CACHE.get(answer_cache_key) if self.use_cache else None
+            if cached_answer:
+                streamed_events, model_text = cached_answer
+                print("⚡ Answer cache hit - replaying previous response")
+                for event in streamed_events:
+                    yield event
+                await write_behind.save_chat_message(
+                    self.db,
+                    user_id=self.user.id,
+                    conversation_id=self.conversation_id,
+                    role="model",
+                    content=model_text
+                )
+                return
+
+        self._cacheable = True
+        self._response_text = ""
+        streamed = []
+        async for event in self._stream_llm_response(prompt, image, is_conversational, max_iterations):
+            if event["type"] != "heartbeat":
+                streamed.append(event)
+            yield event
+
+        if answer_cache_key and self._cacheable and self._response_text:
+            response_cache.ANSWER_CACHE.set(
+                answer_cache_key,
+                (streamed, self._response_text),
+                size=response_cache.answer_size(streamed, self._response_text),
+            )
+
+    # ------------------------------------------------------------------
+    async def _stream_llm_response(self, prompt: str, image: Image | None, is_conversational: bool, max_iterations: int):
+        """Generate the Gemini answer for a turn (text-only or tool loop) and save it."""
         # Enhance prompt based on type
         enhanced_prompt = prompt
         if is_conversational:
@@ -410,31 +712,20 @@ Keep your response:
 Remember: This is just a chat - no data analysis, no code, just a friendly conversation."""
             print(f"💬 Detected conversational prompt ('{prompt}') - responding naturally without tools")
         elif self.dataset and len(self.dataset) > 0:
-            # Get column names and sample info
-            sample_row = self.dataset[0] if self.dataset else {}
-            columns = list(sample_row.keys()) if sample_row else []
-            row_count = len(self.dataset)
-            
-            # Enhanced context with clear instructions
-            # Detect numeric columns more reliably
-            numeric_cols = []
-            if self.dataset and len(self.dataset) > 0:
-                for col in columns:
-                    try:
-                        # Check first few rows to see if values are numeric
-                        sample_values = [self.dataset[i].get(col, '') for i in range(min(5, len(self.dataset)))]
-                        numeric_count = sum(1 for v in sample_values if isinstance(v, (int, float)) or (isinstance(v, str) and v.replace('.', '').replace('-', '').isdigit()))
-                        if numeric_count >= 2:  # At least 2 numeric values
-                            numeric_cols.append(col)
-                    except:
-                        pass
-            
+            # Only the columns relevant to the question go into the prompt;
+            # wide datasets would otherwise blow up the prompt size. When the
+            # full schema is in the cached prefix, the column names suffice.
+            schema = self._schema()
+            row_count = schema.row_count
+            columns = schema.columns
+            self._schema_in_prefix = (
+                await asyncio.to_thread(self._cached_prefix, model_router.ROUTER.pick("code"))
+            ) is not None
+
             dataset_context = f"""User question: {prompt}
 
 Dataset available:
-- {row_count} rows, {len(columns)} columns
-- All columns: {', '.join(columns)}
-- Numeric columns: {', '.join(numeric_cols) if numeric_cols else 'None detected'}
+{schema.focus(prompt) if self._schema_in_prefix else schema.describe(prompt)}
 - DataFrame name: 'df'
 
 IMPORTANT: 
@@ -459,888 +750,146 @@ IMPORTANT:
         iteration_count = 0
 
         try:
-            # For conversational prompts, use a text-only generation config (no tools)
-            if is_conversational:
+            if not is_conversational:
+                # Data analysis runs as a multi-step function-calling loop
+                async for event, is_model_text in self._run_tool_loop(prompt, enhanced_prompt):
+                    if is_model_text:
+                        has_output = True
+                        ai_response_content += event["delta"]
+                    yield event
+                if self._is_cancelled():
+                    self._save_truncated(ai_response_content)
+                    return
+                if not has_output:
+                    self._cacheable = False
+                    fallback = (
+                        "\n\n✅ Analysis completed! The results are shown above.\n"
+                        if self._tools_executed
+                        else "\n\n❌ I'm having trouble generating a response. Please try rephrasing your question or check the backend logs for errors.\n"
+                    )
+                    ai_response_content += fallback
+                    yield stream_events.text(fallback)
+            else:
+                # For conversational prompts, use a text-only generation config (no tools)
                 print("💬 Using google.genai client for conversational response (no tools available)")
 
+                chat_model = model_router.ROUTER.pick("chat")
+                chat_started = time.perf_counter()
+
                 def _start_text_stream():
                     cfg = GenerateContentConfig(
                         system_instruction=[self._text_system_instruction],
                     )
                     return self.client.models.generate_content_stream(
-                        model=self.model_name,
+                        model=chat_model,
                         contents=[enhanced_prompt],
                         config=cfg,
                     )
 
+                def _switch_after_quota_error() -> bool:
+                    # Prefer another model for the phase, then another API key
+                    nonlocal chat_model
+                    model_router.ROUTER.mark_throttled(chat_model)
+                    fallback_model = model_router.ROUTER.pick("chat", exclude={chat_model})
+                    if fallback_model != chat_model:
+                        print(f"🚦 Retrying conversational response with {fallback_model}...")
+                        chat_model = fallback_model
+                        return True
+                    if _try_switch_gemini_key():
+                        self.client = GENAI_CLIENT
+                        return True
+                    return False
+
                 try:
                     response_stream = _start_text_stream()
                     print("✅ Text-only stream created for conversational response")
                 except Exception as stream_init_error:
                     print(f"❌ Error creating conversational stream: {stream_init_error}")
-                    if self._is_quota_error(stream_init_error) and _try_switch_gemini_key():
-                        print("🔁 Retrying conversational response with backup Gemini key...")
-                        self.client = GENAI_CLIENT
+                    if self._is_quota_error(stream_init_error) and _switch_after_quota_error():
+                        print("🔁 Retrying conversational response after quota error...")
                         try:
                             response_stream = _start_text_stream()
-                            print("✅ Text-only stream created after key rotation")
+                            print("✅ Text-only stream created after switching model/key")
                         except Exception as retry_error:
                             print(f"❌ Retry failed after key rotation: {retry_error}")
-                            yield f"❌ Error initializing response after switching Gemini key: {str(retry_error)}"
+                            self._cacheable = False
+                            yield stream_events.text(f"❌ Error initializing response after switching Gemini key: {str(retry_error)}")
                             return
                     else:
-                        yield f"❌ Error initializing response: {str(stream_init_error)}"
+                        self._cacheable = False
+                        yield stream_events.text(f"❌ Error initializing response: {str(stream_init_error)}")
                         return
-            else:
-                # For data analysis, use tools via google.genai
-                print("🔄 Starting google.genai stream with tools...")
-
-                def _start_tool_stream():
-                    # Rebuild full conversation history for this turn
-                    history_db = crud.get_chat_history(db=self.db, user_id=self.user.id)
-                    history_gemini = self.convert_db_history_to_gemini(history_db)
-                    contents = history_gemini + [{"role": "user", "parts": [{"text": enhanced_prompt}]}]
-                    cfg = GenerateContentConfig(
-                        system_instruction=[self._system_instruction],
-                        tools=[run_python_tool_schema, google_search_tool_schema],
-                        tool_config=ToolConfig(
-                            function_calling_config=FunctionCallingConfig(mode="ANY")
-                        ),
-                    )
-                    return self.client.models.generate_content_stream(
-                        model=self.model_name,
-                        contents=contents,
-                        config=cfg,
-                    )
+
+                event_count = 0
+                first_text_time = None
+                usage = None
+                last_event_time = time.time()
+                STREAM_TIMEOUT = 30  # 30 second timeout for stream
 
                 try:
-                    response_stream = _start_tool_stream()
-                    print("✅ Stream object created, starting to iterate...")
-                except Exception as stream_init_error:
-                    print(f"❌ Error creating stream: {stream_init_error}")
-                    if self._is_quota_error(stream_init_error) and _try_switch_gemini_key():
-                        print("🔁 Retrying data-analysis stream with backup Gemini key...")
-                        self.client = GENAI_CLIENT
+                    async for event in self._iterate_in_thread(response_stream):
+                        event_count += 1
+                        current_time = time.time()
+
+                        # Check for timeout
+                        if current_time - last_event_time > STREAM_TIMEOUT:
+                            print(f"⏱️ Stream timeout: No events for {STREAM_TIMEOUT} seconds")
+                            yield stream_events.text("\n\n⚠️ Stream timeout: The response is taking too long. Please try again.\n")
+                            break
+
+                        last_event_time = current_time
+
+                        iteration_count += 1
+                        if iteration_count > max_iterations * 1000:  # Increased safety limit
+                            yield stream_events.text("\n⚠️ Maximum iterations reached. Stopping to prevent infinite loop.\n")
+                            break
+
+                        usage = getattr(event, "usage_metadata", None) or usage
+                        for part in _event_parts(event):
+                            if part.text and not part.thought:
+                                if first_text_time is None:
+                                    first_text_time = time.perf_counter()
+                                has_output = True
+                                ai_response_content += part.text
+                                yield stream_events.text(part.text)
+
+                except Exception as stream_error:
+                    print(f"❌ Error during stream iteration: {stream_error}")
+                    traceback.print_exc()
+                    self._cacheable = False
+
+                    # If this is a quota / rate-limit error, try switching to a backup key once
+                    if self._is_quota_error(stream_error) and _switch_after_quota_error():
+                        print("🔁 Stream hit quota error during iteration; switching model/key and retrying turn...")
                         try:
-                            response_stream = _start_tool_stream()
-                            print("✅ Stream object created after key rotation")
-                        except Exception as retry_error:
-                            print(f"❌ Retry failed after key rotation: {retry_error}")
-                            yield f"❌ Error initializing response stream after switching Gemini key: {str(retry_error)}"
-                            return
+                            async for retry_event in self._iterate_in_thread(_start_text_stream()):
+                                for part in _event_parts(retry_event):
+                                    if part.text and not part.thought:
+                                        has_output = True
+                                        ai_response_content += part.text
+                                        yield stream_events.text(part.text)
+                        except Exception as retry_err:
+                            print(f"❌ Retry after quota switch failed: {retry_err}")
+                            yield stream_events.text(f"\n\n⚠️ Error processing stream after switching Gemini key: {str(retry_err)}\n")
                     else:
-                        yield f"❌ Error initializing response stream: {str(stream_init_error)}"
-                        return
+                        yield stream_events.text(f"\n\n⚠️ Error processing stream: {str(stream_error)}\n")
+
+                if self._is_cancelled():
+                    self._save_truncated(ai_response_content)
+                    return
+
+                model_router.ROUTER.record(
+                    "chat",
+                    chat_model,
+                    time.perf_counter() - chat_started,
+                    usage=usage,
+                    ttft_s=first_text_time - chat_started if first_text_time else None,
+                )
 
-            event_count = 0
-            last_event_time = time.time()
-            STREAM_TIMEOUT = 30  # 30 second timeout for stream
-            
-            try:
-                for event in response_stream:
-                    event_count += 1
-                    current_time = time.time()
-                    
-                    # Check for timeout
-                    if current_time - last_event_time > STREAM_TIMEOUT:
-                        print(f"⏱️ Stream timeout: No events for {STREAM_TIMEOUT} seconds")
-                        yield "\n\n⚠️ Stream timeout: The response is taking too long. Please try again.\n"
-                        break
-                    
-                    last_event_time = current_time
-                    
-                    if event_count == 1:
-                        print(f"✅ First event received (type: {type(event)})")
-                    if event_count % 10 == 0:
-                        print(f"📊 Processed {event_count} events so far...")
-                    
-                    iteration_count += 1
-                    if iteration_count > max_iterations * 1000:  # Increased safety limit
-                        yield "\n⚠️ Maximum iterations reached. Stopping to prevent infinite loop.\n"
-                        break
-                    
-                    # --- Handle standard text chunks ---
-                    try:
-                        if hasattr(event, "text") and event.text:
-                            has_output = True
-                            ai_response_content += event.text
-                            yield event.text
-                            continue  # Skip to next event
-                    except Exception as text_error:
-                        # If accessing .text fails, it might be a function call or invalid response
-                        # For conversational prompts, skip tool call handling
-                        if is_conversational:
-                            print(f"⚠️ Error accessing text in conversational response: {text_error}")
-                            continue
-                        
-                        # Check if it's a function call issue
-                        error_str = str(text_error)
-                        if "finish_reason" in error_str or "FunctionCall" in error_str:
-                            print(f"⚠️ Function call issue detected: {text_error}")
-                            # Try to get candidate and check for function calls
-                            try:
-                                if hasattr(event, "candidates") and event.candidates:
-                                    for candidate in event.candidates:
-                                        if hasattr(candidate, "content") and candidate.content:
-                                            if hasattr(candidate.content, "parts"):
-                                                for part in candidate.content.parts:
-                                                    if hasattr(part, "text") and part.text:
-                                                        has_output = True
-                                                        ai_response_content += part.text
-                                                        yield part.text
-                            except Exception as e:
-                                print(f"⚠️ Could not extract text from candidate: {e}")
-                        else:
-                            print(f"⚠️ Could not access text: {text_error}")
-                        pass
-
-                    # --- Handle Gemini tool calls from event.parts ---
-                    # Skip tool call handling for conversational prompts (text_model doesn't have tools)
-                    if not is_conversational and hasattr(event, "parts") and event.parts:
-                        for part in event.parts:
-                            if hasattr(part, "function_call") and part.function_call:
-                                fc = part.function_call
-                                tool_name = fc.name if hasattr(fc, "name") else "unknown"
-                                tool_args = dict(fc.args) if hasattr(fc, "args") and fc.args else {}
-                                
-                                # SAFEGUARD: Check if this was a conversational prompt
-                                # Re-check the prompt to see if it's conversational
-                                prompt_check = prompt.lower().strip()
-                                single_greetings = ["hey", "hi", "hello", "hey!", "hi!", "hello!"]
-                                is_conv_check = prompt_check in single_greetings or \
-                                               (any(kw in prompt_check for kw in ["good morning", "good evening", "what can you do", "who are you"]) and 
-                                                not any(kw in prompt_check for kw in ["data", "analyze", "plot", "chart", "create", "show"]))
-                                
-                                if is_conv_check:
-                                    print(f"⚠️ BLOCKED: Attempted tool call '{tool_name}' for conversational prompt '{prompt}'. Ignoring.")
-                                    # Skip this tool call and continue to get text response
-                                    continue
-                                
-                                # Process the function call
-                                print(f"🔧 Executing tool from event.parts: {tool_name}")
-                                yield f"\n\n🤖 **Executing:** `{tool_name}`\n\n"
-                                
-                                try:
-                                    # Initialize tool_result to ensure it's always defined
-                                    tool_result = None
-                                    
-                                    if tool_name == "run_python_code":
-                                        code = tool_args.get("code", "")
-                                        if not code:
-                                            tool_result = "Error: No code provided to execute."
-                                        else:
-                                            # Show the code being run BEFORE execution
-                                            yield f"```python\n{code}\n```\n\n"
-                                            print(f"💻 Running Python code ({len(code)} chars)...")
-                                            tool_result = tools.run_python_code(code, self.dataset)
-                                            print(f"✅ Code execution completed")
-                                            # Yield the tool result output so it's visible
-                                            if tool_result:
-                                                yield f"\n**Code Output:**\n```\n{tool_result}\n```\n\n"
-                                    elif tool_name == "google_search":
-                                        query = tool_args.get("query", "")
-                                        tool_result = tools.google_search(query)
-                                    else:
-                                        tool_result = f"Error: Unknown tool `{tool_name}`"
-                                    
-                                    # Ensure tool_result is set
-                                    if tool_result is None:
-                                        tool_result = "Error: Tool execution returned no result."
-                                    
-                                    # Feed tool response back to Gemini
-                                    has_image = "PLOT_IMG_BASE64:" in tool_result if tool_result else False
-
-                                    # Detect any saved model files signaled by the tool
-                                    saved_model_paths = []
-                                    if tool_result:
-                                        for line in tool_result.splitlines():
-                                            if line.startswith("MODEL_FILE:"):
-                                                path = line.replace("MODEL_FILE:", "").strip()
-                                                if path:
-                                                    saved_model_paths.append(path)
-
-                                    # If models were saved, surface a short note to the user
-                                    if saved_model_paths:
-                                        model_list = "\n".join(f"- `{p}`" for p in saved_model_paths)
-                                        yield f"\n💾 **Models saved**:\n{model_list}\n\n"
-                                    
-                                    # Check if code execution failed
-                                    code_failed = "Code execution failed" in tool_result or "Error:" in tool_result if tool_result else False
-                                    
-                                    # Extract key information from tool result for better context
-                                    # Use larger preview to ensure all tables are included
-                                    tool_result_preview = tool_result[:8000] if tool_result else 'No results'
-                                    if tool_result and len(tool_result) > 8000:
-                                        tool_result_preview += '\n... (truncated, showing first 8000 chars)'
-                                    
-                                    # Always define followup_prompt
-                                    if code_failed:
-                                        followup_prompt = f"""User question: {prompt}
-
-Code execution error:
-
-{tool_result_preview}
-
-Provide a brief summary based on available dataset info. Be concise.
-
-Format:
-🤖 DataGem: [Brief explanation of error/what was attempted]
-
-[Key dataset info if available]
-
-**Next steps:** [1-2 suggestions]
-
-Keep it short - text only, no tools."""
-                                    else:
-                                        followup_prompt = f"""User question: {prompt}
-
-Code executed successfully. Results (including any markdown tables):
-
-{tool_result_preview}
-
-Write a focused analytic answer to the user's question that USES the numbers from the tables above.
-
-Requirements:
-- First, directly answer the user's question in 1–2 clear sentences (for example, list the unique values, give the requested correlation, describe the requested relationship, etc.).
-- Extract concrete key findings from the output (means, mins/maxes, counts, correlations, etc.).
-- When the user asks for "all columns", "all ground names", "unique values", etc., ALWAYS include at least one clear markdown table with proper headers:
-  - For columns: | Column | Type | Description |
-  - For unique values: | Column | Value | Count |
-- Reference the markdown tables directly instead of repeating them in prose.
-- Highlight patterns, outliers, and comparisons that are actually visible in the data.
-- 3–5 concise bullet-point insights, each grounded in specific values from the tables.
-- If a model was trained, briefly mention its target, main features, and key metrics (accuracy, RMSE, etc.).
-- If any MODEL_FILE lines are present, mention that models were saved but do NOT repeat the paths.
-- No generic filler text, no restating the prompt.
-
-Format:
-🤖 DataGem: [Direct answer to the question in 1–2 sentences]
-
-**Insights:**
-- [Insight with specific numbers]
-- [Insight with specific numbers]
-- [Optional extra insight]
-
-{"**Visualization:** [Brief description of what the plot shows]" if has_image else ""}
-
-Start NOW - text only, no tools."""
-                                    
-                                    # Use the google.genai client for generating summaries (no tools)
-                                    print(f"📝 Generating text summary from tool results...")
-                                    summary_prompt = followup_prompt  # Use the comprehensive prompt
-
-                                    def _start_summary_stream(prompt_text: str):
-                                        cfg = GenerateContentConfig(
-                                            system_instruction=[self._text_system_instruction],
-                                        )
-                                        return self.client.models.generate_content_stream(
-                                            model=self.model_name,
-                                            contents=[prompt_text],
-                                            config=cfg,
-                                        )
-
-                                    try:
-                                        followup_response = _start_summary_stream(summary_prompt)
-                                        print(f"✅ Summary generation started")
-                                    except Exception as summary_error:
-                                        print(f"❌ Error starting summary: {summary_error}")
-                                        # Fallback to simpler prompt
-                                        summary_prompt = f"""Code executed. Results:
-
-{tool_result_preview}
-
-Write a brief summary: key findings only, no redundancy. Extract actual values from output. Be direct and concise."""
-                                        followup_response = _start_summary_stream(summary_prompt)
-                                    
-                                    # Process followup response - this contains the text summary
-                                    followup_has_text = False
-                                    followup_text_accumulated = ""
-                                    print(f"🔄 Processing followup response for summary generation...")
-                                    
-                                    try:
-                                        event_count = 0
-                                        for followup_event in followup_response:
-                                            event_count += 1
-                                            
-                                            # generate_content with stream=True returns chunks with text directly
-                                            try:
-                                                # Try direct text access first (most common for generate_content)
-                                                if hasattr(followup_event, "text") and followup_event.text:
-                                                    has_output = True
-                                                    followup_has_text = True
-                                                    followup_text_accumulated += followup_event.text
-                                                    ai_response_content += followup_event.text
-                                                    yield followup_event.text
-                                                    continue
-                                            except Exception as e:
-                                                print(f"⚠️ Error accessing followup_event.text: {e}")
-                                            
-                                            # Try candidates path (for compatibility)
-                                            try:
-                                                if hasattr(followup_event, "candidates") and followup_event.candidates:
-                                                    for cand in followup_event.candidates:
-                                                        if hasattr(cand, "content") and cand.content:
-                                                            if hasattr(cand.content, "parts"):
-                                                                for p in cand.content.parts:
-                                                                    # Skip function calls, only process text
-                                                                    if hasattr(p, "function_call") and p.function_call:
-                                                                        print(f"⚠️ Warning: Gemini tried to call a function in followup response. Skipping function call.")
-                                                                        continue
-                                                                    if hasattr(p, "text") and p.text:
-                                                                        has_output = True
-                                                                        followup_has_text = True
-                                                                        followup_text_accumulated += p.text
-                                                                        ai_response_content += p.text
-                                                                        yield p.text
-                                            except Exception as e:
-                                                print(f"⚠️ Error accessing followup_event.candidates: {e}")
-                                            
-                                            # Try parts directly (for compatibility)
-                                            try:
-                                                if hasattr(followup_event, "parts"):
-                                                    for part in followup_event.parts:
-                                                        # Skip function calls, only process text
-                                                        if hasattr(part, "function_call") and part.function_call:
-                                                            print(f"⚠️ Warning: Gemini tried to call a function in followup response. Skipping function call.")
-                                                            continue
-                                                        if hasattr(part, "text") and part.text:
-                                                            has_output = True
-                                                            followup_has_text = True
-                                                            followup_text_accumulated += part.text
-                                                            ai_response_content += part.text
-                                                            yield part.text
-                                            except Exception as e:
-                                                print(f"⚠️ Error accessing followup_event.parts: {e}")
-                                        
-                                        print(f"📊 Processed {event_count} followup events, has_text: {followup_has_text}, accumulated: {len(followup_text_accumulated)} chars")
-                                    except Exception as followup_error:
-                                        print(f"❌ Error processing followup response: {followup_error}")
-                                        traceback.print_exc()
-                                    
-                                    # If no followup text was generated, try to get the full response
-                                    if not followup_has_text:
-                                        print("⚠️ No followup text found in stream, trying to get full response...")
-                                        try:
-                                            # Try to get the response object directly
-                                            if hasattr(followup_response, "text"):
-                                                text = followup_response.text
-                                                if text:
-                                                    has_output = True
-                                                    followup_has_text = True
-                                                    ai_response_content += text
-                                                    yield text
-                                            elif hasattr(followup_response, "candidates"):
-                                                for cand in followup_response.candidates:
-                                                    if hasattr(cand, "content") and cand.content:
-                                                        if hasattr(cand.content, "parts"):
-                                                            for p in cand.content.parts:
-                                                                if hasattr(p, "text") and p.text:
-                                                                    has_output = True
-                                                                    followup_has_text = True
-                                                                    ai_response_content += p.text
-                                                                    yield p.text
-                                        except Exception as e:
-                                            print(f"⚠️ Could not extract from followup response object: {e}")
-                                    
-                                    # If still no text, yield a helpful message
-                                    if not followup_has_text:
-                                        print("⚠️ Still no followup text generated, using default message")
-                                        default_summary = "\n\n✅ Analysis completed. Review the code, output, and visualizations above."
-                                        has_output = True
-                                        ai_response_content += default_summary
-                                        yield default_summary
-                                    else:
-                                        print(f"✅ Followup summary generated successfully ({len(followup_text_accumulated)} chars)")
-                                        print(f"📝 Summary preview (first 500 chars): {followup_text_accumulated[:500]}")
-                                except Exception as tool_error:
-                                    error_msg = f"Error executing tool `{tool_name}`: {str(tool_error)}"
-                                    print(f"❌ Tool execution error: {tool_error}")
-                                    traceback.print_exc()
-                                    yield f"\n⚠️ {error_msg}\n"
-                                    ai_response_content += error_msg
-                                    
-                                    # Set default values if exception occurred
-                                    tool_result = error_msg
-                                    code_failed = True
-                                    tool_result_preview = error_msg
-                                    has_image = False
-                                    
-                                    # Define followup_prompt even on error
-                                    followup_prompt = f"""The tool execution encountered an error: {error_msg}
-
-Provide a brief summary based on available dataset info. Be concise - text only, no tools."""
-                                    
-                                    # Still try to send followup response even on error
-                                    try:
-                                        # Use the text-only model for generating summaries (no tools available)
-                                        summary_prompt = f"""The tool execution encountered an error, but please still provide insights based on the dataset information:
-
-{followup_prompt}
-
-Provide a brief summary with key insights. Start with "🤖 DataGem:" - be concise, no redundancy."""
-                                        
-                                        # Use the text-only model (no tools) to generate the summary
-                                        followup_response = self.text_model.generate_content(
-                                            summary_prompt,
-                                            stream=True
-                                        )
-                                        
-                                        # Process followup response
-                                        followup_has_text = False
-                                        followup_text_accumulated = ""
-                                        
-                                        try:
-                                            for followup_event in followup_response:
-                                                try:
-                                                    if hasattr(followup_event, "text") and followup_event.text:
-                                                        has_output = True
-                                                        followup_has_text = True
-                                                        followup_text_accumulated += followup_event.text
-                                                        ai_response_content += followup_event.text
-                                                        yield followup_event.text
-                                                        continue
-                                                except Exception as e:
-                                                    print(f"⚠️ Error accessing followup_event.text: {e}")
-                                                
-                                                # Try candidates path
-                                                try:
-                                                    if hasattr(followup_event, "candidates") and followup_event.candidates:
-                                                        for cand in followup_event.candidates:
-                                                            if hasattr(cand, "content") and cand.content:
-                                                                if hasattr(cand.content, "parts"):
-                                                                    for p in cand.content.parts:
-                                                                        if hasattr(p, "text") and p.text:
-                                                                            has_output = True
-                                                                            followup_has_text = True
-                                                                            followup_text_accumulated += p.text
-                                                                            ai_response_content += p.text
-                                                                            yield p.text
-                                                except Exception as e:
-                                                    print(f"⚠️ Error accessing followup_event.candidates: {e}")
-                                                
-                                                # Try parts directly
-                                                try:
-                                                    if hasattr(followup_event, "parts"):
-                                                        for part in followup_event.parts:
-                                                            if hasattr(part, "text") and part.text:
-                                                                has_output = True
-                                                                followup_has_text = True
-                                                                followup_text_accumulated += part.text
-                                                                ai_response_content += part.text
-                                                                yield part.text
-                                                except Exception as e:
-                                                    print(f"⚠️ Error accessing followup_event.parts: {e}")
-                                        except Exception as followup_error:
-                                            print(f"❌ Error processing followup response: {followup_error}")
-                                            traceback.print_exc()
-                                        
-                                        if not followup_has_text:
-                                            print("⚠️ No followup text generated after error, using default message")
-                                            default_summary = "\n\n⚠️ Analysis encountered an error. Check the code output above for details."
-                                            has_output = True
-                                            ai_response_content += default_summary
-                                            yield default_summary
-                                    except Exception as followup_send_error:
-                                        print(f"❌ Error sending followup after tool error: {followup_send_error}")
-                                        traceback.print_exc()
-                
-                # --- Handle Gemini tool calls from candidates (if not already handled) ---
-                # Skip tool call handling for conversational prompts (text_model doesn't have tools)
-                # Only process if we haven't already handled function calls from event.parts
-                if not is_conversational and hasattr(event, "candidates") and event.candidates and not hasattr(event, "parts"):
-                    for candidate in event.candidates:
-                        if hasattr(candidate, "content") and candidate.content:
-                            if hasattr(candidate.content, "parts"):
-                                for part in candidate.content.parts:
-                                    if hasattr(part, "function_call") and part.function_call:
-                                        fc = part.function_call
-                                        tool_name = fc.name if hasattr(fc, "name") else "unknown"
-                                        tool_args = dict(fc.args) if hasattr(fc, "args") and fc.args else {}
-                                        
-                                        # SAFEGUARD: Check if this was a conversational prompt
-                                        prompt_check = prompt.lower().strip()
-                                        single_greetings = ["hey", "hi", "hello", "hey!", "hi!", "hello!"]
-                                        is_conv_check = prompt_check in single_greetings or \
-                                                       (any(kw in prompt_check for kw in ["good morning", "good evening", "what can you do", "who are you"]) and 
-                                                        not any(kw in prompt_check for kw in ["data", "analyze", "plot", "chart", "create", "show"]))
-                                        
-                                        if is_conv_check:
-                                            print(f"⚠️ BLOCKED: Attempted tool call '{tool_name}' for conversational prompt '{prompt}'. Ignoring.")
-                                            continue
-                                        
-                                        print(f"🔧 Executing tool from candidates: {tool_name}")
-                                        yield f"\n\n🤖 **Executing:** `{tool_name}`\n\n"
-                                        
-                                        # Process the function call (same logic as above)
-                                        try:
-                                            # Initialize tool_result to ensure it's always defined
-                                            tool_result = None
-                                            
-                                            if tool_name == "run_python_code":
-                                                code = tool_args.get("code", "")
-                                                if not code:
-                                                    tool_result = "Error: No code provided to execute."
-                                                else:
-                                                    yield f"```python\n{code}\n```\n\n"
-                                                    print(f"💻 Running Python code ({len(code)} chars)...")
-                                                    tool_result = tools.run_python_code(code, self.dataset)
-                                                    print(f"✅ Code execution completed")
-                                                    if tool_result:
-                                                        yield f"\n**Code Output:**\n```\n{tool_result}\n```\n\n"
-                                            elif tool_name == "google_search":
-                                                query = tool_args.get("query", "")
-                                                tool_result = tools.google_search(query)
-                                            else:
-                                                tool_result = f"Error: Unknown tool `{tool_name}`"
-                                            
-                                            # Ensure tool_result is set
-                                            if tool_result is None:
-                                                tool_result = "Error: Tool execution returned no result."
-                                            
-                                            # Feed back to Gemini
-                                            has_image = "PLOT_IMG_BASE64:" in tool_result if tool_result else False
-                                            
-                                            # Check if code execution failed
-                                            code_failed = "Code execution failed" in tool_result or "Error:" in tool_result if tool_result else False
-                                            
-                                            # Extract key information from tool result for better context
-                                            # Use larger preview to ensure all tables are included
-                                            tool_result_preview = tool_result[:8000] if tool_result else 'No results'
-                                            if tool_result and len(tool_result) > 8000:
-                                                tool_result_preview += '\n... (truncated, showing first 8000 chars)'
-                                            
-                                            # Always define followup_prompt
-                                            if code_failed:
-                                                followup_prompt = f"""The Python code execution encountered an error. Here are the details:
-
-{tool_result_preview}
-
-IMPORTANT: Even though the code failed, you MUST still provide a comprehensive text summary based on what you know about the dataset. Use the dataset information from the original context.
-
-CRITICAL: You MUST write a comprehensive text summary NOW. Do NOT use any tools - just write text directly in your response.
-
-INSTRUCTIONS:
-1. Parse the code output above to extract ALL tables and data
-2. Extract actual numeric values, column names, types, and statistics
-3. Create markdown tables with proper alignment using the actual extracted values
-4. Format your response EXACTLY like this ChatGPT-style example:
-
-Here's the detailed **summary** of your dataset `student_exam_scores.csv`:
-
-### 📊 Dataset Overview
-
-* **Total Records (Rows):** 200
-* **Total Columns:** 6
-* **No missing values detected** ✅
-
-### 🧩 Columns
-
-| Column               | Type    | Description                          |
-| -------------------- | ------- | ------------------------------------ |
-| `student_id`         | object  | Unique ID for each student           |
-| `hours_studied`      | float64 | Number of study hours per day        |
-| `sleep_hours`        | float64 | Average hours of sleep               |
-| `attendance_percent` | float64 | Attendance percentage                |
-| `previous_scores`    | int64   | Past academic performance score      |
-| `exam_score`         | float64 | Current exam score (target variable) |
-
-### 📈 Descriptive Statistics
-
-| Feature                | Mean  | Std Dev | Min  | 25%  | 50%   | 75%   | Max   |
-| ---------------------- | ----- | ------- | ---- | ---- | ----- | ----- | ----- |
-| **hours_studied**      | 6.33  | 3.23    | 1.0  | 3.5  | 6.15  | 9.0   | 12.0  |
-| **sleep_hours**        | 6.62  | 1.50    | 4.0  | 5.3  | 6.7   | 8.03  | 9.0   |
-| **attendance_percent** | 74.83 | 14.25   | 50.3 | 62.2 | 75.25 | 87.43 | 100.0 |
-| **previous_scores**    | 66.8  | 15.66   | 40   | 54   | 67.5  | 80    | 95    |
-| **exam_score**         | 33.96 | 6.79    | 17.1 | 29.5 | 34.05 | 38.75 | 51.3  |
-
----
-
-Would you like me to:
-
-1. Generate **visual insights** (correlation heatmap, distributions, scatterplots)?
-2. Build a **predictive model** (e.g., linear regression to predict `exam_score`)?
-3. Create a **summary report (PDF/HTML)** for this dataset?
-
-MANDATORY REQUIREMENTS:
-- Start with "Here's the detailed **summary** of your dataset" (include dataset name if available)
-- Use EXACT emoji headings: 📊 Dataset Overview, 🧩 Columns, 📈 Descriptive Statistics
-- Include bullet points with bold labels (e.g., **Total Records (Rows):**)
-- Create markdown tables with proper alignment using ACTUAL values from the code output above
-- Use checkmarks (✅) for positive indicators
-- End with "Would you like me to:" followed by numbered options
-- Write in a friendly, conversational ChatGPT-style tone
-- PARSE the code output tables and extract ALL actual values - do NOT use placeholders like [number] or [type]
-- Include ALL columns and statistics that appear in the code output
-{"- Describe any visualizations that were generated" if has_image else ""}
-
-CRITICAL: The code output above contains tables with actual data. You MUST parse those tables and recreate them as markdown tables in your response with the EXACT same values. Do not summarize - show the complete tables.
-                            
-Write the summary NOW - do not use tools, just write the text directly."""
-                                            else:
-                                                followup_prompt = f"""Code executed successfully. Results:
-
-{tool_result_preview}
-
-Write a CONCISE summary. Extract key findings from output above. Be direct - no redundancy.
-
-Format:
-🤖 DataGem: [1-sentence intro]
-
-[Key tables/data from output]
-
-**Insights:** [2-3 bullet points max]
-
-Keep it short and actionable. Text only."""
-                                            
-                                            # Use the text-only model (no tools) to generate the summary
-                                            print(f"📝 Generating text summary from tool results...")
-                                            summary_prompt = followup_prompt
-                                            
-                                            try:
-                                                followup_response = self.text_model.generate_content(
-                                                    summary_prompt,
-                                                    stream=True
-                                                )
-                                                
-                                                followup_has_text = False
-                                                followup_text_accumulated = ""
-                                                
-                                                try:
-                                                    for followup_event in followup_response:
-                                                        try:
-                                                            # Try direct text access
-                                                            if hasattr(followup_event, "text") and followup_event.text:
-                                                                has_output = True
-                                                                followup_has_text = True
-                                                                followup_text_accumulated += followup_event.text
-                                                                ai_response_content += followup_event.text
-                                                                yield followup_event.text
-                                                                continue
-                                                        except Exception as e:
-                                                            print(f"⚠️ Error accessing followup_event.text: {e}")
-                                                        
-                                                        # Try candidates path
-                                                        try:
-                                                            if hasattr(followup_event, "candidates") and followup_event.candidates:
-                                                                for cand in followup_event.candidates:
-                                                                    if hasattr(cand, "content") and cand.content:
-                                                                        if hasattr(cand.content, "parts"):
-                                                                            for p in cand.content.parts:
-                                                                                if hasattr(p, "text") and p.text:
-                                                                                    has_output = True
-                                                                                    followup_has_text = True
-                                                                                    followup_text_accumulated += p.text
-                                                                                    ai_response_content += p.text
-                                                                                    yield p.text
-                                                        except Exception as e:
-                                                            print(f"⚠️ Error accessing followup_event.candidates: {e}")
-                                                        
-                                                        # Try parts directly
-                                                        try:
-                                                            if hasattr(followup_event, "parts"):
-                                                                for part in followup_event.parts:
-                                                                    if hasattr(part, "text") and part.text:
-                                                                        has_output = True
-                                                                        followup_has_text = True
-                                                                        followup_text_accumulated += part.text
-                                                                        ai_response_content += part.text
-                                                                        yield part.text
-                                                        except Exception as e:
-                                                            print(f"⚠️ Error accessing followup_event.parts: {e}")
-                                                except Exception as followup_error:
-                                                    print(f"❌ Error processing followup response: {followup_error}")
-                                                    traceback.print_exc()
-                                            except Exception as generate_error:
-                                                print(f"❌ Error generating summary: {generate_error}")
-                                                yield f"\n❌ Error generating summary: {str(generate_error)}\n"
-                                            
-                                            # If no followup text was generated, try to get the full response
-                                            if not followup_has_text:
-                                                print("⚠️ No followup text found in stream, trying to get full response...")
-                                                try:
-                                                    # Try to get the response object directly
-                                                    if hasattr(followup_response, "text"):
-                                                        text = followup_response.text
-                                                        if text:
-                                                            has_output = True
-                                                            followup_has_text = True
-                                                            ai_response_content += text
-                                                            yield text
-                                                    elif hasattr(followup_response, "candidates"):
-                                                        for cand in followup_response.candidates:
-                                                            if hasattr(cand, "content") and cand.content:
-                                                                if hasattr(cand.content, "parts"):
-                                                                    for p in cand.content.parts:
-                                                                        if hasattr(p, "text") and p.text:
-                                                                            has_output = True
-                                                                            followup_has_text = True
-                                                                            ai_response_content += p.text
-                                                                            yield p.text
-                                                except Exception as e:
-                                                    print(f"⚠️ Could not extract from followup response object: {e}")
-                                            
-                                            # If still no text, yield a helpful message
-                                            if not followup_has_text:
-                                                print("⚠️ Still no followup text generated, using default message")
-                                                default_summary = "\n\n✅ Analysis completed. Review the code, output, and visualizations above."
-                                                has_output = True
-                                                ai_response_content += default_summary
-                                                yield default_summary
-                                            else:
-                                                print(f"✅ Followup summary generated successfully ({len(followup_text_accumulated)} chars)")
-                                        except Exception as tool_error:
-                                            error_msg = f"Error executing tool `{tool_name}`: {str(tool_error)}"
-                                            print(f"❌ Tool execution error: {tool_error}")
-                                            traceback.print_exc()
-                                            yield f"\n⚠️ {error_msg}\n"
-                                            ai_response_content += error_msg
-                                            
-                                            # Set default values if exception occurred
-                                            tool_result = error_msg
-                                            code_failed = True
-                                            tool_result_preview = error_msg
-                                            has_image = False
-                                            
-                                            # Define followup_prompt even on error
-                                            followup_prompt = f"""The tool execution encountered an error: {error_msg}
-
-Provide a brief summary based on available dataset info. Be concise - text only, no tools."""
-                                            
-                                            # Still try to send followup response even on error
-                                            try:
-                                                # Use the text-only model for generating summaries (no tools available)
-                                                summary_prompt = f"""The tool execution encountered an error, but please still provide insights based on the dataset information:
-
-{followup_prompt}
-
-Provide a brief summary with key insights. Start with "🤖 DataGem:" - be concise, no redundancy."""
-                                                
-                                                # Use the text-only model (no tools) to generate the summary
-                                                followup_response = self.text_model.generate_content(
-                                                    summary_prompt,
-                                                    stream=True
-                                                )
-                                                
-                                                # Process followup response
-                                                followup_has_text = False
-                                                followup_text_accumulated = ""
-                                                
-                                                try:
-                                                    for followup_event in followup_response:
-                                                        try:
-                                                            # Try direct text access
-                                                            if hasattr(followup_event, "text") and followup_event.text:
-                                                                has_output = True
-                                                                followup_has_text = True
-                                                                followup_text_accumulated += followup_event.text
-                                                                ai_response_content += followup_event.text
-                                                                yield followup_event.text
-                                                                continue
-                                                        except Exception as e:
-                                                            print(f"⚠️ Error accessing followup_event.text: {e}")
-                                                        
-                                                        # Try candidates path
-                                                        try:
-                                                            if hasattr(followup_event, "candidates") and followup_event.candidates:
-                                                                for cand in followup_event.candidates:
-                                                                    if hasattr(cand, "content") and cand.content:
-                                                                        if hasattr(cand.content, "parts"):
-                                                                            for p in cand.content.parts:
-                                                                                if hasattr(p, "text") and p.text:
-                                                                                    has_output = True
-                                                                                    followup_has_text = True
-                                                                                    followup_text_accumulated += p.text
-                                                                                    ai_response_content += p.text
-                                                                                    yield p.text
-                                                        except Exception as e:
-                                                            print(f"⚠️ Error accessing followup_event.candidates: {e}")
-                                                        
-                                                        # Try parts directly
-                                                        try:
-                                                            if hasattr(followup_event, "parts"):
-                                                                for part in followup_event.parts:
-                                                                    if hasattr(part, "text") and part.text:
-                                                                        has_output = True
-                                                                        followup_has_text = True
-                                                                        followup_text_accumulated += part.text
-                                                                        ai_response_content += part.text
-                                                                        yield part.text
-                                                        except Exception as e:
-                                                            print(f"⚠️ Error accessing followup_event.parts: {e}")
-                                                except Exception as followup_error:
-                                                    print(f"❌ Error processing followup response: {followup_error}")
-                                                    traceback.print_exc()
-                                                
-                                                if not followup_has_text:
-                                                    print("⚠️ No followup text generated after error, using default message")
-                                                    default_summary = "\n\n⚠️ Analysis encountered an error. Check the code output above for details."
-                                                    has_output = True
-                                                    ai_response_content += default_summary
-                                                    yield default_summary
-                                            except Exception as followup_send_error:
-                                                print(f"❌ Error sending followup after tool error: {followup_send_error}")
-                                                traceback.print_exc()
-            
-            except StopIteration:
-                print("✅ Stream ended normally (StopIteration)")
-            except Exception as stream_error:
-                print(f"❌ Error during stream iteration: {stream_error}")
-                traceback.print_exc()
-
-                # If this is a quota / rate-limit error, try switching to a backup key once
-                if self._is_quota_error(stream_error) and _try_switch_gemini_key():
-                    print("🔁 Stream hit quota error during iteration; switching key and retrying turn...")
-                    self.client = GENAI_CLIENT
-                    try:
-                        # Rebuild stream with the same prompt under the new key
-                        if is_conversational:
-                            cfg = GenerateContentConfig(
-                                system_instruction=[self._text_system_instruction],
-                            )
-                            retry_stream = self.client.models.generate_content_stream(
-                                model=self.model_name,
-                                contents=[enhanced_prompt],
-                                config=cfg,
-                            )
-                        else:
-                            history_db = crud.get_chat_history(db=self.db, user_id=self.user.id)
-                            history_gemini = self.convert_db_history_to_gemini(history_db)
-                            contents = history_gemini + [{"role": "user", "parts": [{"text": enhanced_prompt}]}]
-                            cfg = GenerateContentConfig(
-                                system_instruction=[self._system_instruction],
-                                tools=[run_python_tool_schema, google_search_tool_schema],
-                                tool_config=ToolConfig(
-                                    function_calling_config=FunctionCallingConfig(mode="ANY")
-                                ),
-                            )
-                            retry_stream = self.client.models.generate_content_stream(
-                                model=self.model_name,
-                                contents=contents,
-                                config=cfg,
-                            )
-
-                        # Consume the retry stream and yield its text
-                        for retry_event in retry_stream:
-                            try:
-                                if hasattr(retry_event, "text") and retry_event.text:
-                                    has_output = True
-                                    ai_response_content += retry_event.text
-                                    yield retry_event.text
-                            except Exception:
-                                pass
-                    except Exception as retry_err:
-                        print(f"❌ Retry after quota switch failed: {retry_err}")
-                        yield f"\n\n⚠️ Error processing stream after switching Gemini key: {str(retry_err)}\n"
-                else:
-                    yield f"\n\n⚠️ Error processing stream: {str(stream_error)}\n"
-
-            # --- If Gemini produced no text ---
-            if not has_output:
-                print("⚠️ No output from Gemini - trying to extract from candidates")
-                # For conversational prompts, this shouldn't happen often, but handle it gracefully
-                if is_conversational:
-                    # For conversational prompts, provide a friendly fallback
+                # --- If Gemini produced no text, provide a friendly fallback ---
+                if not has_output:
+                    self._cacheable = False
+                    print("⚠️ No output from Gemini for conversational prompt - using fallback greeting")
                     fallback_response = "Hi! I'm DataGem, your AI data analyst assistant. How can I help you today?"
                     if self.dataset and len(self.dataset) > 0:
                         row_count = len(self.dataset)
@@ -1348,80 +897,365 @@ Provide a brief summary with key insights. Start with "🤖 DataGem:" - be conci
                         fallback_response = f"Hi! I'm DataGem, your AI data analyst. I can see you have a dataset with {row_count} rows and {len(columns)} columns loaded. How can I help you analyze it?"
                     has_output = True
                     ai_response_content = fallback_response
-                    yield fallback_response
-                else:
-                    # For data analysis, try to extract from candidates
-                    try:
-                        # Get the last response to check for text
-                        if hasattr(response_stream, "candidates"):
-                            for candidate in response_stream.candidates:
-                                if hasattr(candidate, "content") and candidate.content:
-                                    if hasattr(candidate.content, "parts"):
-                                        for part in candidate.content.parts:
-                                            if hasattr(part, "text") and part.text:
-                                                has_output = True
-                                                ai_response_content += part.text
-                                                yield part.text
-                    except Exception as e:
-                        print(f"⚠️ Could not extract from candidates: {e}")
-                    
-                    if not has_output:
-                        # If we executed tools but got no text response, provide a helpful message
-                        if ai_response_content:  # We have some content from tool execution
-                            yield "\n\n✅ Analysis completed! The results are shown above.\n"
-                            ai_response_content += "\n\n✅ Analysis completed!"
-                        else:
-                            yield "\n\n⚠️ I processed your request but encountered an issue. Let me try a different approach...\n"
-                            # Try sending a simpler prompt
-                            try:
-                                simple_response = self.chat.send_message(
-                                    f"Please explain the results of the analysis in simple terms.",
-                                    stream=True
-                                )
-                                for simple_event in simple_response:
-                                    try:
-                                        if hasattr(simple_event, "text") and simple_event.text:
-                                            has_output = True
-                                            ai_response_content += simple_event.text
-                                            yield simple_event.text
-                                    except:
-                                        if hasattr(simple_event, "candidates") and simple_event.candidates:
-                                            for cand in simple_event.candidates:
-                                                if hasattr(cand, "content") and cand.content:
-                                                    if hasattr(cand.content, "parts"):
-                                                        for p in cand.content.parts:
-                                                            if hasattr(p, "text") and p.text:
-                                                                has_output = True
-                                                                ai_response_content += p.text
-                                                                yield p.text
-                            except Exception as retry_error:
-                                print(f"❌ Retry also failed: {retry_error}")
-                                yield "\n\n❌ I'm having trouble generating a response. Please try rephrasing your question or check the backend logs for errors.\n"
-                                ai_response_content = "Error generating response."
+                    yield stream_events.text(fallback_response)
 
             print(f"✅ Stream completed. Total output length: {len(ai_response_content)} chars")
 
             # Save AI response
+            self._response_text = ai_response_content
             if ai_response_content:
-                crud.save_chat_message(
-                    db=self.db,
+                self._final_save_started = True
+                await write_behind.save_chat_message(
+                    self.db,
                     user_id=self.user.id,
+                    conversation_id=self.conversation_id,
                     role="model",
                     content=ai_response_content
                 )
 
+        except asyncio.CancelledError:
+            # The response task itself was cancelled (client went away).
+            # Once the final answer is being saved, a truncated copy would
+            # only duplicate it.
+            self.cancel_event.set()
+            if not self._final_save_started:
+                self._save_truncated(ai_response_content)
+            raise
         except Exception as e:
             print("❌ Exception during Gemini stream:")
             traceback.print_exc()
+            self._cacheable = False
             error_message = f"❌ Gemini API Error: {str(e)}"
-            yield error_message
+            yield stream_events.text(error_message)
 
             try:
-                crud.save_chat_message(
-                    db=self.db,
+                await write_behind.save_chat_message(
+                    self.db,
                     user_id=self.user.id,
+                    conversation_id=self.conversation_id,
                     role="model",
                     content=error_message
                 )
             except Exception as save_error:
                 print(f"❌ Failed to save error message: {save_error}")
+
+    # ------------------------------------------------------------------
+    def _stream_model_step(self, contents: list, mode: str, phase: str = "code"):
+        """
+        Yield the content parts of one tool-enabled model call, using the
+        model the router picks for `phase`. Before any part has been
+        produced, a quota error moves to the phase's fallback model (or
+        rotates the API key) and a rejected context cache falls back to the
+        inline prompt; the same step is then retried once.
+        """
+        retried = False
+        model = model_router.ROUTER.pick(phase)
+        while True:
+            produced = False
+            started = time.perf_counter()
+            first_part_at = None
+            usage = None
+            try:
+                config = self._tool_generation_config(mode, model)
+                stream = self.client.models.generate_content_stream(
+                    model=model,
+                    contents=self._inline_prefix() + contents,
+                    config=config,
+                )
+                for event in stream:
+                    if self._is_cancelled():
+                        if hasattr(stream, "close"):
+                            stream.close()
+                        return
+                    usage = getattr(event, "usage_metadata", None) or usage
+                    for part in _event_parts(event):
+                        if first_part_at is None:
+                            first_part_at = time.perf_counter()
+                        produced = True
+                        yield part
+                model_router.ROUTER.record(
+                    phase,
+                    model,
+                    time.perf_counter() - started,
+                    usage=usage,
+                    ttft_s=first_part_at - started if first_part_at else None,
+                )
+                return
+            except Exception as step_error:
+                if self._is_quota_error(step_error):
+                    model_router.ROUTER.mark_throttled(model)
+                if produced or retried:
+                    raise
+                retried = True
+                if self._context_cache_name and mode != "AUTO" and context_cache.is_tool_config_rejection(step_error):
+                    print("🗄️ Cached content can't take a per-call tool config; forced-mode steps go inline")
+                    context_cache.CONTEXT_CACHE.tool_config_rejected = True
+                elif self._context_cache_name and context_cache.is_stale_cache_error(step_error):
+                    print("🗄️ Context cache rejected; retrying step without it...")
+                    context_cache.CONTEXT_CACHE.invalidate(self._context_cache_name)
+                    self._use_context_cache = False
+                elif self._is_quota_error(step_error):
+                    fallback_model = model_router.ROUTER.pick(phase, exclude={model})
+                    if fallback_model != model:
+                        print(f"🚦 Step hit quota error on {model}; retrying with {fallback_model}...")
+                        model = fallback_model
+                    elif _try_switch_gemini_key():
+                        print("🔁 Step hit quota error; switching key and retrying...")
+                        self.client = GENAI_CLIENT
+                    else:
+                        raise
+                else:
+                    raise
+
+    def _execute_tool(self, tool_name: str, tool_args: dict) -> str:
+        """Run one tool call and return its textual result."""
+        if tool_name == "run_python_code":
+            code = tool_args.get("code", "")
+            if not code:
+                return "Code execution failed: no code was provided."
+            print(f"💻 Running Python code ({len(code)} chars)...")
+            tool_result = tools.run_python_code(code, self.dataset, cancel_event=self.cancel_event)
+            print(f"✅ Code execution completed")
+        elif tool_name == "google_search":
+            tool_result = tools.google_search(tool_args.get("query", ""))
+        else:
+            tool_result = f"Error: Unknown tool `{tool_name}`"
+        return tool_result or "Error: Tool execution returned no result."
+
+    async def _execute_tool_async(self, tool_name: str, tool_args: dict, slots: asyncio.Semaphore) -> str:
+        """Run a tool call in a worker thread once one of the turn's `slots` is free."""
+        async with slots:
+            return await asyncio.to_thread(self._execute_tool, tool_name, tool_args)
+
+    async def _run_tool_loop(self, prompt: str, enhanced_prompt: str):
+        """
+        Multi-step function-calling loop for data-analysis prompts.
+
+        Each model step may emit function calls; their results go back into
+        the same conversation as FunctionResponse parts so the model can
+        chain tools (e.g. inspect, then plot) and finally answer in text.
+        The first step must call a tool, the last step allowed by
+        AGENT_MAX_TOOL_STEPS must answer in text.
+
+        When generated code crashes, the trimmed traceback and the failing
+        code go back to the model, which must submit a corrected version;
+        this repeats up to CODE_REPAIR_MAX_ATTEMPTS times within
+        CODE_REPAIR_TIME_BUDGET seconds, each attempt adding one step.
+
+        Yields (chunk, is_model_text) pairs.
+        """
+        print("🔄 Starting google.genai tool loop...")
+        contents = await self.build_history_context(prompt) + [
+            Content(role="user", parts=[Part(text=enhanced_prompt)])
+        ]
+
+        step = 0
+        step_budget = AGENT_MAX_TOOL_STEPS
+        tool_slots = asyncio.Semaphore(TOOL_MAX_PARALLEL)
+        summary_cache_key: Optional[str] = None
+        next_mode = "ANY"
+        repair_attempts = 0
+        repair_started: Optional[float] = None
+        while step < step_budget:
+            step += 1
+            is_repair_step = repair_attempts > 0 and next_mode == "ANY"
+            if next_mode:
+                mode = next_mode
+            elif step == step_budget:
+                mode = "NONE"
+            else:
+                mode = "AUTO"
+            next_mode = None
+
+            model_parts = []
+            function_calls = []
+            step_text = ""
+            # Steps that may still call tools write code; only the text-only step summarises
+            phase = "repair" if is_repair_step else "code" if mode != "NONE" else "summary"
+            async for part in self._iterate_in_thread(self._stream_model_step(contents, mode, phase)):
+                if part.function_call:
+                    function_calls.append(part.function_call)
+                    model_parts.append(part)
+                elif part.text and not part.thought:
+                    step_text += part.text
+                    yield stream_events.text(part.text), True
+                elif part.thought_signature:
+                    model_parts.append(part)
+            if step_text:
+                model_parts.insert(0, Part(text=step_text))
+
+            if self._is_cancelled():
+                return
+            print(f"🧭 Step {step}/{step_budget} ({mode}): {len(function_calls)} tool call(s)")
+            if not function_calls:
+                if summary_cache_key and step_text:
+                    response_cache.SUMMARY_CACHE.set(summary_cache_key, step_text)
+                return
+            summary_cache_key = None
+
+            contents.append(Content(role="model", parts=model_parts))
+            # (display id, provider id, tool name, args)
+            calls = [
+                (fc.id or f"call-{step}-{i + 1}", fc.id, fc.name or "unknown", dict(fc.args) if fc.args else {})
+                for i, fc in enumerate(function_calls)
+            ]
+            tagged = len(calls) > 1
+            results: dict[str, str] = {}
+
+            # SAFEGUARD: Check if this was a conversational prompt
+            is_conv_check = intent.should_block_tool_call(prompt)
+
+            # Independent calls from one model turn run concurrently, each in
+            # its own sandbox process; outputs stream as they finish.
+            pending = {}
+            for call_id, _, tool_name, tool_args in calls:
+                if is_conv_check:
+                    print(f"⚠️ BLOCKED: Attempted tool call '{tool_name}' for conversational prompt '{prompt}'. Ignoring.")
+                    results[call_id] = "Error: Tools are not needed for a conversational message. Reply in text."
+                    continue
+
+                print(f"🔧 Executing tool: {tool_name}" + (f" ({call_id})" if tagged else ""))
+                yield stream_events.status(
+                    "executing", f"Executing {tool_name}", tool=tool_name, call_id=call_id, parallel=tagged
+                ), False
+                if tool_name == "run_python_code" and tool_args.get("code"):
+                    # Show the code being run BEFORE execution
+                    yield stream_events.code(call_id, tool_args["code"], parallel=tagged), False
+                task = asyncio.create_task(self._execute_tool_async(tool_name, tool_args, tool_slots))
+                pending[task] = (call_id, tool_name)
+
+            tools_started = time.monotonic()
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=STREAM_HEARTBEAT_SECONDS, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # Keep idle connections (and proxies in between) alive during long runs
+                    yield stream_events.heartbeat(time.monotonic() - tools_started), False
+                for task in done:
+                    call_id, tool_name = pending.pop(task)
+                    try:
+                        tool_result = task.result()
+                    except Exception as tool_error:
+                        print(f"❌ Tool execution error: {tool_error}")
+                        traceback.print_exception(tool_error)
+                        tool_result = f"Error executing tool `{tool_name}`: {str(tool_error)}"
+                        yield stream_events.status("tool_error", tool_result, call_id=call_id, parallel=tagged), False
+                    else:
+                        self._tools_executed = True
+                        # Yield the tool result output so it's visible
+                        yield stream_events.tool_output(call_id, tool_name, tool_result, parallel=tagged), False
+                    results[call_id] = tool_result
+
+                    # Detect any saved model files signaled by the tool
+                    saved_model_paths = [
+                        line.replace("MODEL_FILE:", "").strip()
+                        for line in tool_result.splitlines()
+                        if line.startswith("MODEL_FILE:") and line.replace("MODEL_FILE:", "").strip()
+                    ]
+                    if saved_model_paths:
+                        yield stream_events.status(
+                            "models_saved", "Models saved", paths=saved_model_paths, call_id=call_id
+                        ), False
+
+            if self._is_cancelled():
+                return
+
+            # Sandbox crashes get an automatic repair attempt while budget remains
+            failed_ids = {
+                call_id for call_id, _, tool_name, _ in calls
+                if tool_name == "run_python_code" and tools.is_execution_failure(results[call_id])
+            }
+            if is_repair_step:
+                metrics.incr("code_repair_successes" if not failed_ids else "code_repair_failures")
+            can_repair = False
+            if failed_ids:
+                if repair_started is None:
+                    repair_started = time.monotonic()
+                    metrics.incr("code_repair_turns")
+                can_repair = (
+                    repair_attempts < CODE_REPAIR_MAX_ATTEMPTS
+                    and time.monotonic() - repair_started < CODE_REPAIR_TIME_BUDGET
+                )
+                if can_repair:
+                    repair_attempts += 1
+                    metrics.incr("code_repair_attempts")
+                    step_budget += 1
+                    next_mode = "ANY"
+                    print(f"🩹 Code failed; requesting repair attempt {repair_attempts}/{CODE_REPAIR_MAX_ATTEMPTS}")
+                    yield stream_events.status(
+                        "repair",
+                        f"🩹 **Code failed, attempting an automatic fix ({repair_attempts}/{CODE_REPAIR_MAX_ATTEMPTS})...**",
+                        attempt=repair_attempts,
+                        max_attempts=CODE_REPAIR_MAX_ATTEMPTS,
+                    ), False
+                else:
+                    metrics.incr("code_repair_exhausted")
+                    self._cacheable = False
+                    next_mode = "NONE"
+
+            # Responses go back in the order the model issued the calls
+            response_parts = []
+            for call_id, provider_id, tool_name, tool_args in calls:
+                tool_result = results[call_id]
+                if call_id in failed_ids:
+                    response = {
+                        "error": tools.trim_traceback(tool_result),
+                        "failed_code": tool_args.get("code", ""),
+                    }
+                    if can_repair:
+                        response["instruction"] = (
+                            "Fix the error and call run_python_code again with the complete corrected code "
+                            f"(repair attempt {repair_attempts} of {CODE_REPAIR_MAX_ATTEMPTS})."
+                        )
+                    else:
+                        response["instruction"] = (
+                            "Automatic repair attempts are exhausted. Do not call tools again; "
+                            "briefly explain the error and suggest 1-2 next steps."
+                        )
+                else:
+                    code_failed = tools.is_execution_failure(tool_result)
+                    condensed = output_condenser.condense(tool_result)
+                    metrics.observe("tool_output_condense_ratio", len(condensed) / max(1, len(tool_result)))
+                    response = {"error" if code_failed else "output": condensed}
+                response_parts.append(Part(function_response=FunctionResponse(
+                    id=provider_id,
+                    name=tool_name,
+                    response=response,
+                )))
+
+            contents.append(Content(role="user", parts=response_parts))
+
+            # Self-sufficient output (a table, a single number, a titled chart)
+            # gets a templated answer instead of a second model call, unless
+            # the user asked for interpretation. Only when the next step
+            # would have to write the closing summary: before that the model
+            # may still chain tools (inspect the columns, then plot).
+            if not failed_ids and not is_conv_check and step + 1 >= step_budget:
+                metrics.incr("summary_checks")
+                direct_answer = None
+                if all(tool_name == "run_python_code" for _, _, tool_name, _ in calls):
+                    direct_answer = output_postprocessor.render_direct_answer(
+                        prompt,
+                        [(tool_args.get("code", ""), results[call_id]) for call_id, _, _, tool_args in calls],
+                    )
+                if direct_answer:
+                    metrics.incr("summary_skipped")
+                    print("⚡ Tool output answers the question - skipping the summary call")
+                    yield stream_events.text("\n" + direct_answer), True
+                    return
+                metrics.incr("summary_called")
+
+            # Tier-2 cache: identical tool output for the same question means
+            # the answer can be replayed without another model call.
+            if not failed_ids and response_cache.RESPONSE_CACHE_ENABLED:
+                summary_cache_key = response_cache.summary_key(
+                    prompt,
+                    model_router.ROUTER.signature,
+                    [json.dumps(part.function_response.response, sort_keys=True) for part in response_parts],
+                )
+                cached_summary = response_cache.SUMMARY_CACHE.get(summary_cache_key) if self.use_cache else None
+                if cached_summary:
+                    print("⚡ Summary cache hit - skipping follow-up model call")
+                    yield stream_events.text(cached_summary), True
+                    return
@@ -1,16 +1,88 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
+import asyncio
+import os
+from datetime import datetime
+import threading
 import traceback
 
 # Internal imports
-from database import database, crud, models as db_models
+from database import async_crud, async_database, crud, database, search, user_cache, write_behind, models as db_models
 from chat.agent import DataAnalystAgent
-import bcrypt
+from chat import response_cache, stream_coalescer, stream_events
+from auth import security
 
 router = APIRouter()
 
+# Use a single anonymous user for all chat sessions (no auth required)
+ANONYMOUS_EMAIL = "anonymous@datagem.ai"
+
+# Largest page GET /chat/history returns
+HISTORY_PAGE_MAX = 200
+
+# How often a streaming /chat response checks whether the client is still there
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+
+async def _watch_disconnect(http_request: Request, cancel_event: threading.Event) -> None:
+    """Set `cancel_event` as soon as the client closes the connection."""
+    while not cancel_event.is_set():
+        if await http_request.is_disconnected():
+            print("🔌 Client disconnected - cancelling the turn")
+            cancel_event.set()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+# Computed once by bootstrap_anonymous_user() at startup
+_anonymous_password_hash: str | None = None
+
+
+def bootstrap_anonymous_user() -> None:
+    """
+    Create the anonymous user at startup (and warm the identity cache), so
+    no request ever has to hash a password.
+    """
+    global _anonymous_password_hash
+    _anonymous_password_hash = security.get_password_hash("anonymous")
+    db = database.SessionLocal()
+    try:
+        user = crud.get_user_by_email(db, ANONYMOUS_EMAIL)
+        if not user:
+            user = crud.create_user(db=db, user=_new_anonymous_user(_anonymous_password_hash))
+            print(f"👤 Created bootstrap user {ANONYMOUS_EMAIL}")
+        user_cache.USER_CACHE.put(user)
+    finally:
+        db.close()
+
+
+def _new_anonymous_user(hashed_password: str) -> db_models.User:
+    return db_models.User(
+        email=ANONYMOUS_EMAIL,
+        hashed_password=hashed_password,
+        full_name="Anonymous User"
+    )
+
+
+async def _get_anonymous_user(db) -> user_cache.CachedUser:
+    """The shared anonymous user (from the identity cache; re-created if the database was reset)."""
+    user = await async_crud.get_cached_user_by_email(db, ANONYMOUS_EMAIL)
+    if not user:
+        hashed_password = _anonymous_password_hash or await security.get_password_hash_async("anonymous")
+        new_user = await async_crud.call("create_user", db, user=_new_anonymous_user(hashed_password))
+        user = user_cache.USER_CACHE.put(new_user)
+    return user
+
+
+async def _get_conversation_or_404(db, user: user_cache.CachedUser, conversation_id: int) -> db_models.Conversation:
+    conversation = await async_crud.call("get_conversation", db, user_id=user.id, conversation_id=conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
+    return conversation
+
 
 # =====================
 # Request Schema
@@ -18,33 +90,82 @@ router = APIRouter()
 class ChatRequest(BaseModel):
     message: str
     dataset: list[dict] | None = None  # Optional dataset data
+    # "text" (markdown, default), "ndjson" or "sse" typed events; see chat/stream_events.py
+    stream_format: str | None = None
+    # Scope history to this conversation (see POST /chat/conversations);
+    # without it the turn uses the messages sent outside any conversation
+    conversation_id: int | None = None
+
+
+class ConversationCreate(BaseModel):
+    title: str | None = None
+    dataset_name: str | None = None
+    # Rows of the dataset the conversation is about; only its fingerprint is stored
+    dataset: list[dict] | None = None
+
+
+class ConversationOut(BaseModel):
+    id: int
+    title: str | None = None
+    dataset_name: str | None = None
+    dataset_fingerprint: str | None = None
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+
+
+class HistoryMessage(BaseModel):
+    id: int
+    role: str
+    content: str
+    timestamp: datetime | None = None
+    # True when `content` is only a preview; GET /chat/messages/{id} has the
+    # full text (unless maintenance stripped it)
+    truncated: bool = False
+    content_size: int | None = None  # length of the full text, when truncated
+
+
+class MessageDetail(HistoryMessage):
+    conversation_id: int | None = None
+
+
+class SearchHit(BaseModel):
+    id: int  # open with GET /chat/messages/{id}
+    role: str
+    conversation_id: int | None = None
+    timestamp: datetime | None = None
+    snippet: str  # matched terms wrapped in <mark></mark>
+    score: float  # higher is better
+
+
+class SearchResults(BaseModel):
+    hits: list[SearchHit]  # best match first
+    next_offset: int | None = None  # pass as `offset` for the next page; None on the last page
+
+
+class HistoryPage(BaseModel):
+    messages: list[HistoryMessage]  # oldest first
+    next_cursor: int | None = None  # pass as `before` to get the previous page; None at the start
 
 
 # =====================
 # Endpoint: /chat (router is included with prefix="/chat" in main.py)
 # =====================
 @router.post("/")
-async def chat_endpoint(request: ChatRequest, db: Session = Depends(database.get_db)):
+async def chat_endpoint(
+    request: ChatRequest,
+    http_request: Request,
+    db: Session | AsyncSession = Depends(async_database.get_chat_db),
+):
     """
     Handles a user message, streams Gemini’s AI response, and returns it to the frontend.
+    Send `X-DataGem-Cache: bypass` (or `Cache-Control: no-cache`) to skip cached answers.
+    Set `stream_format` (or `Accept: application/x-ndjson` / `text/event-stream`)
+    for a typed event stream instead of markdown text.
     """
     try:
-        # Use a single anonymous user for all chat sessions (no auth required)
-        user_email = "anonymous@datagem.ai"
-        user = crud.get_user_by_email(db, user_email)
-
-        if not user:
-            # Create anonymous user with bcrypt directly
-            password_bytes = "anonymous".encode('utf-8')
-            hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
-            hashed_password = hashed.decode('utf-8')
-            
-            new_user = db_models.User(
-                email=user_email,
-                hashed_password=hashed_password,
-                full_name="Anonymous User"
-            )
-            user = crud.create_user(db=db, user=new_user)
+        user = await _get_anonymous_user(db)
+        if request.conversation_id is not None:
+            await _get_conversation_or_404(db, user, request.conversation_id)
 
         # ✅ Initialize AI agent
         if request.dataset:
@@ -52,22 +173,185 @@ async def chat_endpoint(request: ChatRequest, db: Session = Depends(database.get
         else:
             print("⚠️ No dataset provided in request")
         
-        agent = DataAnalystAgent(db=db, user=user, dataset=request.dataset)
+        # Set when the client disconnects; stops the Gemini stream and the sandbox
+        cancel_event = threading.Event()
+        agent = DataAnalystAgent(
+            db=db,
+            user=user,
+            dataset=request.dataset,
+            use_cache=not response_cache.wants_bypass(http_request.headers),
+            cancel_event=cancel_event,
+            conversation_id=request.conversation_id,
+        )
+
+        stream_format = stream_events.negotiate_format(request.stream_format, http_request.headers.get("accept", ""))
+        render = stream_events.RENDERERS[stream_format]
 
         # ✅ Define async stream generator
         async def event_stream():
+            watcher = asyncio.create_task(_watch_disconnect(http_request, cancel_event))
             try:
-                async for token in agent.stream_response(request.message):
-                    yield token
+                async for event in stream_coalescer.coalesce(agent.stream_response(request.message)):
+                    chunk = render(event)
+                    if chunk:
+                        yield chunk
+                if stream_format != "text":
+                    yield render(stream_events.done())
+            except asyncio.CancelledError:
+                cancel_event.set()
+                raise
             except Exception as stream_err:
                 print("❌ Error while streaming response:")
                 traceback.print_exc()
-                yield f"\n[Stream Error] {str(stream_err)}"
+                yield render(stream_events.text(f"\n[Stream Error] {str(stream_err)}"))
+            finally:
+                watcher.cancel()
 
         # ✅ Return streaming response
-        return StreamingResponse(event_stream(), media_type="text/plain")
+        return StreamingResponse(event_stream(), media_type=stream_events.MEDIA_TYPES[stream_format])
 
+    except HTTPException:
+        raise
     except Exception as e:
         print("❌ Error in /chat endpoint:")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Chat endpoint failed: {str(e)}")
+
+
+# =====================
+# Endpoint: /chat/history
+# =====================
+@router.get("/history", response_model=HistoryPage)
+async def chat_history(
+    before: int | None = Query(None, description="`next_cursor` from the previous page"),
+    limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX),
+    conversation_id: int | None = Query(None, description="Omit for messages sent outside any conversation"),
+    db: Session | AsyncSession = Depends(async_database.get_chat_db),
+):
+    """
+    Pages backwards through the chat history, newest page first. Uses keyset
+    pagination, so deep pages cost the same as the first one.
+    """
+    user = await async_crud.get_cached_user_by_email(db, ANONYMOUS_EMAIL)
+    if not user:
+        return HistoryPage(messages=[])
+    if conversation_id is not None:
+        await _get_conversation_or_404(db, user, conversation_id)
+
+    await write_behind.read_barrier()
+    # One extra row tells whether an older page exists
+    rows = await async_crud.call(
+        "get_chat_history_page",
+        db,
+        user_id=user.id,
+        before=before,
+        limit=limit + 1,
+        conversation_id=conversation_id,
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return HistoryPage(
+        messages=[
+            HistoryMessage(
+                id=msg.id,
+                role=msg.role,
+                content=msg.content,
+                timestamp=msg.timestamp,
+                truncated=msg.content_size is not None,
+                content_size=msg.content_size,
+            )
+            for msg in reversed(rows)
+        ],
+        next_cursor=rows[-1].id if has_more else None,
+    )
+
+
+@router.get("/messages/{message_id}", response_model=MessageDetail)
+async def chat_message(
+    message_id: int,
+    db: Session | AsyncSession = Depends(async_database.get_chat_db),
+):
+    """One message with its full content (history pages only carry previews of large messages)."""
+    user = await async_crud.get_cached_user_by_email(db, ANONYMOUS_EMAIL)
+    message = None
+    if user:
+        await write_behind.read_barrier()
+        message = await async_crud.call("get_chat_message", db, user_id=user.id, message_id=message_id)
+    if message is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    content = await async_crud.call("get_message_content", db, message=message)
+    return MessageDetail(
+        id=message.id,
+        role=message.role,
+        content=content,
+        timestamp=message.timestamp,
+        conversation_id=message.conversation_id,
+        truncated=False,
+        content_size=message.content_size,
+    )
+
+@router.get("/search", response_model=SearchResults)
+async def search_history(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=search.SEARCH_PAGE_MAX),
+    offset: int = Query(0, ge=0),
+    conversation_id: int | None = Query(None, description="Only search this conversation"),
+    db: Session | AsyncSession = Depends(async_database.get_chat_db),
+):
+    """Full-text search over past messages, ranked, with highlighted snippets."""
+    if search.SEARCH_BACKEND is None:
+        raise HTTPException(status_code=503, detail="Search is not available on this database")
+    user = await async_crud.get_cached_user_by_email(db, ANONYMOUS_EMAIL)
+    if not user:
+        return SearchResults(hits=[])
+
+    await write_behind.read_barrier()
+    # One extra row tells whether another page exists
+    rows = await async_crud.call(
+        "search_chat_messages",
+        db,
+        user_id=user.id,
+        query=q,
+        conversation_id=conversation_id,
+        limit=limit + 1,
+        offset=offset,
+    )
+    return SearchResults(
+        hits=[SearchHit.model_validate(row, from_attributes=True) for row in rows[:limit]],
+        next_offset=offset + limit if len(rows) > limit else None,
+    )
+
+# =====================
+# Endpoints: /chat/conversations
+# =====================
+@router.post("/conversations", response_model=ConversationOut, status_code=201)
+async def create_conversation(
+    request: ConversationCreate,
+    db: Session | AsyncSession = Depends(async_database.get_chat_db),
+):
+    """Starts a conversation; pass its `id` as `conversation_id` to POST /chat/."""
+    user = await _get_anonymous_user(db)
+    fingerprint = None
+    if request.dataset:
+        fingerprint = await asyncio.to_thread(response_cache.dataset_fingerprint, request.dataset)
+    conversation = db_models.Conversation(
+        user_id=user.id,
+        title=request.title,
+        dataset_name=request.dataset_name,
+        dataset_fingerprint=fingerprint,
+    )
+    conversation = await async_crud.call("create_conversation", db, conversation=conversation)
+    return ConversationOut.model_validate(conversation, from_attributes=True)
+
+
+@router.get("/conversations", response_model=list[ConversationOut])
+async def list_conversations(
+    limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX),
+    db: Session | AsyncSession = Depends(async_database.get_chat_db),
+):
+    """Lists conversations, most recently active first."""
+    user = await async_crud.get_cached_user_by_email(db, ANONYMOUS_EMAIL)
+    if not user:
+        return []
+    conversations = await async_crud.call("list_conversations", db, user_id=user.id, limit=limit)
+    return [ConversationOut.model_validate(c, from_attributes=True) for c in conversations]
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from google.genai import types as genai_types
+
+#
+# Provider-side context caching for the stable part of the tool prompt:
+# system instruction, tool declarations and the per-dataset schema.
+#
+# Gemini caches are bound to the API key and model that created them, so
+# entries are keyed by (key index, model, content hash): one cache per
+# dataset and model. After a key rotation the next request simply creates a
+# fresh cache under the new key. The per-step function-calling mode is not
+# part of the prefix; it is sent with each request.
+#
+
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+# Extend a cache's TTL when it is this close to expiring
+CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = 300
+# After a failed create (e.g. prefix below the model's minimum cacheable size)
+# don't try the same prefix again for this long
+CONTEXT_CACHE_RETRY_AFTER_SECONDS = 600
+
+
+def _to_jsonable(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(v) for v in value]
+    return value
+
+
+def content_hash(system_instruction: str, tools: list, contents: list) -> str:
+    """Stable digest of everything that goes into a cached prefix."""
+    payload = {
+        "system_instruction": system_instruction,
+        "tools": _to_jsonable(tools),
+        "contents": _to_jsonable(contents),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ContextCache:
+    """Tracks the cached-content resources this process has created."""
+
+    def __init__(self):
+        # (key_index, model, digest) -> (cache name, expires_at epoch seconds)
+        self._entries: dict[tuple[int, str, str], tuple[str, float]] = {}
+        # (key_index, model, digest) -> epoch seconds of the last failed create
+        self._failures: dict[tuple[int, str, str], float] = {}
+        self._lock = threading.Lock()
+        # Set once the provider refuses a per-request tool_config next to a
+        # cached prefix; steps that need a forced mode then go inline
+        self.tool_config_rejected = False
+        self.hits = 0
+        self.creates = 0
+
+    def get_or_create(
+        self,
+        client,
+        key_index: int,
+        model: str,
+        system_instruction: str,
+        tools: list,
+        contents: list,
+    ) -> Optional[str]:
+        """
+        Return the name of a live cache for this prefix, creating or
+        refreshing it as needed. Returns None when caching is unavailable,
+        in which case the caller should send the prefix inline.
+        """
+        if not CONTEXT_CACHE_ENABLED or client is None:
+            return None
+
+        digest = content_hash(system_instruction, tools, contents)
+        entry_key = (key_index, model, digest)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            failed_at = self._failures.get(entry_key)
+        if failed_at and now - failed_at < CONTEXT_CACHE_RETRY_AFTER_SECONDS:
+            return None
+
+        if entry:
+            name, expires_at = entry
+            if expires_at - now > CONTEXT_CACHE_REFRESH_MARGIN_SECONDS:
+                self.hits += 1
+                return name
+            if expires_at > now:
+                refreshed = self._refresh(client, entry_key, name)
+                if refreshed:
+                    self.hits += 1
+                    return refreshed
+
+        try:
+            cached = client.caches.create(
+                model=model,
+                config=genai_types.CreateCachedContentConfig(
+                    display_name=f"datagem-{digest[:16]}",
+                    system_instruction=system_instruction,
+                    tools=tools,
+                    contents=contents,
+                    ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s",
+                ),
+            )
+        except Exception as e:
+            print(f"⚠️ Context cache unavailable, sending prompt inline: {e}")
+            with self._lock:
+                self._failures[entry_key] = now
+            return None
+
+        self.creates += 1
+        with self._lock:
+            self._entries[entry_key] = (cached.name, self._expiry_of(cached, now))
+            self._failures.pop(entry_key, None)
+        usage = getattr(cached, "usage_metadata", None)
+        tokens = getattr(usage, "total_token_count", None) if usage else None
+        print(f"🗄️ Created context cache {cached.name} ({tokens or '?'} tokens)")
+        return cached.name
+
+    def invalidate(self, name: str) -> None:
+        """Forget a cache the provider no longer recognises."""
+        with self._lock:
+            for entry_key, (entry_name, _) in list(self._entries.items()):
+                if entry_name == name:
+                    del self._entries[entry_key]
+
+    # ------------------------------------------------------------------
+    def _refresh(self, client, entry_key, name: str) -> Optional[str]:
+        try:
+            cached = client.caches.update(
+                name=name,
+                config=genai_types.UpdateCachedContentConfig(ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s"),
+            )
+        except Exception as e:
+            print(f"⚠️ Could not extend context cache {name}: {e}")
+            self.invalidate(name)
+            return None
+        with self._lock:
+            self._entries[entry_key] = (name, self._expiry_of(cached, time.time()))
+        return name
+
+    @staticmethod
+    def _expiry_of(cached, now: float) -> float:
+        expire_time = getattr(cached, "expire_time", None)
+        if expire_time is not None:
+            try:
+                return expire_time.timestamp()
+            except Exception:
+                pass
+        return now + CONTEXT_CACHE_TTL_SECONDS
+
+
+def is_tool_config_rejection(err: Exception) -> bool:
+    """True when a request was refused for combining cached content with a tool_config."""
+    msg = str(err).lower().replace(" ", "_")
+    return "tool_config" in msg and "cached" in msg
+
+
+def is_stale_cache_error(err: Exception) -> bool:
+    """True when a request failed because its cached content is gone or foreign."""
+    msg = str(err).lower()
+    return "cachedcontent" in msg.replace(" ", "").replace("_", "") or "cached content" in msg
+
+
+CONTEXT_CACHE = ContextCache()
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+from pathlib import Path
+
+#
+# Prompt classification and the local (no-LLM) responder for greetings and
+# "what can you do?"-style questions. Keyword lists are compiled into one
+# regex each at import time, so classifying a prompt is a single scan.
+#
+
+# Single word greetings - always conversational
+SINGLE_WORD_GREETINGS = ["hey", "hi", "hello", "hey!", "hi!", "hello!"]
+
+# Multi-word conversational phrases
+CONVERSATIONAL_KEYWORDS = ["good morning", "good evening", "good afternoon", "good night",
+                           "what can you do", "what all can you do", "who are you", "tell me about yourself",
+                           "thanks", "thank you", "how are you", "what's up", "what's going on"]
+
+# Data analysis keywords - if present, it's NOT conversational
+DATA_KEYWORDS = ["data", "dataset", "analyze", "analysis", "statistics", "visualize", "visualization",
+                 "plot", "chart", "graph", "correlation", "heatmap", "scatter", "box plot", "histogram",
+                 "create a", "show me", "display", "calculate", "find", "insights", "summary report",
+                 "pdf", "html", "model", "predict"]
+
+# Narrower lists used to block tool calls the model makes for small talk
+TOOL_GUARD_CONVERSATIONAL = ["good morning", "good evening", "what can you do", "who are you"]
+TOOL_GUARD_DATA = ["data", "analyze", "plot", "chart", "create", "show"]
+
+
+def _compile_keywords(keywords: list[str]) -> re.Pattern:
+    # Longest first so overlapping phrases behave like the old substring scans
+    alternatives = sorted((re.escape(kw) for kw in keywords), key=len, reverse=True)
+    return re.compile("|".join(alternatives))
+
+
+_SINGLE_GREETINGS = frozenset(SINGLE_WORD_GREETINGS)
+_CONVERSATIONAL_RE = _compile_keywords(CONVERSATIONAL_KEYWORDS)
+_DATA_RE = _compile_keywords(DATA_KEYWORDS)
+_GUARD_CONVERSATIONAL_RE = _compile_keywords(TOOL_GUARD_CONVERSATIONAL)
+_GUARD_DATA_RE = _compile_keywords(TOOL_GUARD_DATA)
+
+
+def is_conversational(prompt: str) -> bool:
+    """
+    A prompt is conversational if it is a single word greeting, or it has
+    conversational keywords and no data keywords.
+    """
+    prompt_lower = prompt.lower().strip()
+    if prompt_lower in _SINGLE_GREETINGS:
+        return True
+    return bool(_CONVERSATIONAL_RE.search(prompt_lower)) and not _DATA_RE.search(prompt_lower)
+
+
+def should_block_tool_call(prompt: str) -> bool:
+    """Safeguard: True if a tool call for this prompt is almost certainly small talk."""
+    prompt_lower = prompt.lower().strip()
+    if prompt_lower in _SINGLE_GREETINGS:
+        return True
+    return bool(_GUARD_CONVERSATIONAL_RE.search(prompt_lower)) and not _GUARD_DATA_RE.search(prompt_lower)
+
+
+# =====================
+# Local responder
+# =====================
+
+DEFAULT_RULES_PATH = Path(__file__).resolve().parent / "responder_rules.json"
+RESPONDER_RULES_PATH = Path(os.getenv("RESPONDER_RULES_PATH", str(DEFAULT_RULES_PATH)))
+
+
+class LocalResponder:
+    """
+    Answers conversational prompts from templates in a rules file. Each
+    rule has regex `patterns` and a `response` template; the first rule
+    whose pattern matches wins. Templates may use {dataset_sentence},
+    {rows}, {columns} and {column_preview}.
+    """
+
+    def __init__(self, rules_path: Path = RESPONDER_RULES_PATH):
+        with open(rules_path, encoding="utf-8") as f:
+            config = json.load(f)
+        self.enabled = config.get("enabled", True)
+        self.dataset_sentence = config.get("dataset_sentence", "")
+        self.no_dataset_sentence = config.get("no_dataset_sentence", "")
+        self.rules = [
+            (rule["name"], re.compile("|".join(f"(?:{p})" for p in rule["patterns"])), rule["response"])
+            for rule in config.get("rules", [])
+        ]
+
+    def respond(self, prompt: str, dataset: list[dict] | None) -> str | None:
+        """The templated answer for this prompt, or None if no rule matches."""
+        if not self.enabled:
+            return None
+        prompt_lower = prompt.lower().strip()
+        for name, pattern, template in self.rules:
+            if pattern.search(prompt_lower):
+                print(f"⚡ Local responder matched rule '{name}'")
+                return template.format(**self._dataset_fields(dataset))
+        return None
+
+    def _dataset_fields(self, dataset: list[dict] | None) -> dict:
+        if not dataset:
+            return {"dataset_sentence": self.no_dataset_sentence, "rows": 0, "columns": 0, "column_preview": ""}
+        columns = list(dataset[0].keys())
+        preview = ", ".join(columns[:5]) + (", ..." if len(columns) > 5 else "")
+        fields = {"rows": len(dataset), "columns": len(columns), "column_preview": preview}
+        fields["dataset_sentence"] = self.dataset_sentence.format(**fields)
+        return fields
+
+
+try:
+    LOCAL_RESPONDER: LocalResponder | None = LocalResponder()
+except Exception as e:
+    print(f"⚠️ Could not load responder rules from {RESPONDER_RULES_PATH}: {e}")
+    LOCAL_RESPONDER = None
@@ -0,0 +1,83 @@
+import threading
+from collections import defaultdict, deque
+
+#
+# Lightweight in-process metrics, exposed as JSON on GET /metrics.
+# Counters only ever go up; observations keep count/sum/max plus a window
+# of recent values for percentiles.
+#
+
+RECENT_WINDOW = 500
+
+_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(float)
+_observations: dict[str, dict] = {}
+
+# Derived rates reported by snapshot(): name -> (numerator, denominator)
+RATES = {
+    "code_repair_success_rate": ("code_repair_successes", "code_repair_attempts"),
+    "summary_skip_rate": ("summary_skipped", "summary_checks"),
+}
+
+
+def incr(name: str, value: float = 1) -> None:
+    """Increase a counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+    """Record one measurement (e.g. a latency in seconds)."""
+    with _lock:
+        obs = _observations.get(name)
+        if obs is None:
+            obs = _observations[name] = {"count": 0, "sum": 0.0, "max": 0.0, "recent": deque(maxlen=RECENT_WINDOW)}
+        obs["count"] += 1
+        obs["sum"] += value
+        obs["max"] = max(obs["max"], value)
+        obs["recent"].append(value)
+
+
+def percentile(name: str, pct: float) -> float | None:
+    """Percentile (0-100) over the recent window of an observation, or None if empty."""
+    with _lock:
+        obs = _observations.get(name)
+        values = sorted(obs["recent"]) if obs else []
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def ratio(numerator: str, denominator: str) -> float | None:
+    """counter[numerator] / counter[denominator], or None when nothing was counted."""
+    with _lock:
+        total = _counters.get(denominator, 0)
+        part = _counters.get(numerator, 0)
+    return part / total if total else None
+
+
+def summary(name: str) -> dict | None:
+    """count/avg/max/p50/p95 of one observation, or None if never observed."""
+    with _lock:
+        obs = _observations.get(name)
+        if obs is None:
+            return None
+        count, total, peak = obs["count"], obs["sum"], obs["max"]
+    return {
+        "count": count,
+        "avg": total / count if count else 0.0,
+        "max": peak,
+        "p50": percentile(name, 50),
+        "p95": percentile(name, 95),
+    }
+
+
+def snapshot() -> dict:
+    """All counters and observation summaries."""
+    with _lock:
+        counters = dict(_counters)
+        names = list(_observations)
+    observations = {name: summary(name) for name in names}
+    rates = {name: ratio(num, den) for name, (num, den) in RATES.items()}
+    return {"counters": counters, "rates": rates, "observations": observations}
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from chat import metrics
+
+#
+# Per-phase model routing.
+#
+# Phases of a turn:
+#   chat    - conversational answers the local responder could not handle
+#   code    - tool steps (write the analysis code, or chain further tools)
+#   repair  - steps that fix code which crashed in the sandbox
+#   summary - the closing text-only step, when tools are no longer allowed
+#
+# Each phase lists candidate models in preference order with optional
+# latency and cost SLOs. A model is skipped while it is throttled (quota /
+# rate-limit errors) or while its p50 latency or average cost for the phase
+# over its calls in the last slo_window_seconds is over the SLO. Those
+# samples expire, so a skipped model is tried again once the window has
+# passed. Latency and token usage are recorded per phase and per model in
+# /metrics so the table can be tuned with real data.
+#
+# Override the table with MODEL_ROUTING_CONFIG: inline JSON or a path to a
+# JSON file with the same shape as DEFAULT_ROUTING.
+#
+
+DEFAULT_ROUTING = {
+    "phases": {
+        "chat": {"models": ["gemini-2.5-flash-lite"], "latency_slo_ms": 4000},
+        "code": {"models": ["gemini-2.5-flash", "gemini-2.5-flash-lite"], "latency_slo_ms": 20000},
+        "repair": {"models": ["gemini-2.5-flash", "gemini-2.5-flash-lite"], "latency_slo_ms": 20000},
+        "summary": {"models": ["gemini-2.5-flash-lite", "gemini-2.5-flash"], "latency_slo_ms": 8000},
+    },
+    # USD per 1M tokens, used for the optional cost_slo_usd (per call) checks
+    "model_prices": {
+        "gemini-2.5-flash": {"input": 0.30, "output": 2.50},
+        "gemini-2.5-flash-lite": {"input": 0.10, "output": 0.40},
+    },
+    # How long a throttled model is avoided
+    "throttle_cooldown_seconds": 60,
+    # Recent calls needed before SLOs are enforced for a model
+    "min_samples": 5,
+    # SLOs are checked against the last slo_window_calls calls of a model
+    # made within slo_window_seconds
+    "slo_window_seconds": 600,
+    "slo_window_calls": 20,
+}
+
+
+def _load_routing_config() -> dict:
+    raw = os.getenv("MODEL_ROUTING_CONFIG", "").strip()
+    if not raw:
+        return DEFAULT_ROUTING
+    try:
+        if raw.startswith("{"):
+            config = json.loads(raw)
+        else:
+            config = json.loads(Path(raw).read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"⚠️ Invalid MODEL_ROUTING_CONFIG ({e}); using default model routing")
+        return DEFAULT_ROUTING
+    return {**DEFAULT_ROUTING, **config}
+
+
+class ModelRouter:
+    """Picks a model per phase and records how each model performs."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.phases: dict[str, dict] = config["phases"]
+        self.prices: dict[str, dict] = config.get("model_prices", {})
+        self.cooldown = float(config.get("throttle_cooldown_seconds", 60))
+        self.min_samples = int(config.get("min_samples", 5))
+        self.slo_window = float(config.get("slo_window_seconds", 600))
+        self.slo_window_calls = int(config.get("slo_window_calls", 20))
+        self._throttled_until: dict[str, float] = {}
+        # (phase, model) -> recent (time, latency_s, cost_usd or None)
+        self._recent: dict[tuple[str, str], deque] = {}
+        self._lock = threading.Lock()
+        self.signature = hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def candidates(self, phase: str) -> list[str]:
+        return list(self.phases.get(phase, self.phases["code"])["models"])
+
+    def pick(self, phase: str, exclude: set[str] | None = None) -> str:
+        """The first candidate for the phase that is healthy and within its SLOs."""
+        route = self.phases.get(phase, self.phases["code"])
+        candidates = [m for m in route["models"] if m not in (exclude or set())] or list(route["models"])
+        now = time.time()
+        available = []
+        for model in candidates:
+            with self._lock:
+                throttled = self._throttled_until.get(model, 0) > now
+            if throttled:
+                continue
+            available.append(model)
+            if self._within_slo(phase, model, route):
+                return model
+        # Every model is over its SLO (or throttled): take the first one not throttled
+        return available[0] if available else candidates[0]
+
+    def _within_slo(self, phase: str, model: str, route: dict) -> bool:
+        horizon = time.time() - self.slo_window
+        with self._lock:
+            samples = [sample for sample in self._recent.get((phase, model), ()) if sample[0] >= horizon]
+        if len(samples) < self.min_samples:
+            return True
+        slo_ms = route.get("latency_slo_ms")
+        latencies = sorted(latency for _, latency, _ in samples)
+        if slo_ms and latencies[len(latencies) // 2] * 1000 > slo_ms:
+            return False
+        cost_slo = route.get("cost_slo_usd")
+        costs = [cost for _, _, cost in samples if cost is not None]
+        if cost_slo and costs and sum(costs) / len(costs) > cost_slo:
+            return False
+        return True
+
+    def mark_throttled(self, model: str) -> None:
+        with self._lock:
+            self._throttled_until[model] = time.time() + self.cooldown
+        metrics.incr(f"model.{model}.throttled")
+        print(f"🚦 Model {model} throttled; avoiding it for {self.cooldown:.0f}s")
+
+    def record(self, phase: str, model: str, latency_s: float, usage=None, ttft_s: float | None = None) -> None:
+        """Record latency (and token usage, if the response carried it) for one model call."""
+        metrics.observe(f"phase.{phase}.latency_s", latency_s)
+        metrics.observe(f"model.{phase}.{model}.latency_s", latency_s)
+        metrics.incr(f"phase.{phase}.calls")
+        if ttft_s is not None:
+            metrics.observe(f"phase.{phase}.ttft_s", ttft_s)
+        cost = self._record_usage(phase, model, usage) if usage is not None else None
+        with self._lock:
+            recent = self._recent.setdefault((phase, model), deque(maxlen=self.slo_window_calls))
+            recent.append((time.time(), latency_s, cost))
+
+    def _record_usage(self, phase: str, model: str, usage) -> float | None:
+        """Token counters for one call; returns its cost when the model has a price."""
+        input_tokens = getattr(usage, "prompt_token_count", None) or 0
+        output_tokens = getattr(usage, "candidates_token_count", None) or 0
+        cached_tokens = getattr(usage, "cached_content_token_count", None) or 0
+        metrics.incr(f"phase.{phase}.input_tokens", input_tokens)
+        metrics.incr(f"phase.{phase}.output_tokens", output_tokens)
+        metrics.incr(f"phase.{phase}.cached_tokens", cached_tokens)
+        price = self.prices.get(model)
+        if price:
+            cost = (input_tokens * price.get("input", 0) + output_tokens * price.get("output", 0)) / 1_000_000
+            metrics.observe(f"model.{phase}.{model}.cost_usd", cost)
+            return cost
+        return None
+
+
+ROUTER = ModelRouter(_load_routing_config())
@@ -0,0 +1,199 @@
+import math
+import os
+import re
+
+#
+# Condenses sandbox output before it goes back to the model as a
+# FunctionResponse. The output is split into segments (text, markdown
+# tables, images, warnings) and a token budget is shared between them:
+# images become one-line placeholders, tables keep their header plus head
+# and tail rows with a row count, repeated warnings are collapsed and long
+# text keeps its beginning and end.
+#
+
+TOOL_RESULT_TOKEN_BUDGET = int(os.getenv("TOOL_RESULT_TOKEN_BUDGET", "2000"))
+# Share of the budget warnings may use at most
+WARNING_BUDGET_SHARE = 0.15
+# Table cells longer than this are shortened
+MAX_CELL_CHARS = 60
+# Characters per token used for budgeting (rough but stable)
+CHARS_PER_TOKEN = 4
+
+TEXT, TABLE, IMAGE, WARNING = "text", "table", "image", "warning"
+
+_IMAGE_PREFIX = "PLOT_IMG_BASE64:"
+_BASE64_RUN_RE = re.compile(r"[A-Za-z0-9+/=]{200,}")
+_TABLE_SEPARATOR_RE = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$")
+_WARNING_HEADER_RE = re.compile(r"^--- (?:Errors/)?Warnings ---$")
+_WARNING_LINE_RE = re.compile(r"\b(?:\w*Warning|warnings\.warn)\b")
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _lines_tokens(lines: list[str]) -> int:
+    return sum(_tokens(line) + 1 for line in lines)
+
+
+def parse_segments(output: str) -> list[tuple[str, list[str]]]:
+    """Split sandbox output into (kind, lines) segments, in order."""
+    segments: list[tuple[str, list[str]]] = []
+    lines = output.splitlines()
+    in_warnings = False
+
+    def _append(kind: str, line: str) -> None:
+        if segments and segments[-1][0] == kind and kind in (TEXT, WARNING):
+            segments[-1][1].append(line)
+        else:
+            segments.append((kind, [line]))
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if _WARNING_HEADER_RE.match(stripped):
+            in_warnings = True
+            i += 1
+            continue
+        if stripped.startswith(_IMAGE_PREFIX) or _BASE64_RUN_RE.search(stripped):
+            segments.append((IMAGE, [stripped]))
+        elif (
+            stripped.startswith("|")
+            and i + 1 < len(lines)
+            and _TABLE_SEPARATOR_RE.match(lines[i + 1].strip())
+        ):
+            end = i + 2
+            while end < len(lines) and lines[end].strip().startswith("|"):
+                end += 1
+            segments.append((TABLE, [l.strip() for l in lines[i:end]]))
+            i = end
+            continue
+        elif in_warnings or _WARNING_LINE_RE.search(stripped):
+            if stripped:
+                _append(WARNING, line)
+        else:
+            _append(TEXT, line)
+        i += 1
+
+    # Blank-only text segments carry nothing
+    return [(kind, seg) for kind, seg in segments if kind != TEXT or any(l.strip() for l in seg)]
+
+
+def _image_placeholder(line: str, number: int) -> str:
+    payload = line[len(_IMAGE_PREFIX):] if line.startswith(_IMAGE_PREFIX) else line
+    size_kb = len(payload) * 3 / 4 / 1024
+    return f"[image {number}: plot rendered for the user ({size_kb:.0f} KB), omitted]"
+
+
+def _shorten_cells(row: str) -> str:
+    cells = row.strip("|").split("|")
+    short = [
+        cell if len(cell.strip()) <= MAX_CELL_CHARS else f" {cell.strip()[:MAX_CELL_CHARS - 1]}… "
+        for cell in cells
+    ]
+    return "|" + "|".join(short) + "|"
+
+
+def _condense_table(lines: list[str], budget: int) -> list[str]:
+    header = [_shorten_cells(lines[0]), lines[1]]
+    rows = [_shorten_cells(row) for row in lines[2:]]
+    if _lines_tokens(header + rows) <= budget:
+        return header + rows
+    avg_row = max(1, _lines_tokens(rows) // max(1, len(rows)))
+    # Header, the omission marker and the row-count note come first
+    fit = max(2, (budget - _lines_tokens(header) - 12) // avg_row)
+    head = max(1, math.ceil(fit * 0.7))
+    tail = max(1, fit - head)
+    omitted = len(rows) - head - tail
+    if omitted <= 0:
+        return header + rows
+    return header + rows[:head] + [f"| ... {omitted} rows omitted ... |"] + rows[-tail:] + [
+        f"({len(rows)} rows in total)"
+    ]
+
+
+def _condense_text(lines: list[str], budget: int) -> list[str]:
+    if _lines_tokens(lines) <= budget:
+        return lines
+    budget_chars = budget * CHARS_PER_TOKEN
+    if len(lines) == 1:
+        line = lines[0]
+        keep = max(0, budget_chars - 40)
+        return [f"{line[:keep * 2 // 3]} ... ({len(line) - keep} chars omitted) ... {line[len(line) - keep // 3:]}"]
+    # Keep roughly two thirds of the budget for the beginning, the rest for the end
+    head, used = [], 0
+    for line in lines:
+        cost = _tokens(line) + 1
+        if used + cost > budget * 2 // 3:
+            break
+        head.append(line)
+        used += cost
+    tail, used = [], 0
+    for line in reversed(lines[len(head):]):
+        cost = _tokens(line) + 1
+        if used + cost > budget // 3:
+            break
+        tail.insert(0, line)
+        used += cost
+    omitted = len(lines) - len(head) - len(tail)
+    return head + [f"... ({omitted} lines omitted) ..."] + tail
+
+
+def _condense_warnings(lines: list[str], budget: int) -> list[str]:
+    counts: dict[str, int] = {}
+    for line in lines:
+        key = line.strip()
+        counts[key] = counts.get(key, 0) + 1
+    collapsed = [line if n == 1 else f"{line} (x{n})" for line, n in counts.items()]
+    return _condense_text(collapsed, budget)
+
+
+def _allocate(needs: list[int], budget: int) -> list[int]:
+    """Fair share: small segments get what they need, large ones split what's left."""
+    allotted = [0] * len(needs)
+    remaining = budget
+    order = sorted(range(len(needs)), key=lambda i: needs[i])
+    for position, index in enumerate(order):
+        share = remaining // (len(order) - position)
+        allotted[index] = min(needs[index], share)
+        remaining -= allotted[index]
+    return allotted
+
+
+def condense(output: str, budget: int = TOOL_RESULT_TOKEN_BUDGET) -> str:
+    """Sandbox output condensed to roughly `budget` tokens for the model."""
+    segments = parse_segments(output)
+    if not segments:
+        return output.strip()
+
+    rendered: list[list[str] | None] = [None] * len(segments)
+    image_count = 0
+    for index, (kind, lines) in enumerate(segments):
+        if kind == IMAGE:
+            image_count += 1
+            rendered[index] = [_image_placeholder(lines[0], image_count)]
+    remaining = budget - sum(_lines_tokens(r) for r in rendered if r)
+
+    warning_indices = [i for i, (kind, _) in enumerate(segments) if kind == WARNING]
+    if warning_indices:
+        warning_budget = int(budget * WARNING_BUDGET_SHARE)
+        needs = [_lines_tokens(segments[i][1]) for i in warning_indices]
+        for index, allotted in zip(warning_indices, _allocate(needs, warning_budget)):
+            rendered[index] = _condense_warnings(segments[index][1], max(allotted, 8))
+            remaining -= _lines_tokens(rendered[index])
+
+    content_indices = [i for i, (kind, _) in enumerate(segments) if kind in (TEXT, TABLE)]
+    needs = [_lines_tokens(segments[i][1]) for i in content_indices]
+    for index, allotted in zip(content_indices, _allocate(needs, max(remaining, 0))):
+        kind, lines = segments[index]
+        allotted = max(allotted, 16)
+        rendered[index] = _condense_table(lines, allotted) if kind == TABLE else _condense_text(lines, allotted)
+
+    parts = []
+    for (kind, _), lines in zip(segments, rendered):
+        if kind == WARNING:
+            parts.append("--- Warnings ---\n" + "\n".join(lines))
+        else:
+            parts.append("\n".join(lines))
+    return "\n".join(parts).strip()
@@ -0,0 +1,170 @@
+import os
+import re
+
+#
+# Direct answers from tool output.
+#
+# Many questions ("show value counts of X", "describe the data", "average
+# salary?") are fully answered by what the sandbox printed: a table, a single
+# number, or a titled chart. For those the agent renders a deterministic
+# answer here instead of a second Gemini call. Prompts that ask for
+# interpretation ("why", "explain", "what does this tell us", ...) still go
+# to the model.
+#
+
+DIRECT_ANSWERS_ENABLED = os.getenv("DIRECT_ANSWERS_ENABLED", "1") == "1"
+
+# Asking for any of these means the user wants prose, not just the numbers
+# (whole words; a plural "s" is allowed, so "trends" counts but "trending" doesn't)
+INTERPRETATION_KEYWORDS = ["why", "explain", "explanation", "interpret", "interpretation", "insight", "meaning",
+                           "mean for", "tell me about", "what does", "implication", "trend", "pattern",
+                           "compare", "comparing", "comparison", "recommend", "recommendation", "suggest",
+                           "suggestion", "should", "conclusion", "conclude", "summarize", "summary", "analyze",
+                           "analyzing", "analyse", "analysing", "analysis", "story", "understand"]
+
+# Extra lines (captions, headings) tolerated around a table or chart
+MAX_CAPTION_LINES = 2
+MAX_CAPTION_CHARS = 120
+MAX_SCALAR_CHARS = 120
+
+# Lines printed by the sandbox preamble / tool conventions, never part of the answer
+_NOISE_PREFIXES = ("Dataset loaded:", "Columns:", "Numeric columns:", "Warning: sklearn", "MODEL_FILE:")
+
+_INTERPRETATION_RE = re.compile(r"\b(?:" + "|".join(re.escape(kw) for kw in INTERPRETATION_KEYWORDS) + r")s?\b")
+_TABLE_SEPARATOR_RE = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$")
+_NUMBER = r"[-+]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?(?:[eE][-+]?\d+)?%?"
+_SCALAR_RE = re.compile(rf"^(?:(?P<label>[^:=\n]{{1,80}}?)\s*[:=]\s*)?(?P<value>\$?{_NUMBER})\s*(?P<unit>[A-Za-z%/]{{0,12}})$")
+_SERIES_FOOTER_RE = re.compile(r"^(?:Name: .*, )?(?:Length: \d+, )?dtype: \w+$")
+_TITLE_RE = re.compile(
+    r"""(?:\.title|\.set_title|\.suptitle)\(\s*[fr]?(["'])(?P<title>.+?)\1"""
+    r"""|\btitle\s*=\s*[fr]?(["'])(?P<kw_title>.+?)\3"""
+)
+
+
+def wants_interpretation(prompt: str) -> bool:
+    """True if the prompt asks for an explanation rather than just a result."""
+    return bool(_INTERPRETATION_RE.search(prompt.lower()))
+
+
+def _answer_lines(output: str) -> list[str]:
+    """The lines of a tool output that carry the answer (preamble and blank lines dropped)."""
+    return [
+        line.rstrip() for line in output.splitlines()
+        if line.strip() and not line.startswith(_NOISE_PREFIXES)
+    ]
+
+
+def _split_tables(lines: list[str]) -> tuple[list[list[str]], list[str]]:
+    """Separate markdown tables (header + separator + rows) from the other lines."""
+    tables, others = [], []
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        if (
+            line.startswith("|")
+            and i + 1 < len(lines)
+            and _TABLE_SEPARATOR_RE.match(lines[i + 1].strip())
+        ):
+            end = i + 2
+            while end < len(lines) and lines[end].strip().startswith("|"):
+                end += 1
+            tables.append([l.strip() for l in lines[i:end]])
+            i = end
+            continue
+        others.append(line)
+        i += 1
+    return tables, others
+
+
+def _series_table(lines: list[str]) -> list[str] | None:
+    """A printed pandas Series (e.g. value_counts()) as a two-column markdown table."""
+    if len(lines) < 2 or not _SERIES_FOOTER_RE.match(lines[-1].strip()):
+        return None
+    footer = lines[-1].strip()
+    name_match = re.match(r"Name: (.*?), ", footer)
+    value_header = name_match.group(1) if name_match else "value"
+    body = lines[:-1]
+    index_header = ""
+    # value_counts() prints the column name alone on the first line
+    if len(body[0].split()) == 1 and not re.search(r"\s{2,}", body[0]):
+        index_header = body[0].strip()
+        body = body[1:]
+    rows = []
+    for line in body:
+        parts = re.split(r"\s{2,}", line.strip())
+        if len(parts) != 2:
+            return None
+        rows.append(f"| {parts[0]} | {parts[1]} |")
+    if not rows:
+        return None
+    return [f"| {index_header} | {value_header} |", "| --- | --- |", *rows]
+
+
+def _plot_title(code: str) -> str | None:
+    match = _TITLE_RE.search(code or "")
+    if not match:
+        return None
+    title = (match.group("title") or match.group("kw_title") or "").strip()
+    # f-string placeholders can't be resolved without running the code
+    return title if title and "{" not in title else None
+
+
+def _render_tables(tables: list[list[str]], captions: list[str]) -> str:
+    parts = [f"**{caption.rstrip(':')}**" for caption in captions]
+    for table in tables:
+        row_count = len(table) - 2
+        parts.append("\n".join(table))
+        parts.append(f"_{row_count} row{'s' if row_count != 1 else ''}._")
+    return "\n\n".join(parts)
+
+
+def render_direct_answer(prompt: str, executions: list[tuple[str, str]]) -> str | None:
+    """
+    A deterministic markdown answer for a turn whose tool output is
+    self-sufficient, or None when the model should write the answer.
+
+    `executions` holds (code, output) for each successful run_python_code
+    call of the step. Supported shapes: markdown tables or printed pandas
+    Series (with up to MAX_CAPTION_LINES short caption lines), a single
+    scalar ("Average salary: 52000"), and charts whose code sets a title.
+    """
+    if not DIRECT_ANSWERS_ENABLED or not executions or wants_interpretation(prompt):
+        return None
+
+    rendered = []
+    for code, output in executions:
+        lines = _answer_lines(output)
+        plot_lines = [line for line in lines if line.startswith("PLOT_IMG_BASE64:")]
+        lines = [line for line in lines if not line.startswith("PLOT_IMG_BASE64:")]
+
+        if plot_lines:
+            title = _plot_title(code)
+            if not title or len(lines) > MAX_CAPTION_LINES:
+                return None
+            rendered.append(f"📊 **{title}**: the chart is shown above.")
+            rendered.extend(lines)
+            continue
+
+        if not lines:
+            return None
+
+        if len(lines) == 1:
+            scalar = _SCALAR_RE.match(lines[0].strip())
+            if scalar and len(lines[0]) <= MAX_SCALAR_CHARS:
+                label = (scalar.group("label") or "").strip()
+                value = f"{scalar.group('value')} {scalar.group('unit')}".strip()
+                rendered.append(f"**{label}:** {value}" if label else f"**Result:** {value}")
+                continue
+            return None
+
+        tables, others = _split_tables(lines)
+        if not tables:
+            series = _series_table(lines)
+            if series is None:
+                return None
+            tables, others = [series], []
+        if len(others) > MAX_CAPTION_LINES or any(len(line) > MAX_CAPTION_CHARS for line in others):
+            return None
+        rendered.append(_render_tables(tables, others))
+
+    return "\n\n".join(rendered) + "\n"
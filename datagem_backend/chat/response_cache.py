@@ -0,0 +1,148 @@
+import hashlib
+import json
+import marshal
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from chat import metrics
+
+#
+# Two-tier response cache.
+#
+# Tier 1 (answers):   (normalized prompt, dataset fingerprint, model, template
+#                     version) -> everything streamed for that turn, replayed
+#                     instantly on a repeat question. Only used for the first
+#                     question of a conversation: with earlier turns in the
+#                     context the same words can ask something else.
+# Tier 2 (summaries): (normalized prompt, model, template version, tool
+#                     outputs) -> the model's text answer after those tool
+#                     results, so a re-run with identical output skips the
+#                     follow-up Gemini call.
+#
+# Both tiers are in-process LRU caches with a TTL; the answer tier is also
+# bounded by size, since replayed turns carry base64 plot images.
+#
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL", "1800"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "512"))
+SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("SUMMARY_CACHE_TTL", "3600"))
+
+# Bump whenever the system instruction / prompt templates change in a way
+# that should invalidate previously cached answers.
+PROMPT_TEMPLATE_VERSION = "1"
+
+# Request header that skips cache reads for one request ("bypass")
+CACHE_OPT_OUT_HEADER = "x-datagem-cache"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class TTLCache:
+    """
+    A small thread-safe LRU cache whose entries also expire after `ttl`
+    seconds. With `max_bytes`, the sizes passed to set() are bounded too.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float, max_bytes: int | None = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> (expires_at, value, size)
+        self._data: OrderedDict[str, tuple[float, object, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.RATES[f"{name}_hit_rate"] = (f"{name}_hits", f"{name}_lookups")
+
+    def get(self, key: str):
+        metrics.incr(f"{self.name}_lookups")
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value, size = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    metrics.incr(f"{self.name}_hits")
+                    return value
+                del self._data[key]
+                self.size -= size
+        return None
+
+    def set(self, key: str, value, size: int = 0) -> None:
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self._data[key] = (time.monotonic() + self.ttl, value, size)
+            self.size += size
+            while len(self._data) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.size -= evicted_size
+                metrics.incr(f"{self.name}_evictions")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+ANSWER_CACHE = TTLCache("answer_cache", ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_BYTES)
+SUMMARY_CACHE = TTLCache("summary_cache", SUMMARY_CACHE_MAX_ENTRIES, SUMMARY_CACHE_TTL_SECONDS)
+
+
+def _digest(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case/whitespace-insensitive form of a prompt, trailing punctuation dropped."""
+    return _WHITESPACE_RE.sub(" ", prompt.lower()).strip().rstrip("?!. ")
+
+
+def dataset_fingerprint(dataset: list[dict] | None) -> str:
+    """
+    Hash of the uploaded dataset's full content ("none" when there is no
+    dataset). Takes about 0.2 s on a 5000x400 upload, so call it off the
+    event loop, once per request.
+    """
+    if not dataset:
+        return "none"
+    try:
+        # Format 2 never emits back-references, so equal rows give equal bytes
+        payload = marshal.dumps(dataset, 2)
+    except ValueError:  # values JSON parsing never produces
+        payload = json.dumps(dataset, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def answer_key(prompt: str, fingerprint: str, model_name: str) -> str:
+    return _digest("answer", normalize_prompt(prompt), fingerprint, model_name, PROMPT_TEMPLATE_VERSION)
+
+
+def answer_size(events: list[dict], model_text: str) -> int:
+    """Approximate bytes held by a cached answer (dominated by plot images)."""
+    return len(model_text) + sum(len(v) for event in events for v in event.values() if isinstance(v, str))
+
+
+def summary_key(prompt: str, model_name: str, tool_outputs: list[str]) -> str:
+    return _digest("summary", normalize_prompt(prompt), model_name, PROMPT_TEMPLATE_VERSION, *tool_outputs)
+
+
+def wants_bypass(headers) -> bool:
+    """True if the request opted out of cached answers."""
+    if headers.get(CACHE_OPT_OUT_HEADER, "").lower() in ("bypass", "no-cache", "off"):
+        return True
+    cache_control = headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
@@ -0,0 +1,182 @@
+import difflib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+#
+# Builds the compact "Dataset available" block for a prompt.
+# On wide datasets only the columns relevant to the user's question are
+# listed (with short type/stat hints); the rest are summarised as a count.
+#
+
+SCHEMA_TOP_K_COLUMNS = int(os.getenv("SCHEMA_TOP_K_COLUMNS", "40"))
+# Rows inspected when profiling a column for its type/stat hint
+PROFILE_SAMPLE_ROWS = 200
+# Minimum SequenceMatcher ratio for a fuzzy token match ("salry" ~ "salary")
+FUZZY_THRESHOLD = 0.8
+# Datasets whose index is kept between requests
+SCHEMA_INDEX_CACHE_SIZE = 16
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def _name_tokens(name: str) -> list[str]:
+    """Split a column name like 'AvgOrder_value' into ['avg', 'order', 'value']."""
+    return _WORD_RE.findall(_CAMEL_RE.sub(" ", str(name)).lower())
+
+
+def _is_numeric_value(v) -> bool:
+    if isinstance(v, bool):
+        return False
+    if isinstance(v, (int, float)):
+        return True
+    return isinstance(v, str) and v.replace('.', '').replace('-', '').isdigit()
+
+
+class SchemaIndex:
+    """
+    Per-dataset column index. Column name tokens are computed once; column
+    profiles are computed lazily and only for columns that get selected.
+    """
+
+    def __init__(self, dataset: list[dict]):
+        # Profiles only look at the first rows; the index is kept across
+        # requests, so it doesn't hold on to the rest of the dataset
+        self._sample_rows = dataset[:PROFILE_SAMPLE_ROWS]
+        self.columns = list(dataset[0].keys()) if dataset else []
+        self.row_count = len(dataset)
+        self._tokens = [_name_tokens(col) for col in self.columns]
+        self._normalized = [" ".join(tokens) for tokens in self._tokens]
+        self._vocab = {tok for tokens in self._tokens for tok in tokens}
+        self._fuzzy_vocab = sorted(tok for tok in self._vocab if len(tok) > 3)
+        self._profiles: dict[str, tuple[bool, str]] = {}
+        self._full_schema: str | None = None
+
+    # ------------------------------------------------------------------
+    def _token_weights(self, q_tokens: set[str]) -> dict[str, float]:
+        """Weight of each column-name token for this question (exact or fuzzy hit)."""
+        weights = {tok: 1.0 for tok in q_tokens if tok in self._vocab}
+        for q in q_tokens:
+            if len(q) <= 3 or q in self._vocab:
+                continue
+            for match in difflib.get_close_matches(q, self._fuzzy_vocab, n=3, cutoff=FUZZY_THRESHOLD):
+                ratio = difflib.SequenceMatcher(None, q, match).ratio()
+                weights[match] = max(weights.get(match, 0.0), ratio * 0.8)
+        return weights
+
+    def score_columns(self, question: str) -> list[float]:
+        """Relevance of every column to the question (0 = unrelated)."""
+        q_words = _WORD_RE.findall(question.lower())
+        q_normalized = " ".join(q_words)
+        weights = self._token_weights(set(q_words))
+        scores = []
+        for normalized, tokens in zip(self._normalized, self._tokens):
+            if not tokens:
+                scores.append(0.0)
+                continue
+            score = sum(weights.get(tok, 0.0) for tok in tokens)
+            # Whole column name mentioned ("hours studied", "exam_score")
+            if score and len(normalized) > 2 and normalized in q_normalized:
+                score += 3.0
+            scores.append(score / len(tokens) ** 0.5)
+        return scores
+
+    def select_columns(self, question: str, top_k: int = SCHEMA_TOP_K_COLUMNS) -> list[str]:
+        """Top-k columns for the question, in their original dataset order."""
+        if len(self.columns) <= top_k:
+            return list(self.columns)
+        scores = self.score_columns(question)
+        ranked = sorted(range(len(self.columns)), key=lambda i: (-scores[i], i))
+        chosen = set(ranked[:top_k])
+        return [col for i, col in enumerate(self.columns) if i in chosen]
+
+    # ------------------------------------------------------------------
+    def profile(self, col: str) -> tuple[bool, str]:
+        """Return (is_numeric, short hint) for a column, e.g. (True, 'num 18–90')."""
+        if col in self._profiles:
+            return self._profiles[col]
+
+        sample = [row.get(col) for row in self._sample_rows]
+        values = [v for v in sample if v not in (None, "")]
+        # Same rule as before: numeric if at least 2 of the first 5 rows look numeric
+        is_numeric = sum(1 for v in sample[:5] if _is_numeric_value(v)) >= 2
+
+        if not values:
+            hint = "empty"
+        elif is_numeric:
+            nums = []
+            for v in values:
+                try:
+                    nums.append(float(v))
+                except (TypeError, ValueError):
+                    pass
+            hint = f"num {min(nums):g}–{max(nums):g}" if nums else "num"
+        else:
+            distinct = len(set(map(str, values)))
+            hint = f"text, {distinct}{'+' if distinct == len(values) else ''} uniq"
+
+        self._profiles[col] = (is_numeric, hint)
+        return self._profiles[col]
+
+    def full_schema(self) -> str:
+        """Every column with its hint; the stable per-dataset part of the prompt."""
+        if self._full_schema is None:
+            lines = [f"Dataset schema for df ({self.row_count} rows, {len(self.columns)} columns):"]
+            lines.extend(f"- {col} ({self.profile(col)[1]})" for col in self.columns)
+            self._full_schema = "\n".join(lines)
+        return self._full_schema
+
+    def describe(self, question: str, top_k: int = SCHEMA_TOP_K_COLUMNS) -> str:
+        """The dataset lines of the analysis prompt for this question."""
+        selected = self.select_columns(question, top_k)
+        omitted = len(self.columns) - len(selected)
+
+        column_hints = []
+        numeric_cols = []
+        for col in selected:
+            is_numeric, hint = self.profile(col)
+            column_hints.append(f"{col} ({hint})")
+            if is_numeric:
+                numeric_cols.append(col)
+
+        label = "All columns" if omitted == 0 else "Relevant columns"
+        lines = [
+            f"- {self.row_count} rows, {len(self.columns)} columns",
+            f"- {label}: {', '.join(column_hints)}",
+        ]
+        if omitted:
+            lines.append(f"- {omitted} other columns omitted (still available in df; use df.columns to list them)")
+        lines.append(f"- Numeric columns: {', '.join(numeric_cols) if numeric_cols else 'None detected'}")
+        return "\n".join(lines)
+
+    def focus(self, question: str, top_k: int = SCHEMA_TOP_K_COLUMNS) -> str:
+        """
+        The dataset lines of the analysis prompt when full_schema() is
+        already in the model's context: names of the relevant columns only.
+        """
+        lines = [f"- {self.row_count} rows, {len(self.columns)} columns (types and ranges in the dataset schema above)"]
+        if len(self.columns) > top_k:
+            lines.append(f"- Columns most relevant to the question: {', '.join(self.select_columns(question, top_k))}")
+        return "\n".join(lines)
+
+
+_indexes: OrderedDict[str, SchemaIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def index_for(dataset: list[dict], fingerprint: str) -> SchemaIndex:
+    """The SchemaIndex of a dataset, shared by every request on that dataset (LRU)."""
+    with _indexes_lock:
+        index = _indexes.get(fingerprint)
+        if index is not None:
+            _indexes.move_to_end(fingerprint)
+            return index
+    index = SchemaIndex(dataset)
+    with _indexes_lock:
+        index = _indexes.setdefault(fingerprint, index)
+        _indexes.move_to_end(fingerprint)
+        while len(_indexes) > SCHEMA_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,105 @@
+import asyncio
+import os
+
+from chat import stream_events
+
+#
+# Coalesces the agent's text deltas before they are rendered and sent.
+#
+# Gemini streams prose a few characters at a time; sending each fragment is
+# one ASGI message (and one socket write) per fragment. Consecutive text
+# deltas are buffered and flushed when the buffer reaches
+# STREAM_COALESCE_MAX_CHARS, when STREAM_COALESCE_WINDOW_MS has passed since
+# the first buffered fragment, or immediately at a structural boundary (a
+# closing code fence, or any non-text event such as code or tool output).
+# The source is read ahead by at most STREAM_COALESCE_QUEUE_EVENTS events,
+# so a slow client holds back the agent instead of letting its output pile
+# up in memory.
+#
+
+STREAM_COALESCE_WINDOW_MS = float(os.getenv("STREAM_COALESCE_WINDOW_MS", "24"))
+STREAM_COALESCE_MAX_CHARS = int(os.getenv("STREAM_COALESCE_MAX_CHARS", "512"))
+STREAM_COALESCE_QUEUE_EVENTS = int(os.getenv("STREAM_COALESCE_QUEUE_EVENTS", "64"))
+
+_END = object()
+
+
+def _ends_structure(delta: str) -> bool:
+    """A delta that closes a markdown block should reach the client right away."""
+    stripped = delta.rstrip(" ")
+    return stripped.endswith("```") or stripped.endswith("```\n") or stripped.endswith("\n\n")
+
+
+async def coalesce(
+    events,
+    window_ms: float = STREAM_COALESCE_WINDOW_MS,
+    max_chars: int = STREAM_COALESCE_MAX_CHARS,
+):
+    """Re-yield an async stream of events with adjacent text deltas merged."""
+    if window_ms <= 0:
+        async for event in events:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    window = window_ms / 1000
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, STREAM_COALESCE_QUEUE_EVENTS))
+    state = {"error": None}
+
+    async def _pump() -> None:
+        # Reads the source in its own task so a quiet source can't hold back
+        # a due flush; put() waits while the client is behind
+        try:
+            async for event in events:
+                await queue.put(event)
+        except Exception as e:
+            state["error"] = e
+        await queue.put(_END)
+
+    pump = asyncio.ensure_future(_pump())
+    buffer: list[str] = []
+    buffered_chars = 0
+    deadline = 0.0
+    try:
+        while True:
+            try:
+                event = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                if not buffer:
+                    event = await queue.get()
+                else:
+                    try:
+                        event = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        # Window elapsed with no new fragment
+                        yield stream_events.text("".join(buffer))
+                        buffer, buffered_chars = [], 0
+                        continue
+            if event is _END:
+                break
+
+            if event["type"] == "text":
+                if not buffer:
+                    deadline = loop.time() + window
+                buffer.append(event["delta"])
+                buffered_chars += len(event["delta"])
+                if buffered_chars >= max_chars or _ends_structure(event["delta"]) or loop.time() >= deadline:
+                    yield stream_events.text("".join(buffer))
+                    buffer, buffered_chars = [], 0
+                continue
+            if buffer:
+                yield stream_events.text("".join(buffer))
+                buffer, buffered_chars = [], 0
+            yield event
+
+        if buffer:
+            yield stream_events.text("".join(buffer))
+        if state["error"] is not None:
+            raise state["error"]
+    finally:
+        if not pump.done():
+            pump.cancel()
+            try:
+                await pump
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,141 @@
+import hashlib
+import json
+
+from chat import output_condenser
+
+#
+# Typed events for /chat responses.
+#
+# The agent produces one event stream per turn. The default `text` format
+# renders it as the markdown text/plain stream the frontend has always
+# parsed; the opt-in `ndjson` and `sse` formats send the events themselves,
+# with tool output split into text chunks, structured tables and image refs
+# so clients don't have to re-parse markdown.
+#
+# Event types:
+#   text         {"delta"}                                 model prose
+#   status       {"stage", "message", ...}                 progress (executing, repair, models_saved, tool_error)
+#   code         {"call_id", "language", "code"}           code about to run
+#   tool_output  {"call_id", "tool", "text"}               full tool output (split for typed formats)
+#   table        {"call_id", "columns", "rows"}            markdown table printed by a tool
+#   image        {"call_id", "id", "mime", "data"}         plot printed by a tool (base64)
+#   heartbeat    {"elapsed"}                               keep-alive during long sandbox runs
+#   done         {}                                        end of the turn
+#
+
+STREAM_FORMATS = ("text", "ndjson", "sse")
+MEDIA_TYPES = {"text": "text/plain", "ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+_IMAGE_PREFIX = "PLOT_IMG_BASE64:"
+
+
+def text(delta: str) -> dict:
+    return {"type": "text", "delta": delta}
+
+
+def status(stage: str, message: str, **fields) -> dict:
+    return {"type": "status", "stage": stage, "message": message, **fields}
+
+
+def code(call_id: str, source: str, parallel: bool = False) -> dict:
+    return {"type": "code", "call_id": call_id, "language": "python", "code": source, "parallel": parallel}
+
+
+def tool_output(call_id: str, tool: str, output: str, parallel: bool = False) -> dict:
+    return {"type": "tool_output", "call_id": call_id, "tool": tool, "text": output, "parallel": parallel}
+
+
+def heartbeat(elapsed: float) -> dict:
+    return {"type": "heartbeat", "elapsed": round(elapsed, 1)}
+
+
+def done() -> dict:
+    return {"type": "done"}
+
+
+def _label(event: dict) -> str:
+    return f" (`{event['call_id']}`)" if event.get("parallel") else ""
+
+
+def to_markdown(event: dict) -> str:
+    """The text/plain rendering of an event (heartbeat and done render as nothing)."""
+    kind = event["type"]
+    if kind == "text":
+        return event["delta"]
+    if kind == "code":
+        return f"```python\n{event['code']}\n```\n\n"
+    if kind == "tool_output":
+        if event["tool"] != "run_python_code":
+            return ""
+        return f"\n**Code Output:**{_label(event)}\n```\n{event['text']}\n```\n\n"
+    if kind == "status":
+        stage = event["stage"]
+        if stage == "executing":
+            return f"\n\n🤖 **Executing:** `{event['tool']}`{_label(event)}\n\n"
+        if stage == "tool_error":
+            return f"\n⚠️ {event['message']}{_label(event)}\n"
+        if stage == "models_saved":
+            model_list = "\n".join(f"- `{p}`" for p in event["paths"])
+            return f"\n💾 **Models saved**:\n{model_list}\n\n"
+        return f"\n{event['message']}\n\n"
+    return ""
+
+
+def _table_event(call_id: str, lines: list[str]) -> dict:
+    def _cells(row: str) -> list[str]:
+        return [cell.strip() for cell in row.strip().strip("|").split("|")]
+
+    return {"type": "table", "call_id": call_id, "columns": _cells(lines[0]), "rows": [_cells(r) for r in lines[2:]]}
+
+
+def expand(event: dict) -> list[dict]:
+    """
+    Typed-format view of an event: tool output is split into text chunks,
+    `table` events with structured rows and `image` events; everything else
+    passes through unchanged.
+    """
+    if event["type"] != "tool_output":
+        return [event]
+    call_id = event["call_id"]
+    events = []
+    for kind, lines in output_condenser.parse_segments(event["text"]):
+        if kind == output_condenser.TABLE:
+            events.append(_table_event(call_id, lines))
+        elif kind == output_condenser.IMAGE:
+            data = lines[0][len(_IMAGE_PREFIX):] if lines[0].startswith(_IMAGE_PREFIX) else lines[0]
+            image_id = hashlib.sha256(data.encode("ascii", "ignore")).hexdigest()[:16]
+            events.append({"type": "image", "call_id": call_id, "id": image_id, "mime": "image/png", "data": data})
+        else:
+            events.append({
+                "type": "tool_output",
+                "call_id": call_id,
+                "tool": event["tool"],
+                "stream": "warnings" if kind == output_condenser.WARNING else "stdout",
+                "text": "\n".join(lines),
+            })
+    return events
+
+
+def to_ndjson(event: dict) -> str:
+    return "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in expand(event))
+
+
+def to_sse(event: dict) -> str:
+    return "".join(
+        f"event: {e['type']}\ndata: {json.dumps(e, ensure_ascii=False)}\n\n" for e in expand(event)
+    )
+
+
+RENDERERS = {"text": to_markdown, "ndjson": to_ndjson, "sse": to_sse}
+
+
+def negotiate_format(requested: str | None, accept: str) -> str:
+    """Stream format from the request body, else the Accept header, else text."""
+    if requested in STREAM_FORMATS:
+        return requested
+    accept = accept.lower()
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    return "text"
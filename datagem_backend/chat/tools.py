@@ -1,7 +1,12 @@
 import subprocess
 import json
+import signal
+import threading
 import time
 import os
+import re
+
+from chat import metrics
 # Note: pandas, matplotlib, seaborn, numpy are only used in subprocess execution, not imported here
 
 #
@@ -17,12 +22,68 @@ def set_dataset(dataset_data: list[dict] | None):
     global _current_dataset
     _current_dataset = dataset_data
 
-def run_python_code(code: str, dataset_data: list[dict] | None = None) -> str:
+# Seconds a sandbox run may take, and how often a running one checks for cancellation
+SANDBOX_TIMEOUT_SECONDS = 60
+SANDBOX_CANCEL_POLL_SECONDS = 0.25
+
+CANCELLED_MESSAGE = "Error: Code execution cancelled because the client disconnected."
+# Prefixes run_python_code puts on its own failure reports (non-zero exit,
+# timeout, sandbox error); successful runs return the program's stdout as is
+FAILURE_PREFIXES = ("Code execution failed", "Code execution timed out", "An unexpected error occurred")
+
+
+class ExecutionCancelled(Exception):
+    """Raised when a sandbox run is stopped because its turn was cancelled."""
+
+
+def _kill_process_group(proc: subprocess.Popen) -> None:
+    """Kill the sandbox process and anything it spawned."""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+    proc.communicate()
+
+
+def _run_sandbox(args: list[str], env: dict, timeout: float, cancel_event: threading.Event | None) -> subprocess.CompletedProcess:
+    """
+    subprocess.run() for the sandbox, in its own process group so a timeout or
+    cancellation kills everything it started (e.g. joblib workers).
+    """
+    proc = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        env=env,
+        start_new_session=hasattr(os, "killpg"),
+    )
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            stdout, stderr = proc.communicate(timeout=SANDBOX_CANCEL_POLL_SECONDS)
+            return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+        except subprocess.TimeoutExpired:
+            pass
+        if cancel_event is not None and cancel_event.is_set():
+            _kill_process_group(proc)
+            metrics.incr("sandbox_cancelled")
+            raise ExecutionCancelled()
+        if time.monotonic() > deadline:
+            _kill_process_group(proc)
+            raise subprocess.TimeoutExpired(args, timeout)
+
+
+def run_python_code(code: str, dataset_data: list[dict] | None = None, cancel_event: threading.Event | None = None) -> str:
     """
     Runs a given string of Python code in a secure, isolated process.
     This is the "fireproof box" (sandbox) for data analysis.
     The code MUST use `print()` to output any results.
     If dataset_data is provided, it will be available as a pandas DataFrame named 'df'.
+    Setting `cancel_event` stops the run and kills its process group.
     """
     
     try:
@@ -108,24 +169,24 @@ def run_python_code(code: str, dataset_data: list[dict] | None = None) -> str:
             full_code += "df = None\n\n"
         
         # Add user's code
+        preamble_line_count = full_code.count("\n")
         full_code += code
         
         # Run the code - try to use the Python from the virtual environment
         import sys
         python_executable = sys.executable  # Use the same Python that's running this script
         
-        result = subprocess.run(
+        result = _run_sandbox(
             [python_executable, '-c', full_code],
-            capture_output=True,
-            text=True,
-            timeout=60,  # Allow up to 60 seconds to better handle larger datasets
-            check=False,  # Don't raise on error, we'll handle it
-            env={**os.environ, 'PYTHONUNBUFFERED': '1'}  # Ensure unbuffered output
+            env={**os.environ, 'PYTHONUNBUFFERED': '1'},  # Ensure unbuffered output
+            timeout=SANDBOX_TIMEOUT_SECONDS,  # Allow up to 60 seconds to better handle larger datasets
+            cancel_event=cancel_event,
         )
         
         # Combine stdout and stderr for better error visibility
         output = result.stdout
-        stderr_output = result.stderr
+        # Report traceback line numbers relative to the submitted code
+        stderr_output = _renumber_user_frames(result.stderr, preamble_line_count)
         
         # Check return code first
         if result.returncode != 0:
@@ -158,15 +219,82 @@ def run_python_code(code: str, dataset_data: list[dict] | None = None) -> str:
         
         return output
 
+    except ExecutionCancelled:
+        return CANCELLED_MESSAGE
     except subprocess.TimeoutExpired:
-        return "Error: Code execution timed out after 30 seconds. The code may be taking too long or stuck in an infinite loop."
+        return (
+            f"Code execution timed out after {SANDBOX_TIMEOUT_SECONDS} seconds. "
+            "The code may be taking too long or stuck in an infinite loop."
+        )
     except subprocess.CalledProcessError as e:
         # Return the standard error if the code crashes
         error_msg = e.stderr if e.stderr else str(e)
-        return f"Error: {error_msg}"
+        return f"Code execution failed: {error_msg}"
     except Exception as e:
         return f"An unexpected error occurred: {str(e)}"
 
+_STRING_FRAME_RE = re.compile(r'File "<string>", line (\d+)')
+
+
+def _renumber_user_frames(stderr_output: str, preamble_line_count: int) -> str:
+    """Map `File "<string>", line N` frames from the sandbox script back to the user's code."""
+    if not stderr_output:
+        return stderr_output
+
+    def _shift(match):
+        line = int(match.group(1)) - preamble_line_count
+        if line <= 0:
+            return f'File "<preamble>", line {match.group(1)}'
+        return f'File "<code>", line {line}'
+
+    return _STRING_FRAME_RE.sub(_shift, stderr_output)
+
+
+def is_execution_failure(result: str) -> bool:
+    """
+    True when run_python_code reported a crash or timeout rather than output.
+    Only the sandbox's own reports count: a program that prints "Error: ..."
+    and exits normally succeeded.
+    """
+    return result.startswith(FAILURE_PREFIXES)
+
+
+def trim_traceback(result: str, max_message_lines: int = 20) -> str:
+    """
+    Shorten a failed run's output to what matters for fixing it: frames in
+    the user's code, the frame that raised, and the exception message.
+    Library frames in between are collapsed into a single line.
+    """
+    lines = result.splitlines()
+    try:
+        start = max(i for i, line in enumerate(lines) if line.startswith("Traceback (most recent call last)"))
+    except ValueError:
+        # No traceback (e.g. timeout): keep the tail of the output
+        return "\n".join(lines[-max_message_lines:])
+
+    frames, message = [], []
+    for line in lines[start + 1:]:
+        if line.startswith("  File "):
+            frames.append([line])
+        elif line.startswith("    ") and frames and not message:
+            frames[-1].append(line)
+        else:
+            message.append(line)
+
+    kept = []
+    omitted = 0
+    for i, frame in enumerate(frames):
+        if 'File "<code>"' in frame[0] or i == len(frames) - 1:
+            if omitted:
+                kept.append(f"  ... ({omitted} library frames omitted)")
+                omitted = 0
+            kept.extend(frame)
+        else:
+            omitted += 1
+
+    return "\n".join([lines[start]] + kept + message[:max_message_lines])
+
+
 def google_search(query: str) -> str:
     """
     A placeholder function for Google Search.
@@ -0,0 +1,136 @@
+import ipaddress
+import os
+from urllib.parse import urlsplit
+
+from starlette.datastructures import Headers, MutableHeaders
+
+#
+# CORS as a plain ASGI middleware.
+#
+# Unlike a BaseHTTPMiddleware it never wraps the response body: headers are
+# added to the `http.response.start` message as it passes through, so
+# StreamingResponse chunks go straight to the server with normal
+# backpressure. OPTIONS requests are answered here, before routing.
+#
+# CORS_ALLOWED_ORIGINS is a comma-separated allowlist, compiled once:
+#   https://app.example.com   exact origin
+#   *.vercel.app              any origin ending with ".vercel.app"
+#   http://localhost:*        any origin starting with "http://localhost:"
+#   http://10.0.0.0/8         http origins whose host is an IP in the range
+#
+
+DEFAULT_ALLOWED_ORIGINS = ",".join([
+    "*.vercel.app",
+    "http://localhost:*",
+    "http://127.0.0.1:*",
+    "http://10.0.0.0/8",
+    "http://172.16.0.0/12",
+    "http://192.168.0.0/16",
+])
+CORS_ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", DEFAULT_ALLOWED_ORIGINS)
+# Allow-Origin sent on preflights from origins that are not allowed
+CORS_FALLBACK_ORIGIN = os.getenv("CORS_FALLBACK_ORIGIN", "https://datagemakshit.vercel.app")
+
+ALLOW_METHODS = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
+ALLOW_HEADERS = "Content-Type, Authorization, Accept, Origin, X-Requested-With, Cache-Control, X-DataGem-Cache"
+MAX_AGE = "3600"
+
+# Distinct origins remembered with their verdict (browsers send the same few over and over)
+_MATCH_CACHE_SIZE = 1024
+
+
+class OriginMatcher:
+    """An allowlist of exact origins, suffixes, prefixes and CIDR ranges."""
+
+    def __init__(self, allowlist: str):
+        exact, suffixes, prefixes, networks = set(), [], [], []
+        for entry in (e.strip() for e in allowlist.split(",")):
+            if not entry:
+                continue
+            if entry.startswith("*"):
+                suffixes.append(entry[1:])
+            elif entry.endswith("*"):
+                prefixes.append(entry[:-1])
+            elif "/" in entry.split("://", 1)[-1]:
+                scheme, _, cidr = entry.partition("://")
+                networks.append((scheme, ipaddress.ip_network(cidr, strict=False)))
+            else:
+                exact.add(entry.rstrip("/"))
+        self.exact = frozenset(exact)
+        self.suffixes = tuple(suffixes)
+        self.prefixes = tuple(prefixes)
+        self.networks = tuple(networks)
+        self._cache: dict[str, bool] = {}
+
+    def __call__(self, origin: str) -> bool:
+        allowed = self._cache.get(origin)
+        if allowed is None:
+            allowed = self._match(origin)
+            if len(self._cache) >= _MATCH_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[origin] = allowed
+        return allowed
+
+    def _match(self, origin: str) -> bool:
+        if not origin:
+            return False
+        if origin in self.exact or origin.endswith(self.suffixes) or origin.startswith(self.prefixes):
+            return True
+        if self.networks:
+            try:
+                parts = urlsplit(origin)
+                address = ipaddress.ip_address(parts.hostname or "")
+            except ValueError:
+                return False
+            return any(parts.scheme == scheme and address in network for scheme, network in self.networks)
+        return False
+
+
+class CORSOptionsMiddleware:
+    """Adds CORS headers to responses and answers preflight requests directly."""
+
+    def __init__(self, app, allowlist: str = CORS_ALLOWED_ORIGINS, fallback_origin: str = CORS_FALLBACK_ORIGIN):
+        self.app = app
+        self.is_allowed = OriginMatcher(allowlist)
+        self.fallback_origin = fallback_origin
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = Headers(scope=scope).get("origin", "")
+        allowed = self.is_allowed(origin)
+
+        if scope["method"] == "OPTIONS":
+            await self._preflight(origin if allowed else self.fallback_origin, send)
+            return
+        if not allowed:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["Access-Control-Allow-Origin"] = origin
+                headers["Access-Control-Allow-Credentials"] = "true"
+                headers.add_vary_header("Origin")
+                # Ensure streaming responses are not buffered by proxies
+                headers["Cache-Control"] = "no-cache"
+                headers["X-Accel-Buffering"] = "no"
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    async def _preflight(self, allow_origin: str, send) -> None:
+        headers = [
+            (b"access-control-allow-origin", allow_origin.encode("latin-1")),
+            (b"access-control-allow-methods", ALLOW_METHODS.encode("latin-1")),
+            (b"access-control-allow-headers", ALLOW_HEADERS.encode("latin-1")),
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-max-age", MAX_AGE.encode("latin-1")),
+            (b"vary", b"Origin"),
+            (b"content-length", b"0"),
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
@@ -0,0 +1,212 @@
+import asyncio
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import crud, models as db_models
+from database import blob_store, history_index, search, user_cache
+
+#
+# Async equivalents of the crud.py functions used on the chat hot path.
+# Same arguments and return values, for use with an AsyncSession.
+# `call()` takes either kind of session, so callers work unchanged when the
+# async engine is unavailable (the sync function then runs in a worker thread).
+#
+
+# =====================
+# User CRUD
+# =====================
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    """Fetch a single user by their email address."""
+    result = await db.execute(select(db_models.User).where(db_models.User.email == email).limit(1))
+    return result.scalars().first()
+
+async def create_user(db: AsyncSession, user: db_models.User):
+    """Create a new user (the password must already be hashed)."""
+    db.add(user)
+    await db.commit()
+    user_cache.USER_CACHE.invalidate(email=user.email, user_id=user.id)
+    return user
+
+async def set_password_hash(db: AsyncSession, user_id: int, hashed_password: str):
+    """Replace a user's stored password hash."""
+    await db.execute(
+        update(db_models.User).where(db_models.User.id == user_id).values(hashed_password=hashed_password)
+    )
+    await db.commit()
+    user_cache.USER_CACHE.invalidate(user_id=user_id)
+
+# =====================
+# Conversation CRUD
+# =====================
+
+async def create_conversation(db: AsyncSession, conversation: db_models.Conversation):
+    """Create a new conversation."""
+    db.add(conversation)
+    await db.commit()
+    return conversation
+
+async def get_conversation(db: AsyncSession, user_id: int, conversation_id: int):
+    """A user's conversation by id (None if it does not exist or is not theirs)."""
+    result = await db.execute(
+        select(db_models.Conversation)
+        .where(db_models.Conversation.id == conversation_id, db_models.Conversation.user_id == user_id)
+    )
+    return result.scalars().first()
+
+async def list_conversations(db: AsyncSession, user_id: int, limit: int = 50):
+    """A user's conversations, most recently active first."""
+    result = await db.execute(
+        select(db_models.Conversation)
+        .where(db_models.Conversation.user_id == user_id)
+        .order_by(db_models.Conversation.updated_at.desc(), db_models.Conversation.id.desc())
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+# =====================
+# Chat History CRUD
+# =====================
+
+async def get_chat_history(db: AsyncSession, user_id: int, limit: int = 50, conversation_id: int | None = None):
+    """Get the N most recent chat messages for a specific user."""
+    result = await db.execute(
+        select(db_models.ChatHistory)
+        .where(*crud.history_scope(user_id, conversation_id))
+        .order_by(db_models.ChatHistory.timestamp.desc(), db_models.ChatHistory.id.desc())
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+async def get_chat_history_page(
+    db: AsyncSession, user_id: int, before: int | None = None, limit: int = 50, conversation_id: int | None = None
+):
+    """One page of a user's messages, newest first, older than message `before` (see crud)."""
+    query = select(db_models.ChatHistory).where(*crud.history_scope(user_id, conversation_id))
+    if before is not None:
+        query = query.where(crud.older_than(user_id, before))
+    result = await db.execute(
+        query
+        .order_by(db_models.ChatHistory.timestamp.desc(), db_models.ChatHistory.id.desc())
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+async def get_all_chat_messages(
+    db: AsyncSession, user_id: int, conversation_id: int | None = None, limit: int | None = None
+):
+    """Get the messages of a history scope, oldest first; with `limit`, only the newest (see crud)."""
+    if limit is None:
+        result = await db.execute(
+            select(db_models.ChatHistory)
+            .where(*crud.history_scope(user_id, conversation_id))
+            .order_by(db_models.ChatHistory.timestamp.asc(), db_models.ChatHistory.id.asc())
+        )
+        return result.scalars().all()
+    newest = await get_chat_history(db, user_id=user_id, limit=limit, conversation_id=conversation_id)
+    return list(reversed(newest))
+
+async def get_chat_messages_by_ids(db: AsyncSession, user_id: int, message_ids: list[int]):
+    """Fetch specific messages for a user, oldest first."""
+    if not message_ids:
+        return []
+    result = await db.execute(
+        select(db_models.ChatHistory)
+        .where(
+            db_models.ChatHistory.user_id == user_id,
+            db_models.ChatHistory.id.in_(message_ids),
+        )
+        .order_by(db_models.ChatHistory.timestamp.asc(), db_models.ChatHistory.id.asc())
+    )
+    return result.scalars().all()
+
+async def save_chat_message(
+    db: AsyncSession, user_id: int, role: str, content: str, conversation_id: int | None = None
+):
+    """
+    Save a new chat message. The INSERT returns the generated id and
+    timestamp (eager_defaults on the model), so no refresh query is needed.
+    """
+    db_message, blob = blob_store.prepare_message(user_id, role, content, conversation_id)
+    if blob is not None:
+        await blob_store.save_blobs_async(db, [blob])
+    db.add(db_message)
+    if conversation_id is not None:
+        await db.execute(crud.touch_conversation(conversation_id))
+    await db.commit()
+    # Keep the relevance index in step with the table
+    history_index.index_message(history_index.scope(user_id, conversation_id), db_message.id, db_message.content)
+    return db_message
+
+async def search_chat_messages(
+    db: AsyncSession, user_id: int, query: str, conversation_id: int | None = None, limit: int = 20, offset: int = 0
+):
+    """
+    Full-text search over a user's messages, best match first (see search.py).
+    Messages with every query word are returned if there are any, otherwise
+    messages with some of them; every page of one query uses the same rule.
+    """
+    async def run(match_all: bool, limit: int, offset: int):
+        found = search.search_statement(user_id, query, conversation_id, limit, offset, match_all)
+        return (await db.execute(*found)).all() if found is not None else []
+
+    rows = await run(True, limit, offset)
+    if rows or (offset and await run(True, 1, 0)):
+        return rows
+    return await run(False, limit, offset)
+
+async def get_chat_message(db: AsyncSession, user_id: int, message_id: int):
+    """A single message row of a user (content may be a preview, see get_message_content)."""
+    result = await db.execute(
+        select(db_models.ChatHistory)
+        .where(db_models.ChatHistory.id == message_id, db_models.ChatHistory.user_id == user_id)
+    )
+    return result.scalars().first()
+
+async def get_message_content(db: AsyncSession, message: db_models.ChatHistory) -> str:
+    """The full text of a message, loading its blob if it has one."""
+    if message.blob_id is None:
+        return message.content
+    blob = await db.get(db_models.MessageBlob, message.blob_id)
+    return blob_store.blob_text(blob) if blob is not None else message.content
+
+
+_ASYNC_FUNCTIONS = {
+    fn.__name__: fn
+    for fn in (
+        get_user_by_email,
+        create_user,
+        set_password_hash,
+        create_conversation,
+        get_conversation,
+        list_conversations,
+        get_chat_history,
+        get_chat_history_page,
+        get_all_chat_messages,
+        get_chat_messages_by_ids,
+        save_chat_message,
+        get_chat_message,
+        get_message_content,
+        search_chat_messages,
+    )
+}
+
+
+async def call(name: str, db, **kwargs):
+    """Run the CRUD function `name` on `db` without blocking the event loop."""
+    if isinstance(db, AsyncSession):
+        return await _ASYNC_FUNCTIONS[name](db=db, **kwargs)
+    return await asyncio.to_thread(getattr(crud, name), db=db, **kwargs)
+
+
+async def get_cached_user_by_email(db, email: str):
+    """
+    A user by email from the identity cache, loading it on a miss (either
+    kind of session). Returns a read-only user_cache.CachedUser (or None).
+    """
+    cached = user_cache.USER_CACHE.get_by_email(email)
+    if cached is None:
+        user = await call("get_user_by_email", db, email=email)
+        cached = user_cache.USER_CACHE.put(user) if user else None
+    return cached
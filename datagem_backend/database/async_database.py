@@ -0,0 +1,78 @@
+import os
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from database import profiles
+from database.database import SQLALCHEMY_DATABASE_URL, SessionLocal
+
+#
+# Async engine/sessions for the chat hot path (aiosqlite for SQLite,
+# asyncpg for PostgreSQL), built from the same DATABASE_URL as the sync
+# engine. When ASYNC_DB=0 or the async driver is not installed,
+# AsyncSessionLocal is None and callers fall back to the sync CRUD in a
+# worker thread.
+#
+
+ASYNC_DB_ENABLED = os.getenv("ASYNC_DB", "1") == "1"
+
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def to_async_url(sync_url: str):
+    """The async-driver form of a sync DATABASE_URL."""
+    url = make_url(sync_url)
+    backend = url.get_backend_name()
+    url = url.set(drivername=_ASYNC_DRIVERS[backend])
+    if backend == "postgresql" and "sslmode" in url.query:
+        # asyncpg takes `ssl` instead of libpq's `sslmode`
+        query = dict(url.query)
+        query["ssl"] = query.pop("sslmode")
+        url = url.set(query=query)
+    return url
+
+
+def _create_async_engine(writer: bool = False):
+    """The async engine, or its SQLite writer (the sync engine's writer connection, see profiles.py)."""
+    url = to_async_url(SQLALCHEMY_DATABASE_URL)
+    options = profiles.writer_engine_options(url, kind="async") if writer else profiles.engine_options(url, kind="async")
+    engine = create_async_engine(url, **options)
+    profiles.configure_engine(engine.sync_engine)
+    return engine
+
+
+async_engine = None
+async_writer_engine = None
+AsyncSessionLocal: async_sessionmaker[AsyncSession] | None = None
+
+if ASYNC_DB_ENABLED:
+    try:
+        async_engine = _create_async_engine()
+        if profiles.SQLITE_SINGLE_WRITER and profiles.is_file_sqlite(SQLALCHEMY_DATABASE_URL):
+            async_writer_engine = _create_async_engine(writer=True)
+        AsyncSessionLocal = async_sessionmaker(
+            async_engine,
+            expire_on_commit=False,
+            autoflush=False,
+            sync_session_class=profiles.session_class(
+                async_writer_engine.sync_engine if async_writer_engine is not None else None
+            ),
+        )
+    except Exception as e:  # driver not installed / unsupported backend
+        print(f"⚠️ Async database unavailable ({e}); chat uses the sync engine in worker threads")
+
+
+async def get_chat_db():
+    """
+    Session for the chat endpoints: an AsyncSession when the async engine is
+    available, otherwise a sync Session (used through async_crud.call).
+    """
+    if AsyncSessionLocal is None:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import re
+import zlib
+from collections.abc import Iterable
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import models as db_models
+
+# =====================
+# Large message payloads live in the message_blobs table.
+#
+# A message longer than MESSAGE_INLINE_MAX_CHARS (typically one carrying a
+# base64 plot or a long output) is stored as a short preview in
+# chat_history.content plus a content-addressed, compressed blob with the
+# full text. History listings and the prompt context only ever read the
+# preview; the blob is loaded when a client opens that one message.
+# =====================
+
+MESSAGE_INLINE_MAX_CHARS = int(os.getenv("MESSAGE_INLINE_MAX_CHARS", "8000"))
+MESSAGE_PREVIEW_CHARS = int(os.getenv("MESSAGE_PREVIEW_CHARS", "1000"))
+
+_PLOT_RE = re.compile(r"PLOT_IMG_BASE64:\S+")
+PLOT_PLACEHOLDER = "[plot]"
+PREVIEW_SUFFIX = "…"
+
+
+def blob_id(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def new_blob(content: str) -> db_models.MessageBlob:
+    """
+    The blob for `content`. It is stamped as used now; saving it over a
+    stored copy refreshes that copy's last_used_at (see maintenance).
+    """
+    return db_models.MessageBlob(
+        id=blob_id(content),
+        size=len(content),
+        data=zlib.compress(content.encode("utf-8"), 6),
+        last_used_at=datetime.now(timezone.utc),
+    )
+
+
+_UPSERT_DIALECTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def upsert(blobs: Iterable[db_models.MessageBlob], dialect_name: str):
+    """
+    INSERT ... ON CONFLICT(id) DO UPDATE SET last_used_at for `blobs`, or
+    None on a dialect without it. A payload that is already stored only has
+    its last_used_at refreshed: its data is neither read back nor rewritten,
+    and two writers saving the same content cannot collide on the key.
+    """
+    insert = _UPSERT_DIALECTS.get(dialect_name)
+    if insert is None:
+        return None
+    statement = insert(db_models.MessageBlob).values([
+        {"id": blob.id, "size": blob.size, "data": blob.data, "last_used_at": blob.last_used_at}
+        for blob in blobs
+    ])
+    return statement.on_conflict_do_update(
+        index_elements=[db_models.MessageBlob.id],
+        set_={"last_used_at": statement.excluded.last_used_at},
+    )
+
+
+def save_blobs(db: Session, blobs: Iterable[db_models.MessageBlob]) -> None:
+    """Store `blobs` in the current transaction (see upsert)."""
+    blobs = list(blobs)
+    if not blobs:
+        return
+    statement = upsert(blobs, db.get_bind().dialect.name)
+    if statement is None:
+        for blob in blobs:
+            db.merge(blob)
+    else:
+        db.execute(statement)
+
+
+async def save_blobs_async(db: AsyncSession, blobs: Iterable[db_models.MessageBlob]) -> None:
+    blobs = list(blobs)
+    if not blobs:
+        return
+    statement = upsert(blobs, db.get_bind().dialect.name)
+    if statement is None:
+        for blob in blobs:
+            await db.merge(blob)
+    else:
+        await db.execute(statement)
+
+
+def preview(content: str) -> str:
+    """The inline part of a large message: plots replaced by a placeholder, then cut short."""
+    text = _PLOT_RE.sub(PLOT_PLACEHOLDER, content)
+    if len(text) > MESSAGE_PREVIEW_CHARS:
+        text = text[:MESSAGE_PREVIEW_CHARS].rstrip() + PREVIEW_SUFFIX
+    return text
+
+
+def prepare_message(
+    user_id: int, role: str, content: str, conversation_id: int | None = None
+) -> tuple[db_models.ChatHistory, db_models.MessageBlob | None]:
+    """
+    Build the chat_history row for a message, and the blob to store with it
+    when the message is too large to keep inline (store it with `save_blobs`,
+    so a payload that is already stored is not inserted twice).
+    """
+    if len(content) <= MESSAGE_INLINE_MAX_CHARS:
+        message = db_models.ChatHistory(
+            user_id=user_id, conversation_id=conversation_id, role=role, content=content
+        )
+        return message, None
+
+    blob = new_blob(content)
+    message = db_models.ChatHistory(
+        user_id=user_id,
+        conversation_id=conversation_id,
+        role=role,
+        content=preview(content),
+        blob_id=blob.id,
+        content_size=len(content),
+    )
+    return message, blob
+
+
+def externalize(message: db_models.ChatHistory, keep: bool = True) -> db_models.MessageBlob | None:
+    """
+    Move the full text of a stored inline message out of its row, leaving
+    the preview. With keep=False the payload is dropped instead of being
+    returned as a blob (the row only keeps the preview and content_size).
+    """
+    content = message.content
+    blob = None
+    if keep:
+        blob = new_blob(content)
+        message.blob_id = blob.id
+    message.content = preview(content)
+    message.content_size = len(content)
+    return blob
+
+
+def blob_text(blob: db_models.MessageBlob) -> str:
+    return zlib.decompress(blob.data).decode("utf-8")
@@ -1,8 +1,11 @@
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.sql import func
 from sqlalchemy.orm import Session
 # We REMOVED the "from auth import security" to break the circle
 
 # We use absolute imports (starting from the root)
 from database import models as db_models
+from database import blob_store, history_index, search, user_cache
 from auth import models as auth_models 
 
 # =====================
@@ -22,34 +25,193 @@ def create_user(db: Session, user: db_models.User):
     db.add(user)
     db.commit()
     db.refresh(user)
+    user_cache.USER_CACHE.invalidate(email=user.email, user_id=user.id)
     return user
 
+def set_password_hash(db: Session, user_id: int, hashed_password: str):
+    """Replace a user's stored password hash."""
+    db.query(db_models.User).filter(db_models.User.id == user_id).update({"hashed_password": hashed_password})
+    db.commit()
+    user_cache.USER_CACHE.invalidate(user_id=user_id)
+
+def get_cached_user_by_email(db: Session, email: str):
+    """
+    A user by email from the identity cache, loading it on a miss.
+    Returns a read-only user_cache.CachedUser (or None).
+    """
+    cached = user_cache.USER_CACHE.get_by_email(email)
+    if cached is None:
+        user = get_user_by_email(db, email)
+        cached = user_cache.USER_CACHE.put(user) if user else None
+    return cached
+
+# =====================
+# Conversation CRUD
+# =====================
+
+def create_conversation(db: Session, conversation: db_models.Conversation):
+    """Create a new conversation."""
+    db.add(conversation)
+    db.commit()
+    db.refresh(conversation)
+    return conversation
+
+def get_conversation(db: Session, user_id: int, conversation_id: int):
+    """A user's conversation by id (None if it does not exist or is not theirs)."""
+    return (
+        db.query(db_models.Conversation)
+        .filter(db_models.Conversation.id == conversation_id, db_models.Conversation.user_id == user_id)
+        .first()
+    )
+
+def list_conversations(db: Session, user_id: int, limit: int = 50):
+    """A user's conversations, most recently active first."""
+    return (
+        db.query(db_models.Conversation)
+        .filter(db_models.Conversation.user_id == user_id)
+        .order_by(db_models.Conversation.updated_at.desc(), db_models.Conversation.id.desc())
+        .limit(limit)
+        .all()
+    )
+
 # =====================
 # Chat History CRUD
 # =====================
+#
+# History is scoped by `conversation_id`: a conversation's messages, or with
+# None the messages sent outside any conversation. Each scope is a range of
+# one (…, timestamp, id) index.
+
+def history_scope(user_id: int, conversation_id: int | None):
+    """WHERE conditions selecting one history scope."""
+    if conversation_id is None:
+        return (db_models.ChatHistory.user_id == user_id, db_models.ChatHistory.conversation_id.is_(None))
+    return (db_models.ChatHistory.conversation_id == conversation_id, db_models.ChatHistory.user_id == user_id)
 
-def get_chat_history(db: Session, user_id: int, limit: int = 50):
+def get_chat_history(db: Session, user_id: int, limit: int = 50, conversation_id: int | None = None):
     """Get the N most recent chat messages for a specific user."""
     return (
         db.query(db_models.ChatHistory)
-        .filter(db_models.ChatHistory.user_id == user_id)
-        .order_by(db_models.ChatHistory.timestamp.desc())
+        .filter(*history_scope(user_id, conversation_id))
+        .order_by(db_models.ChatHistory.timestamp.desc(), db_models.ChatHistory.id.desc())
         .limit(limit)
         .all()
     )
 
-def save_chat_message(db: Session, user_id: int, role: str, content: str):
+def get_chat_history_page(
+    db: Session, user_id: int, before: int | None = None, limit: int = 50, conversation_id: int | None = None
+):
+    """
+    One page of a user's messages, newest first, older than message `before`
+    (keyset pagination on (timestamp, id): every page is an index range
+    scan, however deep). Returns up to `limit` rows.
+    """
+    query = db.query(db_models.ChatHistory).filter(*history_scope(user_id, conversation_id))
+    if before is not None:
+        query = query.filter(older_than(user_id, before))
+    return (
+        query
+        .order_by(db_models.ChatHistory.timestamp.desc(), db_models.ChatHistory.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+def older_than(user_id: int, message_id: int):
+    """(timestamp, id) < that of the cursor message, compared in SQL so both sides use the stored format."""
+    cursor = (
+        select(db_models.ChatHistory.timestamp, db_models.ChatHistory.id)
+        .where(db_models.ChatHistory.id == message_id, db_models.ChatHistory.user_id == user_id)
+        .scalar_subquery()
+    )
+    return tuple_(db_models.ChatHistory.timestamp, db_models.ChatHistory.id) < cursor
+
+def get_all_chat_messages(db: Session, user_id: int, conversation_id: int | None = None, limit: int | None = None):
+    """
+    Get the messages of a history scope, oldest first (used to build the
+    history index); with `limit`, only the newest `limit` of them.
+    """
+    if limit is None:
+        return (
+            db.query(db_models.ChatHistory)
+            .filter(*history_scope(user_id, conversation_id))
+            .order_by(db_models.ChatHistory.timestamp.asc(), db_models.ChatHistory.id.asc())
+            .all()
+        )
+    newest = get_chat_history(db, user_id=user_id, limit=limit, conversation_id=conversation_id)
+    return list(reversed(newest))
+
+def get_chat_messages_by_ids(db: Session, user_id: int, message_ids: list[int]):
+    """Fetch specific messages for a user, oldest first."""
+    if not message_ids:
+        return []
+    return (
+        db.query(db_models.ChatHistory)
+        .filter(
+            db_models.ChatHistory.user_id == user_id,
+            db_models.ChatHistory.id.in_(message_ids),
+        )
+        .order_by(db_models.ChatHistory.timestamp.asc(), db_models.ChatHistory.id.asc())
+        .all()
+    )
+
+def search_chat_messages(
+    db: Session, user_id: int, query: str, conversation_id: int | None = None, limit: int = 20, offset: int = 0
+):
+    """
+    Full-text search over a user's messages, best match first (see search.py).
+    Messages with every query word are returned if there are any, otherwise
+    messages with some of them; every page of one query uses the same rule.
+    """
+    def run(match_all: bool, limit: int, offset: int):
+        found = search.search_statement(user_id, query, conversation_id, limit, offset, match_all)
+        return db.execute(*found).all() if found is not None else []
+
+    rows = run(True, limit, offset)
+    if rows or (offset and run(True, 1, 0)):
+        return rows
+    return run(False, limit, offset)
+
+def touch_conversation(conversation_id: int):
+    """UPDATE statement marking a conversation as active now."""
+    return (
+        update(db_models.Conversation)
+        .where(db_models.Conversation.id == conversation_id)
+        .values(updated_at=func.now())
+    )
+
+def save_chat_message(db: Session, user_id: int, role: str, content: str, conversation_id: int | None = None):
     """
     Save a new chat message (from user or AI) to the database.
     This is now simpler and just takes the raw parts.
     """
-    db_message = db_models.ChatHistory(
-        user_id=user_id,
-        role=role,
-        content=content
-        # timestamp is set automatically by the database
-    )
+    # Large payloads go to message_blobs; the row keeps a preview
+    # (timestamp is set automatically by the database)
+    db_message, blob = blob_store.prepare_message(user_id, role, content, conversation_id)
+    if blob is not None:
+        blob_store.save_blobs(db, [blob])
     db.add(db_message)
+    if conversation_id is not None:
+        db.execute(touch_conversation(conversation_id))
+    # The INSERT returns the id and timestamp (eager_defaults); read what the
+    # index needs before commit expires the row, instead of refreshing it
+    db.flush()
+    message_id, message_content = db_message.id, db_message.content
     db.commit()
-    db.refresh(db_message)
+    # Keep the relevance index in step with the table
+    history_index.index_message(history_index.scope(user_id, conversation_id), message_id, message_content)
     return db_message
+
+def get_chat_message(db: Session, user_id: int, message_id: int):
+    """A single message row of a user (content may be a preview, see get_message_content)."""
+    return (
+        db.query(db_models.ChatHistory)
+        .filter(db_models.ChatHistory.id == message_id, db_models.ChatHistory.user_id == user_id)
+        .first()
+    )
+
+def get_message_content(db: Session, message: db_models.ChatHistory) -> str:
+    """The full text of a message, loading its blob if it has one."""
+    if message.blob_id is None:
+        return message.content
+    blob = db.get(db_models.MessageBlob, message.blob_id)
+    return blob_store.blob_text(blob) if blob is not None else message.content
@@ -3,18 +3,28 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from database import profiles
+
 # Uses the Internal Database URL from Render for a stable connection
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./datagem.db")
 
 if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_pre_ping=True
-)
+# Pool, timeouts and per-connection settings depend on the database (see profiles.py)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **profiles.engine_options(SQLALCHEMY_DATABASE_URL))
+profiles.configure_engine(engine)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# SQLite: the one connection every write goes through, shared with the
+# async engine (None elsewhere)
+writer_engine = None
+if profiles.SQLITE_SINGLE_WRITER and profiles.is_file_sqlite(SQLALCHEMY_DATABASE_URL):
+    writer_engine = create_engine(SQLALCHEMY_DATABASE_URL, **profiles.writer_engine_options(SQLALCHEMY_DATABASE_URL))
+    profiles.configure_engine(writer_engine)
+
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=engine, class_=profiles.session_class(writer_engine)
+)
 Base = declarative_base()
 
 def get_db():
@@ -0,0 +1,154 @@
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+# =====================
+# In-process BM25 index over each user's chat history, one index per
+# history scope: a conversation, or a user's messages outside any
+# conversation (see `scope()`).
+#
+# The index only stores token statistics and message ids, never the message
+# text itself. Callers look the winning ids back up in the database.
+# At most HISTORY_INDEX_MAX_SCOPES scopes are kept (least recently used
+# dropped first), each with its newest HISTORY_INDEX_MAX_MESSAGES messages.
+# =====================
+
+HISTORY_INDEX_MAX_SCOPES = int(os.getenv("HISTORY_INDEX_MAX_SCOPES", "256"))
+HISTORY_INDEX_MAX_MESSAGES = int(os.getenv("HISTORY_INDEX_MAX_MESSAGES", "2000"))
+
+# BM25 tuning constants (standard defaults)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+")
+# Plot payloads are huge and carry no meaning for retrieval
+_BASE64_RE = re.compile(r"PLOT_IMG_BASE64:\S+")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do for from has have how i in is it me my of on or "
+    "please show that the this to was what which with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens with plot payloads and stopwords removed."""
+    text = _BASE64_RE.sub(" ", text or "").lower()
+    return [tok for tok in _TOKEN_RE.findall(text) if tok not in _STOPWORDS and len(tok) > 1]
+
+
+class _UserIndex:
+    """BM25 statistics for the messages of one history scope."""
+
+    def __init__(self, max_messages: int = HISTORY_INDEX_MAX_MESSAGES):
+        self.max_messages = max_messages
+        # In the order added (oldest first)
+        self.doc_lengths: dict[int, int] = {}
+        self.doc_terms: dict[int, tuple[str, ...]] = {}
+        self.postings: dict[str, dict[int, int]] = {}
+        self.total_length = 0
+
+    def add(self, message_id: int, text: str) -> None:
+        if message_id in self.doc_lengths:
+            return
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        self.doc_lengths[message_id] = length
+        self.doc_terms[message_id] = tuple(counts)
+        self.total_length += length
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[message_id] = tf
+        while len(self.doc_lengths) > self.max_messages:
+            self._remove(next(iter(self.doc_lengths)))
+
+    def _remove(self, message_id: int) -> None:
+        self.total_length -= self.doc_lengths.pop(message_id)
+        for term in self.doc_terms.pop(message_id):
+            postings = self.postings[term]
+            del postings[message_id]
+            if not postings:
+                del self.postings[term]
+
+    def search(self, query: str, top_k: int, exclude: set[int]) -> list[tuple[int, float]]:
+        doc_count = len(self.doc_lengths)
+        if doc_count == 0:
+            return []
+        avg_length = self.total_length / doc_count or 1.0
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for message_id, tf in postings.items():
+                if message_id in exclude:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[message_id] / avg_length)
+                scores[message_id] = scores.get(message_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+Scope = tuple[int, int | None]
+
+_indexes: OrderedDict[Scope, _UserIndex] = OrderedDict()
+_lock = threading.Lock()
+
+
+def scope(user_id: int, conversation_id: int | None = None) -> Scope:
+    """Index key for a conversation, or for a user's messages outside any conversation."""
+    return (user_id, conversation_id)
+
+
+def is_indexed(key: Scope) -> bool:
+    """True once the scope's history has been loaded into the index."""
+    return key in _indexes
+
+
+def build_user_index(key: Scope, messages) -> None:
+    """
+    (Re)build a scope's index from its stored messages, oldest first (only
+    the newest HISTORY_INDEX_MAX_MESSAGES are kept). `messages` is any
+    iterable of objects with `id` and `content`. Tokenizes every message:
+    call it from a worker thread.
+    """
+    index = _UserIndex()
+    for msg in messages:
+        index.add(msg.id, msg.content)
+    with _lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > HISTORY_INDEX_MAX_SCOPES:
+            _indexes.popitem(last=False)
+
+
+def index_message(key: Scope, message_id: int, content: str) -> None:
+    """
+    Add one freshly saved message to the scope's index.
+    Scopes whose history has not been loaded yet are skipped; their index
+    is built from the database on first search instead.
+    """
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            index.add(message_id, content)
+
+
+def search(key: Scope, query: str, top_k: int = 5, exclude: set[int] | None = None) -> list[int]:
+    """Return the ids of the `top_k` messages most relevant to `query`."""
+    with _lock:
+        index = _indexes.get(key)
+        if index is None:
+            return []
+        _indexes.move_to_end(key)
+        return [message_id for message_id, _ in index.search(query, top_k, exclude or set())]
+
+
+def clear(user_id: int | None = None) -> None:
+    """Drop all of one user's indexes (or everyone's), e.g. after history is deleted."""
+    with _lock:
+        if user_id is None:
+            _indexes.clear()
+        else:
+            for key in [key for key in _indexes if key[0] == user_id]:
+                del _indexes[key]
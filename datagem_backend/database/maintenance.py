@@ -0,0 +1,424 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, or_, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from chat import metrics
+from database import blob_store, crud, history_index, search, models as db_models
+from database.database import SessionLocal, engine as default_engine
+
+# =====================
+# History retention, archival and compaction.
+#
+# One maintenance run:
+#   1. archives history older than each user's retention period
+#      (users.history_retention_days, else HISTORY_RETENTION_DAYS) to
+#      gzipped JSON-lines files under HISTORY_ARCHIVE_DIR, then deletes it:
+#      whole conversations idle for that long, and messages sent outside any
+#      conversation in files of ARCHIVE_FILE_MESSAGES;
+#   2. moves plot payloads (and other large inline text) of messages older
+#      than IMAGE_RETENTION_DAYS out of chat_history, into message_blobs
+#      ("externalize") or dropping them ("strip");
+#   3. deletes blobs no message refers to any more and none has used in
+#      the last BLOB_DELETE_GRACE_MINUTES;
+#   4. runs ANALYZE, and VACUUM when enough space is free to be worth it;
+# and reports table sizes and query latency before and after.
+#
+# Archive files are written before anything is deleted, and can be loaded
+# back with restore_archive(). Runs from the app every
+# MAINTENANCE_INTERVAL_HOURS, or on demand: python history_maintenance.py
+# =====================
+
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "0"))  # 0: keep forever
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", "./archive")
+IMAGE_RETENTION_DAYS = int(os.getenv("IMAGE_RETENTION_DAYS", "30"))  # 0: leave rows as they are
+IMAGE_RETENTION_MODE = os.getenv("IMAGE_RETENTION_MODE", "externalize")  # or "strip"
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "0"))  # 0: CLI only
+# Unreferenced blobs used more recently than this are kept (see delete_unreferenced_blobs)
+BLOB_DELETE_GRACE_MINUTES = float(os.getenv("BLOB_DELETE_GRACE_MINUTES", "60"))
+
+ARCHIVE_FILE_MESSAGES = 10_000
+BATCH_SIZE = 500
+# VACUUM rewrites the whole SQLite file; only worth it once this share of it is free
+VACUUM_FREE_RATIO = 0.2
+REPORT_QUERIES = 20
+
+
+def retention_days(user: db_models.User) -> int:
+    if user.history_retention_days is not None:
+        return user.history_retention_days
+    return HISTORY_RETENTION_DAYS
+
+
+def _cutoff(days: int) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+def _isoformat(value: datetime | None) -> str | None:
+    return value.isoformat() if value is not None else None
+
+
+# =====================
+# Archive and restore
+# =====================
+
+def _write_archive(path: str, header: dict, lines) -> None:
+    """Write a gzipped JSON-lines archive atomically (a crash leaves no partial file)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+    os.replace(tmp_path, path)
+
+
+def _message_lines(db: Session, messages: list[db_models.ChatHistory]):
+    for message in messages:
+        yield {
+            "role": message.role,
+            "content": crud.get_message_content(db, message),
+            "timestamp": _isoformat(message.timestamp),
+        }
+
+
+def _delete_messages(db: Session, message_ids: list[int]) -> None:
+    for start in range(0, len(message_ids), BATCH_SIZE):
+        chunk = message_ids[start:start + BATCH_SIZE]
+        db.execute(delete(db_models.ChatHistory).where(db_models.ChatHistory.id.in_(chunk)))
+
+
+def archive_conversation(db: Session, user: db_models.User, conversation: db_models.Conversation) -> int:
+    """Archive one conversation with its messages, then delete them. Returns the message count."""
+    messages = db.scalars(
+        select(db_models.ChatHistory)
+        .where(db_models.ChatHistory.conversation_id == conversation.id)
+        .order_by(db_models.ChatHistory.timestamp, db_models.ChatHistory.id)
+    ).all()
+    header = {
+        "kind": "conversation",
+        "user_id": user.id,
+        "email": user.email,
+        "title": conversation.title,
+        "dataset_name": conversation.dataset_name,
+        "dataset_fingerprint": conversation.dataset_fingerprint,
+        "created_at": _isoformat(conversation.created_at),
+        "updated_at": _isoformat(conversation.updated_at),
+    }
+    path = os.path.join(HISTORY_ARCHIVE_DIR, f"user_{user.id}", f"conversation_{conversation.id}.jsonl.gz")
+    _write_archive(path, header, _message_lines(db, messages))
+    _delete_messages(db, [m.id for m in messages])
+    db.execute(delete(db_models.Conversation).where(db_models.Conversation.id == conversation.id))
+    db.commit()
+    return len(messages)
+
+
+def archive_loose_messages(db: Session, user: db_models.User, cutoff: datetime) -> int:
+    """
+    Archive a user's messages sent outside any conversation before `cutoff`,
+    oldest first, ARCHIVE_FILE_MESSAGES per file. Returns the message count.
+    """
+    archived = 0
+    while True:
+        messages = db.scalars(
+            select(db_models.ChatHistory)
+            .where(
+                db_models.ChatHistory.user_id == user.id,
+                db_models.ChatHistory.conversation_id.is_(None),
+                db_models.ChatHistory.timestamp < cutoff,
+            )
+            .order_by(db_models.ChatHistory.timestamp, db_models.ChatHistory.id)
+            .limit(ARCHIVE_FILE_MESSAGES)
+        ).all()
+        if not messages:
+            return archived
+        header = {"kind": "messages", "user_id": user.id, "email": user.email}
+        path = os.path.join(
+            HISTORY_ARCHIVE_DIR, f"user_{user.id}", f"messages_{messages[0].id}-{messages[-1].id}.jsonl.gz"
+        )
+        _write_archive(path, header, _message_lines(db, messages))
+        _delete_messages(db, [m.id for m in messages])
+        db.commit()
+        archived += len(messages)
+
+
+def restore_archive(db: Session, path: str) -> int:
+    """
+    Load an archive file back into the database (messages get new ids and
+    keep their timestamps; a conversation comes back as a new conversation).
+    Returns the number of restored messages.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        user = crud.get_user_by_email(db, header["email"])
+        if user is None:
+            raise ValueError(f"{path}: user {header['email']} does not exist")
+
+        conversation_id = None
+        if header["kind"] == "conversation":
+            conversation = db_models.Conversation(
+                user_id=user.id,
+                title=header["title"],
+                dataset_name=header["dataset_name"],
+                dataset_fingerprint=header["dataset_fingerprint"],
+            )
+            if header["created_at"]:
+                conversation.created_at = datetime.fromisoformat(header["created_at"])
+            if header["updated_at"]:
+                conversation.updated_at = datetime.fromisoformat(header["updated_at"])
+            db.add(conversation)
+            db.flush()
+            conversation_id = conversation.id
+
+        restored = 0
+        stored = set()
+        for line in f:
+            record = json.loads(line)
+            message, blob = blob_store.prepare_message(user.id, record["role"], record["content"], conversation_id)
+            if record["timestamp"]:
+                message.timestamp = datetime.fromisoformat(record["timestamp"])
+            if blob is not None and blob.id not in stored:
+                blob_store.save_blobs(db, [blob])
+                stored.add(blob.id)
+            db.add(message)
+            restored += 1
+            if restored % BATCH_SIZE == 0:
+                db.flush()
+        db.commit()
+    history_index.clear(user.id)
+    print(f"📦 Restored {restored} message(s) from {path}")
+    return restored
+
+
+# =====================
+# Payloads and blobs
+# =====================
+
+def compact_old_payloads(db: Session, cutoff: datetime, keep: bool = True) -> int:
+    """
+    Move plot payloads and other large inline text of messages older than
+    `cutoff` out of chat_history (into blobs, or dropped with keep=False).
+    Returns the number of rows changed.
+    """
+    changed = 0
+    last_id = 0
+    while True:
+        messages = db.scalars(
+            select(db_models.ChatHistory)
+            .where(
+                db_models.ChatHistory.id > last_id,
+                db_models.ChatHistory.blob_id.is_(None),
+                db_models.ChatHistory.content_size.is_(None),
+                db_models.ChatHistory.timestamp < cutoff,
+                or_(
+                    db_models.ChatHistory.content.like("%PLOT_IMG_BASE64:%"),
+                    func.length(db_models.ChatHistory.content) > blob_store.MESSAGE_INLINE_MAX_CHARS,
+                ),
+            )
+            .order_by(db_models.ChatHistory.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not messages:
+            return changed
+        blobs = {}
+        for message in messages:
+            blob = blob_store.externalize(message, keep=keep)
+            if blob is not None:
+                blobs[blob.id] = blob
+        blob_store.save_blobs(db, blobs.values())
+        db.commit()
+        changed += len(messages)
+        last_id = messages[-1].id
+
+
+def delete_unreferenced_blobs(db: Session, grace_minutes: float = BLOB_DELETE_GRACE_MINUTES) -> int:
+    """
+    Delete blobs no message refers to. Blobs used within the last
+    `grace_minutes` are kept: a message still queued by the write-behind
+    writer (or saved by another process) may be about to refer to one
+    through dedup, and saving it refreshes the blob's last_used_at.
+    """
+    referenced = select(db_models.ChatHistory.blob_id).where(db_models.ChatHistory.blob_id.is_not(None))
+    recently_used = db_models.MessageBlob.last_used_at >= datetime.now(timezone.utc) - timedelta(minutes=grace_minutes)
+    result = db.execute(
+        delete(db_models.MessageBlob).where(
+            db_models.MessageBlob.id.not_in(referenced),
+            or_(db_models.MessageBlob.last_used_at.is_(None), ~recently_used),
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+# =====================
+# Compaction and reports
+# =====================
+
+def compact_database(engine: Engine) -> list[str]:
+    """ANALYZE, merge the full-text index, and VACUUM where it pays off. Returns what ran."""
+    ran = []
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if engine.dialect.name == "sqlite":
+            if search.SEARCH_BACKEND == "fts5":
+                conn.execute(text("INSERT INTO chat_history_fts(chat_history_fts) VALUES ('optimize')"))
+                ran.append("fts optimize")
+            page_count = conn.execute(text("PRAGMA page_count")).scalar()
+            free_pages = conn.execute(text("PRAGMA freelist_count")).scalar()
+            if page_count and free_pages / page_count >= VACUUM_FREE_RATIO:
+                conn.execute(text("VACUUM"))
+                ran.append("VACUUM")
+            conn.execute(text("ANALYZE"))
+            ran.append("ANALYZE")
+        elif engine.dialect.name == "postgresql":
+            # Not bound by the app's statement timeout (see profiles.py); RESET
+            # restores it before the connection goes back to the pool
+            conn.execute(text("SET statement_timeout = 0"))
+            try:
+                for table in ("chat_history", "message_blobs", "conversations"):
+                    conn.execute(text(f"VACUUM (ANALYZE) {table}"))
+            finally:
+                conn.execute(text("RESET statement_timeout"))
+            ran.append("VACUUM (ANALYZE)")
+    return ran
+
+
+def _table_bytes(db: Session, dialect: str) -> dict:
+    tables = ("chat_history", "message_blobs", "conversations")
+    if dialect == "postgresql":
+        sizes = {t: db.execute(text(f"SELECT pg_total_relation_size('{t}')")).scalar() for t in tables}
+        sizes["database"] = db.execute(text("SELECT pg_database_size(current_database())")).scalar()
+        return sizes
+    sizes = {}
+    if dialect == "sqlite":
+        try:
+            # Table plus its indexes (dbstat is missing from some SQLite builds)
+            for table in tables:
+                sizes[table] = db.execute(
+                    text(
+                        "SELECT SUM(pgsize) FROM dbstat WHERE name = :t "
+                        "OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t)"
+                    ),
+                    {"t": table},
+                ).scalar() or 0
+        except Exception:
+            db.rollback()
+        sizes["database"] = (
+            db.execute(text("PRAGMA page_count")).scalar() * db.execute(text("PRAGMA page_size")).scalar()
+        )
+    return sizes
+
+
+def _latency_ms(fn) -> float:
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(REPORT_QUERIES):
+        fn()
+    return (time.perf_counter() - start) / REPORT_QUERIES * 1000
+
+
+def storage_report(db: Session) -> dict:
+    """Row counts, table sizes in bytes, and the latency of typical history queries."""
+    dialect = db.get_bind().dialect.name
+    report = {
+        "rows": {
+            "chat_history": db.scalar(select(func.count()).select_from(db_models.ChatHistory)),
+            "message_blobs": db.scalar(select(func.count()).select_from(db_models.MessageBlob)),
+            "conversations": db.scalar(select(func.count()).select_from(db_models.Conversation)),
+        },
+        "bytes": _table_bytes(db, dialect),
+        "latency_ms": {},
+    }
+    busiest = db.execute(
+        select(db_models.ChatHistory.user_id)
+        .group_by(db_models.ChatHistory.user_id)
+        .order_by(func.count().desc())
+        .limit(1)
+    ).scalar()
+    if busiest is not None:
+        report["latency_ms"]["history_page"] = _latency_ms(
+            lambda: crud.get_chat_history_page(db, user_id=busiest, before=None, limit=50)
+        )
+        if search.SEARCH_BACKEND is not None:
+            report["latency_ms"]["search"] = _latency_ms(
+                lambda: crud.search_chat_messages(db, user_id=busiest, query="data analysis")
+            )
+    return report
+
+
+def print_report(before: dict, after: dict | None = None) -> None:
+    reports = [before] if after is None else [before, after]
+    print(f"{'':<24}" + "".join(f"{label:>14}" for label in ("before", "after")[:len(reports)]))
+    for section in ("rows", "bytes", "latency_ms"):
+        for name in sorted(set().union(*(r[section] for r in reports))):
+            values = [r[section].get(name) for r in reports]
+            cells = ["-" if v is None else (f"{v:.2f}" if section == "latency_ms" else f"{v:,}") for v in values]
+            print(f"{section + '.' + name:<24}" + "".join(f"{cell:>14}" for cell in cells))
+
+
+# =====================
+# Maintenance run
+# =====================
+
+def run_maintenance(session_factory=SessionLocal, engine: Engine = default_engine) -> dict:
+    """One full maintenance pass (see the top of this module). Returns its report."""
+    started = time.perf_counter()
+    result = {"archived_conversations": 0, "archived_messages": 0, "compacted_messages": 0, "deleted_blobs": 0}
+    with session_factory() as db:
+        result["before"] = storage_report(db)
+
+        for user in db.scalars(select(db_models.User)).all():
+            days = retention_days(user)
+            if days <= 0:
+                continue
+            cutoff = _cutoff(days)
+            idle = db.scalars(
+                select(db_models.Conversation).where(
+                    db_models.Conversation.user_id == user.id,
+                    db_models.Conversation.updated_at < cutoff,
+                )
+            ).all()
+            for conversation in idle:
+                result["archived_messages"] += archive_conversation(db, user, conversation)
+                result["archived_conversations"] += 1
+            result["archived_messages"] += archive_loose_messages(db, user, cutoff)
+            history_index.clear(user.id)
+
+        if IMAGE_RETENTION_DAYS > 0:
+            result["compacted_messages"] = compact_old_payloads(
+                db, _cutoff(IMAGE_RETENTION_DAYS), keep=IMAGE_RETENTION_MODE != "strip"
+            )
+        result["deleted_blobs"] = delete_unreferenced_blobs(db)
+
+    result["compaction"] = compact_database(engine)
+    with session_factory() as db:
+        result["after"] = storage_report(db)
+
+    elapsed = time.perf_counter() - started
+    metrics.incr("maintenance_runs")
+    metrics.incr("maintenance_archived_messages", result["archived_messages"])
+    metrics.observe("maintenance_seconds", elapsed)
+    print(
+        f"🧹 Maintenance done in {elapsed:.1f}s: archived {result['archived_conversations']} conversation(s) "
+        f"and {result['archived_messages']} message(s), compacted {result['compacted_messages']} message(s), "
+        f"deleted {result['deleted_blobs']} blob(s); {', '.join(result['compaction']) or 'no compaction'}"
+    )
+    print_report(result["before"], result["after"])
+    return result
+
+
+async def run_periodically(interval_hours: float = MAINTENANCE_INTERVAL_HOURS) -> None:
+    """Background task for the app lifespan: one maintenance run per interval, off the event loop."""
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await asyncio.to_thread(run_maintenance)
+        except Exception as e:
+            print(f"❌ Maintenance run failed: {e}")
+            metrics.incr("maintenance_errors")
@@ -0,0 +1,40 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from database import search
+from database.database import Base
+
+#
+# Schema upkeep at startup. There is no migration tool: create_all() only
+# creates missing tables, so columns and indexes added to existing tables
+# later are created here (each step is a no-op once they exist).
+#
+# Only nullable columns without defaults can be added this way, and the
+# foreign key of an added column is not enforced on existing tables
+# (SQLite cannot add constraints with ALTER TABLE).
+#
+
+
+def _add_missing_columns(engine: Engine) -> None:
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                print(f"🛠️ Adding column {table.name}.{column.name}")
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def ensure_schema(engine: Engine) -> None:
+    """Create missing tables, columns and indexes, and the full-text search index."""
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    search.ensure_search_index(engine)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base  # Import the "Base" blueprint from database.py
@@ -18,12 +18,41 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     full_name = Column(String, index=True, nullable=True) # <-- THIS LINE WAS ADDED
     hashed_password = Column(String, nullable=False)
+    # Days of chat history to keep before it is archived (NULL: the
+    # HISTORY_RETENTION_DAYS default, 0: keep forever); see database/maintenance.py
+    history_retention_days = Column(Integer, nullable=True)
 
     # This creates a "link" to the ChatHistory
     # It tells SQL: "If you get a User, you can also get all
     # their chat messages. If you delete a user, delete all
     # their messages too."
     chat_history = relationship("ChatHistory", back_populates="owner", cascade="all, delete-orphan")
+    conversations = relationship("Conversation", back_populates="owner", cascade="all, delete-orphan")
+
+class Conversation(Base):
+    """
+    One chat session. Its messages are a small partition of chat_history,
+    so history for a turn never mixes in other sessions.
+    - dataset_name / dataset_fingerprint: the dataset the session is about
+      (optional; the rows themselves are not stored)
+    - updated_at: time of the latest message, for listing recent sessions
+    """
+    __tablename__ = "conversations"
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index("ix_conversations_user_updated", "user_id", "updated_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    title = Column(String, nullable=True)
+    dataset_name = Column(String, nullable=True)
+    dataset_fingerprint = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    owner = relationship("User", back_populates="conversations")
+    messages = relationship("ChatHistory", back_populates="conversation", cascade="all, delete-orphan")
 
 class ChatHistory(Base):
     """
@@ -31,17 +60,54 @@ class ChatHistory(Base):
     It tells the database to create columns for:
     - id: A unique number for each message
     - user_id: The ID of the user who this message belongs to (Foreign Key)
+    - conversation_id: The conversation it was sent in (Foreign Key, optional)
     - role: Who sent the message ("user" or "model")
-    - content: The actual text of the message
+    - content: The actual text of the message (a preview when blob_id is set)
+    - blob_id: The message_blobs row with the full text of a large message
     - timestamp: The time the message was created (set automatically)
     """
     __tablename__ = "chat_history"
+    # Return the server-set timestamp from the INSERT (no refresh query, and
+    # safe to read on an AsyncSession)
+    __mapper_args__ = {"eager_defaults": True}
+    # Every history query is "this user's messages by time": the composite
+    # index serves the filter and the ORDER BY without scanning or sorting
+    __table_args__ = (
+        Index("ix_chat_history_user_timestamp", "user_id", "timestamp", "id"),
+        Index("ix_chat_history_conversation_timestamp", "conversation_id", "timestamp", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # NULL for messages sent without a conversation (the original flat history)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=True)
     role = Column(String, nullable=False)  # "user" or "model"
+    # The full text, or for large messages a preview (see database/blob_store.py)
     content = Column(Text, nullable=False)
+    # Large messages: the blob holding the full text, and its length
+    blob_id = Column(String(64), ForeignKey("message_blobs.id"), nullable=True)
+    content_size = Column(Integer, nullable=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
     # This creates the other side of the "link" back to the User
     owner = relationship("User", back_populates="chat_history")
+    conversation = relationship("Conversation", back_populates="messages")
+    # Also makes a flush insert the blob before the message that refers to it
+    blob = relationship("MessageBlob")
+
+class MessageBlob(Base):
+    """
+    Full text of a large chat message (plots, long outputs), kept out of
+    chat_history so history rows stay small. Content-addressed: the id is
+    the SHA-256 of the text, so identical payloads are stored once.
+    - data: zlib-compressed UTF-8 text
+    - size: length of the text in characters
+    - last_used_at: when a message last referred to it (set on every save,
+      so maintenance leaves blobs a queued message may still need alone)
+    """
+    __tablename__ = "message_blobs"
+
+    id = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    last_used_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,367 @@
+import asyncio
+import os
+import sqlite3
+import threading
+from collections import deque
+
+from sqlalchemy import event, exc, pool
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.util import await_only
+
+# =====================
+# Engine profiles, picked from DATABASE_URL.
+#
+# SQLite: WAL journal (readers never wait for the writer), synchronous=NORMAL
+# (safe with WAL, no fsync per commit), a memory-mapped file, and a busy
+# timeout, set on every new connection. Writes go through one writer
+# connection per database file and process, shared by the sync and the
+# async engine: flushes and INSERT/UPDATE/DELETE statements are routed to
+# it by the session class (see session_class()), and once a transaction has
+# written, its reads use it too (so they see its own writes). Writers from
+# worker threads and from the event loop queue for it in arrival order
+# instead of polling SQLite's file lock; sync sessions can't write from the
+# event loop thread, where waiting would block the loop. This profile relies on WAL (the
+# writer never blocks readers), so other journal modes are rejected.
+#
+# PostgreSQL: pools sized from a connection budget shared by all worker
+# processes, connections recycled periodically (instead of a pre-ping round
+# trip on every checkout), and a server-side statement timeout.
+# =====================
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SINGLE_WRITER = os.getenv("SQLITE_SINGLE_WRITER", "1") == "1"
+
+# Connections all worker processes may open together (keep it below the
+# server's max_connections); each process gets its share
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "40"))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Explicit pool sizes per engine (override the budget split)
+DB_POOL_SIZE = int(os.environ["DB_POOL_SIZE"]) if os.getenv("DB_POOL_SIZE") else None
+DB_MAX_OVERFLOW = int(os.environ["DB_MAX_OVERFLOW"]) if os.getenv("DB_MAX_OVERFLOW") else None
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "0") == "1"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))  # 0: no limit
+
+
+def is_file_sqlite(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def _pool_budget(kind: str) -> int:
+    """Connections one process may open on its sync or async engine."""
+    per_process = max(4, DB_MAX_CONNECTIONS // WEB_CONCURRENCY)
+    # Chat traffic runs on the async engine, so it gets two thirds
+    async_share = per_process * 2 // 3
+    return async_share if kind == "async" else per_process - async_share
+
+
+def engine_options(url, kind: str = "sync") -> dict:
+    """create_engine()/create_async_engine() keyword arguments for this URL ("sync" or "async" engine)."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        return {}
+    if backend != "postgresql":
+        return {"pool_pre_ping": True}
+
+    budget = _pool_budget(kind)
+    pool_size = DB_POOL_SIZE if DB_POOL_SIZE is not None else max(2, budget // 2)
+    max_overflow = DB_MAX_OVERFLOW if DB_MAX_OVERFLOW is not None else max(0, budget - pool_size)
+    options = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        driver = url.get_driver_name()
+        if driver == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        elif driver in ("psycopg2", "psycopg"):
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+class _WriterSlot:
+    """
+    The right to use a writer connection: one holder at a time, handed over
+    in arrival order to worker threads and event-loop tasks alike.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = False
+        self._waiters: deque = deque()  # threading.Event, or (loop, future)
+
+    def acquire(self, timeout: float) -> bool:
+        with self._lock:
+            if not self._held:
+                self._held = True
+                return True
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        if waiter.wait(timeout):
+            return True
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return False
+        return True  # handed over just as the wait timed out
+
+    async def acquire_async(self, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._held:
+                self._held = True
+                return True
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    return False
+            # Already being handed over: take it, or pass it on when cancelled
+            if not waiter[1].cancel():
+                if isinstance(e, asyncio.CancelledError):
+                    self.release()
+                    raise
+                return True
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return False
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                try:
+                    loop.call_soon_threadsafe(self._hand_over, future)
+                    return
+                except RuntimeError:  # that loop is closed
+                    continue
+            self._held = False
+
+    def _hand_over(self, future: asyncio.Future) -> None:
+        if future.done():  # its waiter gave up meanwhile
+            self.release()
+        else:
+            future.set_result(True)
+
+
+class _SharedConnection:
+    """
+    A sqlite3 connection as handed to one engine's pool. close() only ends
+    the open transaction: the connection stays open for the other engine.
+
+    What the two dialects do with it (SQLAlchemy 2.x): pysqlite and
+    aiosqlite both register the same REGEXP function (create_function) on
+    connect, then only call cursor(), commit() and rollback(). Neither sets
+    connection attributes unless an engine is given an isolation_level,
+    which the writer engines never are. Setting one (isolation_level,
+    row_factory, ...) would change the connection under the other dialect,
+    so it is refused.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        object.__setattr__(self, "_connection", connection)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"the shared SQLite writer connection can't take per-engine settings ({name})")
+
+    def close(self) -> None:
+        self._connection.rollback()
+
+
+class _Writer:
+    """The writer connection of one SQLite file, and the slot guarding it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.slot = _WriterSlot()
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def connect(self) -> _SharedConnection:
+        with self._lock:
+            if self._connection is None:
+                # Used from worker threads and aiosqlite's thread, never at once
+                self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            return _SharedConnection(self._connection)
+
+    async def connect_async(self):
+        import aiosqlite
+
+        return await aiosqlite.Connection(self.connect, iter_chunk_size=64)
+
+
+_WRITERS: dict[str, _Writer] = {}
+_WRITERS_LOCK = threading.Lock()
+
+
+def _writer_for(url) -> _Writer:
+    path = os.path.abspath(make_url(url).database)
+    with _WRITERS_LOCK:
+        if path not in _WRITERS:
+            _WRITERS[path] = _Writer(path)
+        return _WRITERS[path]
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _slot_timeout_error(timeout: float) -> exc.TimeoutError:
+    return exc.TimeoutError(f"SQLite writer connection busy, timed out after {timeout:.2f}s")
+
+
+class _WriterPool(pool.QueuePool):
+    """One-connection pool of the sync writer engine; checkouts hold the writer slot."""
+
+    writer: _Writer
+
+    def _do_get(self):
+        if _on_event_loop():
+            # The slot may be held by a task of this very loop, which could
+            # then never run to release it
+            raise RuntimeError(
+                "Sync SQLite writes can't run on the event loop thread; "
+                "use an AsyncSession or run them in a worker thread (asyncio.to_thread)"
+            )
+        if not self.writer.slot.acquire(self._timeout):
+            raise _slot_timeout_error(self._timeout)
+        try:
+            return super()._do_get()
+        except BaseException:
+            self.writer.slot.release()
+            raise
+
+    def _do_return_conn(self, record) -> None:
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self.writer.slot.release()
+
+
+class _AsyncWriterPool(pool.AsyncAdaptedQueuePool):
+    """One-connection pool of the async writer engine; waits for the writer slot without blocking the loop."""
+
+    writer: _Writer
+
+    def _do_get(self):
+        if not await_only(self.writer.slot.acquire_async(self._timeout)):
+            raise _slot_timeout_error(self._timeout)
+        try:
+            return super()._do_get()
+        except BaseException:
+            self.writer.slot.release()
+            raise
+
+    def _do_return_conn(self, record) -> None:
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self.writer.slot.release()
+
+
+def check_writer_profile() -> None:
+    """The single-writer profile needs WAL: in any other journal mode the writer blocks every reader."""
+    if SQLITE_JOURNAL_MODE.upper() != "WAL":
+        raise ValueError(
+            f"❌ SQLITE_SINGLE_WRITER=1 requires SQLITE_JOURNAL_MODE=WAL (got {SQLITE_JOURNAL_MODE}). "
+            "Set SQLITE_SINGLE_WRITER=0 to use another journal mode."
+        )
+
+
+def writer_engine_options(url, kind: str = "sync") -> dict:
+    """
+    Options for the SQLite writer engine of `url` ("sync" or "async"): the
+    file's one shared writer connection, waited for in order.
+    """
+    check_writer_profile()
+    writer = _writer_for(url)
+    pool_class = _AsyncWriterPool if kind == "async" else _WriterPool
+    options = {
+        "poolclass": type(pool_class.__name__, (pool_class,), {"writer": writer}),
+        "pool_size": 1,
+        "max_overflow": 0,
+        "pool_timeout": max(DB_POOL_TIMEOUT, SQLITE_BUSY_TIMEOUT_MS / 1000),
+    }
+    if kind == "async":
+        options["async_creator"] = writer.connect_async
+    else:
+        options["creator"] = writer.connect
+    return options
+
+
+def configure_engine(engine: Engine) -> None:
+    """Install the per-connection settings of the profile (pass `async_engine.sync_engine` for async engines)."""
+    if engine.dialect.name != "sqlite" or not is_file_sqlite(engine.url):
+        return
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        journal_mode = cursor.fetchone()[0]
+        if SQLITE_SINGLE_WRITER and journal_mode.upper() != "WAL":
+            # SQLite keeps the old mode where WAL is unsupported (e.g. network file systems)
+            cursor.close()
+            raise RuntimeError(f"❌ SQLITE_SINGLE_WRITER=1 requires WAL, but {engine.url.database} is in {journal_mode} mode")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+
+class _WriterRoutingSession(Session):
+    """
+    Session that sends flushes and DML statements to `writer_engine`, and
+    everything else to its bind until the transaction has written.
+    """
+
+    writer_engine: Engine | None = None
+    _wrote = False
+
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        if self._wrote or self._flushing or isinstance(clause, UpdateBase):
+            self._wrote = True
+            return self.writer_engine
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+@event.listens_for(_WriterRoutingSession, "after_transaction_end")
+def _reset_writer_routing(session, transaction):
+    if transaction.parent is None:
+        session._wrote = False
+
+
+def session_class(writer_engine: Engine | None) -> type[Session]:
+    """Session class for sessionmaker(class_=...) / async_sessionmaker(sync_session_class=...)."""
+    if writer_engine is None:
+        return Session
+    return type("WriterRoutingSession", (_WriterRoutingSession,), {"writer_engine": writer_engine})
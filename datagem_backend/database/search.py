@@ -0,0 +1,165 @@
+from sqlalchemy import DateTime, Float, inspect, text
+from sqlalchemy.engine import Engine
+
+from database import history_index
+
+# =====================
+# Full-text search over chat history.
+#
+# The index lives in the database and the backend follows DATABASE_URL:
+#   - SQLite: an FTS5 table (chat_history_fts) over chat_history.content
+#     and its owner, ranked with bm25(). Triggers on chat_history keep it
+#     current.
+#   - PostgreSQL: a generated tsvector column (chat_history.search_vector)
+#     with a GIN index, ranked with ts_rank_cd().
+# Either way every insert (save_chat_message, write-behind batches) updates
+# the index in the same transaction, and so do deletes/updates (retention).
+# Large messages are indexed by their preview (see blob_store.py).
+#
+# Queries need every meaningful word, which keeps the ranked set small;
+# crud.search_chat_messages falls back to any word when nothing matches.
+# =====================
+
+SEARCH_PAGE_MAX = 50
+SNIPPET_WORDS = 16
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+
+# "fts5" or "tsvector" once ensure_search_index() succeeded, else None
+SEARCH_BACKEND: str | None = None
+
+# The FTS table also indexes the owner ("u<user_id>"), so the per-user
+# filter is part of the MATCH instead of a join over every user's hits.
+# Its external content is a view that yields the same columns.
+_SQLITE_DDL = [
+    """CREATE VIEW IF NOT EXISTS chat_history_fts_source AS
+        SELECT id, content, 'u' || user_id AS owner FROM chat_history""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+        content, owner, content='chat_history_fts_source', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS chat_history_fts_insert AFTER INSERT ON chat_history BEGIN
+        INSERT INTO chat_history_fts(rowid, content, owner) VALUES (new.id, new.content, 'u' || new.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_history_fts_delete AFTER DELETE ON chat_history BEGIN
+        INSERT INTO chat_history_fts(chat_history_fts, rowid, content, owner)
+            VALUES ('delete', old.id, old.content, 'u' || old.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_history_fts_update AFTER UPDATE OF content, user_id ON chat_history BEGIN
+        INSERT INTO chat_history_fts(chat_history_fts, rowid, content, owner)
+            VALUES ('delete', old.id, old.content, 'u' || old.user_id);
+        INSERT INTO chat_history_fts(rowid, content, owner) VALUES (new.id, new.content, 'u' || new.user_id);
+    END""",
+]
+
+_POSTGRES_DDL = [
+    # Filling the column and building the index can outlast the app's statement timeout
+    "SET LOCAL statement_timeout = 0",
+    """ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_search ON chat_history USING GIN (search_vector)",
+]
+
+
+def ensure_search_index(engine: Engine) -> str | None:
+    """Create the full-text index for this database (and fill it from existing rows)."""
+    global SEARCH_BACKEND
+    dialect = engine.dialect.name
+    try:
+        if dialect == "sqlite":
+            created = not inspect(engine).has_table("chat_history_fts")
+            with engine.begin() as conn:
+                for statement in _SQLITE_DDL:
+                    conn.execute(text(statement))
+                if created:
+                    print("🛠️ Building chat_history_fts from existing messages")
+                    conn.execute(text("INSERT INTO chat_history_fts(chat_history_fts) VALUES ('rebuild')"))
+            SEARCH_BACKEND = "fts5"
+        elif dialect == "postgresql":
+            with engine.begin() as conn:
+                for statement in _POSTGRES_DDL:
+                    conn.execute(text(statement))
+            SEARCH_BACKEND = "tsvector"
+        else:
+            print(f"⚠️ Full-text search is not supported on {dialect}")
+    except Exception as e:
+        print(f"⚠️ Full-text search unavailable: {e}")
+    return SEARCH_BACKEND
+
+
+# Question words, on top of the history_index stopwords ("where did I ...")
+_QUERY_STOPWORDS = frozenset(
+    "about any did does done find found get got had into its just over per their "
+    "them then there they were when where who why will would".split()
+)
+
+
+def query_terms(query: str) -> list[str]:
+    """
+    The meaningful words of a free-text query ("where did I compute churn
+    by region?" -> compute, churn, region). Tokens are [a-z0-9_] only, so
+    user input cannot inject query syntax.
+    """
+    return [t for t in dict.fromkeys(history_index.tokenize(query)) if t not in _QUERY_STOPWORDS]
+
+
+def search_statement(
+    user_id: int, query: str, conversation_id: int | None, limit: int, offset: int, match_all: bool = True
+):
+    """
+    Statement and parameters returning (id, role, conversation_id,
+    timestamp, snippet, score) for the best matches, best first: messages
+    with every query word, or with any of them when `match_all` is False.
+    Returns None when there is nothing (else) to search for.
+    """
+    params = {"limit": limit, "offset": offset}
+    conversation_filter = ""
+    if conversation_id is not None:
+        conversation_filter = "AND c.conversation_id = :conversation_id"
+        params["conversation_id"] = conversation_id
+
+    terms = query_terms(query)
+    if not terms or (not match_all and len(terms) == 1):
+        return None
+
+    if SEARCH_BACKEND == "fts5":
+        joined = (" AND " if match_all else " OR ").join(f'"{term}"' for term in terms)
+        params["match"] = f'owner : "u{int(user_id)}" AND content : ({joined})'
+        params["start"], params["stop"] = HIGHLIGHT_START, HIGHLIGHT_STOP
+        sql = f"""
+            SELECT c.id, c.role, c.conversation_id, c.timestamp,
+                   snippet(chat_history_fts, 0, :start, :stop, '…', {SNIPPET_WORDS}) AS snippet,
+                   -bm25(chat_history_fts, 1.0, 0.0) AS score
+            FROM chat_history_fts
+            JOIN chat_history AS c ON c.id = chat_history_fts.rowid
+            WHERE chat_history_fts MATCH :match {conversation_filter}
+            ORDER BY bm25(chat_history_fts, 1.0, 0.0), c.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    elif SEARCH_BACKEND == "tsvector":
+        params["user_id"] = user_id
+        params["query"] = (" & " if match_all else " | ").join(terms)
+        params["headline"] = (
+            f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, "
+            f"MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}, MaxFragments=1"
+        )
+        # Rank and page first, so ts_headline only runs for the returned rows
+        sql = f"""
+            WITH hits AS (
+                SELECT c.id, c.role, c.conversation_id, c.timestamp, c.content,
+                       ts_rank_cd(c.search_vector, q.query) AS score
+                FROM chat_history AS c, to_tsquery('english', :query) AS q(query)
+                WHERE c.search_vector @@ q.query AND c.user_id = :user_id {conversation_filter}
+                ORDER BY score DESC, c.id DESC
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT id, role, conversation_id, timestamp,
+                   ts_headline('english', content, to_tsquery('english', :query), :headline) AS snippet,
+                   score
+            FROM hits
+            ORDER BY score DESC, id DESC
+        """
+    else:
+        raise RuntimeError("full-text search is not available on this database")
+
+    statement = text(sql).columns(timestamp=DateTime, score=Float)
+    return statement, params
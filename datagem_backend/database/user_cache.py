@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from chat import metrics
+
+# =====================
+# In-process identity cache.
+#
+# Every /chat request and every authenticated request needs the user row,
+# which almost never changes. Users are cached here by email and by id as
+# plain snapshots (not ORM objects, so they outlive the session that loaded
+# them), with a TTL and LRU eviction. crud.create_user (and anything else
+# that changes a user) calls `invalidate()`.
+# =====================
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Read-only copy of a users row (same attribute names as db_models.User)."""
+    id: int
+    email: str
+    full_name: str | None
+    hashed_password: str
+
+    @classmethod
+    def from_row(cls, user) -> "CachedUser":
+        return cls(id=user.id, email=user.email, full_name=user.full_name, hashed_password=user.hashed_password)
+
+
+class UserCache:
+    """TTL + LRU cache of users, looked up by email or id."""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._by_email: OrderedDict[str, tuple[float, CachedUser]] = OrderedDict()
+        self._email_by_id: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def get_by_email(self, email: str) -> CachedUser | None:
+        with self._lock:
+            entry = self._by_email.get(email)
+            if entry is None:
+                metrics.incr("user_cache_misses")
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                self._drop(email)
+                metrics.incr("user_cache_misses")
+                return None
+            self._by_email.move_to_end(email)
+        metrics.incr("user_cache_hits")
+        return user
+
+    def get_by_id(self, user_id: int) -> CachedUser | None:
+        with self._lock:
+            email = self._email_by_id.get(user_id)
+        return self.get_by_email(email) if email is not None else None
+
+    def put(self, user) -> CachedUser:
+        """Cache a user (ORM row or snapshot) and return the snapshot."""
+        cached = user if isinstance(user, CachedUser) else CachedUser.from_row(user)
+        with self._lock:
+            self._drop(cached.email)
+            self._by_email[cached.email] = (time.monotonic() + self.ttl, cached)
+            self._email_by_id[cached.id] = cached.email
+            while len(self._by_email) > self.max_size:
+                self._drop(next(iter(self._by_email)))
+        return cached
+
+    def invalidate(self, email: str | None = None, user_id: int | None = None) -> None:
+        """Forget a user after it changed (by email, id or both)."""
+        with self._lock:
+            if user_id is not None:
+                email_for_id = self._email_by_id.get(user_id)
+                if email_for_id is not None:
+                    self._drop(email_for_id)
+            if email is not None:
+                self._drop(email)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_email.clear()
+            self._email_by_id.clear()
+
+    def _drop(self, email: str) -> None:
+        entry = self._by_email.pop(email, None)
+        if entry is not None:
+            self._email_by_id.pop(entry[1].id, None)
+
+
+USER_CACHE = UserCache()
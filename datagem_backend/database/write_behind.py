@@ -0,0 +1,232 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from chat import metrics
+from database import async_crud, blob_store, crud, history_index, models as db_models
+from database.async_database import AsyncSessionLocal
+from database.database import SessionLocal
+
+#
+# Write-behind persistence for chat messages.
+#
+# Instead of one commit per message, saved messages are queued and a
+# background task inserts everything queued in the last flush interval in a
+# single transaction. With WRITE_BEHIND_DURABLE_ACK=1 (default) a save only
+# returns once its batch is committed, so callers keep the old guarantee
+# while concurrent turns share commits; with 0 it returns at once and the
+# message is written within WRITE_BEHIND_FLUSH_MS (history reads call
+# `read_barrier()` first, so they still see it).
+#
+# The queue runs on the event loop between start() and stop() (the app
+# lifespan); stop() flushes whatever is left. When it is not running,
+# messages are written directly.
+#
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND", "1") == "1"
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "20"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+WRITE_BEHIND_DURABLE_ACK = os.getenv("WRITE_BEHIND_DURABLE_ACK", "1") == "1"
+# Flush attempts before a batch is given up (non-durable mode only; durable
+# callers get the error instead)
+WRITE_BEHIND_MAX_ATTEMPTS = 3
+
+
+class _Pending:
+    __slots__ = ("seq", "fields", "message", "done", "attempts")
+
+    def __init__(self, seq: int, fields: dict, done: asyncio.Future | None):
+        self.seq = seq  # enqueue order, for read_barrier()
+        self.fields = fields
+        self.message: db_models.ChatHistory | None = None  # built per flush attempt
+        self.done = done
+        self.attempts = 0
+
+
+class WriteBehindQueue:
+    """Batches chat message inserts into one transaction per flush interval."""
+
+    def __init__(
+        self,
+        async_session_factory=AsyncSessionLocal,
+        sync_session_factory=SessionLocal,
+        flush_interval: float = WRITE_BEHIND_FLUSH_MS / 1000,
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        durable_ack: bool = WRITE_BEHIND_DURABLE_ACK,
+    ):
+        self.async_session_factory = async_session_factory
+        self.sync_session_factory = sync_session_factory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.durable_ack = durable_ack
+        self._pending: deque[_Pending] = deque()
+        # The batch being inserted: popped from _pending, not yet committed
+        self._in_flight: list[_Pending] = []
+        self._seq = 0
+        self._wakeup: asyncio.Event | None = None
+        self._flushed: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._flushed = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print(f"🗃️ Write-behind queue started (flush {self.flush_interval * 1000:.0f} ms, "
+              f"durable ack {'on' if self.durable_ack else 'off'})")
+
+    async def stop(self) -> None:
+        """Stop the background task and flush everything still queued."""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        self._stopping = True
+        self._wakeup.set()
+        await task
+        while self._pending:
+            await self._flush_batch()
+
+    async def save(self, user_id: int, role: str, content: str, conversation_id: int | None = None):
+        """
+        Queue one message. With durable ack, waits for its batch to commit
+        and returns the saved ChatHistory row; otherwise returns None at once.
+        """
+        item = self._enqueue(user_id, role, content, conversation_id, durable=self.durable_ack)
+        if item.done is None:
+            return None
+        await asyncio.shield(item.done)
+        return item.message
+
+    def enqueue(self, user_id: int, role: str, content: str, conversation_id: int | None = None) -> None:
+        """Queue one message without waiting (usable where awaiting is not, e.g. in a cancelled task)."""
+        self._enqueue(user_id, role, content, conversation_id, durable=False)
+
+    def _enqueue(self, user_id, role, content, conversation_id, durable: bool) -> _Pending:
+        fields = {"user_id": user_id, "conversation_id": conversation_id, "role": role, "content": content}
+        self._seq += 1
+        item = _Pending(self._seq, fields, asyncio.get_running_loop().create_future() if durable else None)
+        self._pending.append(item)
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        return item
+
+    async def read_barrier(self) -> None:
+        """Wait until every message queued so far is committed (or given up)."""
+        target = self._seq
+        while self.running and self._oldest_unsaved() <= target:
+            self._flushed.clear()
+            self._wakeup.set()
+            await self._flushed.wait()
+
+    def _oldest_unsaved(self) -> float:
+        """Sequence number of the oldest message not yet committed (inf when there is none)."""
+        oldest = min((item.seq for item in self._in_flight), default=float("inf"))
+        if self._pending:
+            oldest = min(oldest, self._pending[0].seq)
+        return oldest
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._pending:
+                await self._flush_batch()
+            self._flushed.set()
+
+    async def _flush_batch(self) -> None:
+        batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+        self._in_flight = batch
+        try:
+            await self._insert_batch(batch)
+        finally:
+            self._in_flight = []
+
+    async def _insert_batch(self, batch: list[_Pending]) -> None:
+        blobs = {}
+        for item in batch:
+            item.message, blob = blob_store.prepare_message(**item.fields)
+            if blob is not None:
+                blobs[blob.id] = blob
+        messages = [item.message for item in batch]
+        started = time.perf_counter()
+        try:
+            if self.async_session_factory is not None:
+                await self._insert_async(messages, list(blobs.values()))
+            else:
+                await asyncio.to_thread(self._insert_sync, messages, list(blobs.values()))
+        except Exception as e:
+            print(f"❌ Write-behind flush of {len(batch)} message(s) failed: {e}")
+            metrics.incr("write_behind_errors")
+            retry = []
+            for item in batch:
+                item.attempts += 1
+                if item.done is not None:
+                    if not item.done.done():
+                        item.done.set_exception(e)
+                elif item.attempts < WRITE_BEHIND_MAX_ATTEMPTS:
+                    retry.append(item)
+            self._pending.extendleft(reversed(retry))
+            if retry:
+                await asyncio.sleep(self.flush_interval)
+            return
+
+        metrics.incr("write_behind_flushes")
+        metrics.observe("write_behind_batch_size", len(batch))
+        metrics.observe("write_behind_flush_seconds", time.perf_counter() - started)
+        for item in batch:
+            history_index.index_message(
+                history_index.scope(item.fields["user_id"], item.fields["conversation_id"]),
+                item.message.id,
+                item.message.content,
+            )
+            if item.done is not None and not item.done.done():
+                item.done.set_result(None)
+
+    async def _insert_async(self, messages: list[db_models.ChatHistory], blobs: list[db_models.MessageBlob]) -> None:
+        async with self.async_session_factory() as db:
+            await blob_store.save_blobs_async(db, blobs)
+            db.add_all(messages)
+            for conversation_id in {m.conversation_id for m in messages if m.conversation_id is not None}:
+                await db.execute(crud.touch_conversation(conversation_id))
+            await db.commit()
+
+    def _insert_sync(self, messages: list[db_models.ChatHistory], blobs: list[db_models.MessageBlob]) -> None:
+        db = self.sync_session_factory()
+        try:
+            blob_store.save_blobs(db, blobs)
+            db.add_all(messages)
+            for conversation_id in {m.conversation_id for m in messages if m.conversation_id is not None}:
+                db.execute(crud.touch_conversation(conversation_id))
+            # Keep the ids and timestamps loaded after the session closes
+            db.expire_on_commit = False
+            db.commit()
+        finally:
+            db.close()
+
+
+WRITER = WriteBehindQueue()
+
+
+async def save_chat_message(db, user_id: int, role: str, content: str, conversation_id: int | None = None):
+    """Save a chat message through the queue when it is running, directly otherwise."""
+    if WRITE_BEHIND_ENABLED and WRITER.running:
+        return await WRITER.save(user_id, role, content, conversation_id)
+    return await async_crud.call(
+        "save_chat_message", db, user_id=user_id, role=role, content=content, conversation_id=conversation_id
+    )
+
+
+async def read_barrier() -> None:
+    """Make queued messages visible before reading history."""
+    await WRITER.read_barrier()
@@ -0,0 +1,61 @@
+"""
+Chat history maintenance: retention, archival, payload compaction and
+VACUUM/ANALYZE (see database/maintenance.py).
+
+Run from datagem_backend/:
+    python history_maintenance.py                          # one maintenance run
+    python history_maintenance.py restore FILE [FILE ...]  # load archives back
+    python history_maintenance.py retention EMAIL DAYS     # per-user retention (0: keep forever)
+    python history_maintenance.py report                   # sizes and latency only
+"""
+import argparse
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Same .env lookup as main.py, before the database engine reads DATABASE_URL
+current_dir = Path(__file__).resolve().parent
+for env_file in (current_dir.parent / ".env", current_dir / ".env"):
+    if env_file.exists():
+        load_dotenv(env_file)
+        break
+
+from database import crud, maintenance, migrations  # noqa: E402
+from database.database import SessionLocal, engine  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat history maintenance")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="archive, compact and vacuum (the default)")
+    commands.add_parser("report", help="print table sizes and query latency")
+    restore = commands.add_parser("restore", help="load archive files back into the database")
+    restore.add_argument("files", nargs="+")
+    retention = commands.add_parser("retention", help="set a user's retention in days (0: keep forever)")
+    retention.add_argument("email")
+    retention.add_argument("days", type=int)
+    args = parser.parse_args()
+
+    migrations.ensure_schema(engine)
+    if args.command in (None, "run"):
+        maintenance.run_maintenance()
+    elif args.command == "report":
+        with SessionLocal() as db:
+            report = maintenance.storage_report(db)
+        maintenance.print_report(report)
+    elif args.command == "restore":
+        with SessionLocal() as db:
+            for path in args.files:
+                maintenance.restore_archive(db, path)
+    elif args.command == "retention":
+        with SessionLocal() as db:
+            user = crud.get_user_by_email(db, args.email)
+            if user is None:
+                raise SystemExit(f"❌ No user {args.email}")
+            user.history_retention_days = args.days
+            db.commit()
+        print(f"✅ {args.email}: history kept " + (f"for {args.days} day(s)" if args.days else "forever"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,17 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 import uvicorn
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from dotenv import load_dotenv
 
 from database.database import engine, Base
-from database import models as db_models
-from chat import chat
+from database import maintenance, migrations, write_behind, models as db_models
+from chat import chat, metrics
+from cors import CORSOptionsMiddleware
 from auth.router import router as auth_router  # 1. Import the auth router
 from chat.agent import CURRENT_KEY_INDEX, GEMINI_API_KEYS, LAST_QUOTA_ERROR
 
@@ -23,57 +25,38 @@ if project_root_env.exists():
 elif backend_env.exists():
     load_dotenv(backend_env)
 
-# Create all the database tables
-db_models.Base.metadata.create_all(bind=engine)
+# Create all the database tables (and indexes added since they were created)
+migrations.ensure_schema(engine)
+# Bootstrap users are created here, never on the request path (no bcrypt per request)
+chat.bootstrap_anonymous_user()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Chat messages are batched into one commit per flush interval; whatever
+    # is still queued at shutdown is written before the process exits
+    if write_behind.WRITE_BEHIND_ENABLED:
+        write_behind.WRITER.start()
+    # History retention/archival runs in the background when an interval is set
+    maintenance_task = None
+    if maintenance.MAINTENANCE_INTERVAL_HOURS > 0:
+        maintenance_task = asyncio.create_task(maintenance.run_periodically())
+    yield
+    if maintenance_task is not None:
+        maintenance_task.cancel()
+        try:
+            await maintenance_task
+        except asyncio.CancelledError:
+            pass
+    await write_behind.WRITER.stop()
 
 app = FastAPI(
     title="DataGem AI Analyst Backend",
     description="API for the DataGem project, handling user auth, chat, and AI analysis.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
-# Custom middleware to handle OPTIONS requests BEFORE FastAPI routing
-class CORSOptionsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        origin = request.headers.get("origin", "")
-        
-        # THE MAGIC FIX: Allow localhost, local IPs, and ANY Vercel deployment
-        is_allowed = (
-            origin.endswith(".vercel.app") or 
-            origin.startswith("http://localhost:") or 
-            origin.startswith("http://127.0.0.1:") or
-            origin.startswith("http://192.168.") or
-            origin.startswith("http://10.") or
-            origin.startswith("http://172.")
-        )
-
-        # Handle OPTIONS preflight requests immediately - before routing
-        if request.method == "OPTIONS":
-            response = Response()
-            if is_allowed:
-                response.headers["Access-Control-Allow-Origin"] = origin
-            else:
-                # Fallback to your main domain just in case
-                response.headers["Access-Control-Allow-Origin"] = "https://datagemakshit.vercel.app"
-            
-            response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
-            response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, Accept, Origin, X-Requested-With"
-            response.headers["Access-Control-Allow-Credentials"] = "true"
-            response.headers["Access-Control-Max-Age"] = "3600"
-            return response
-        
-        # For all other requests, process normally and add CORS headers
-        response = await call_next(request)
-        
-        if is_allowed:
-            response.headers["Access-Control-Allow-Origin"] = origin
-            response.headers["Access-Control-Allow-Credentials"] = "true"
-            # Ensure streaming responses have proper headers
-            response.headers["Cache-Control"] = "no-cache"
-            response.headers["X-Accel-Buffering"] = "no"
-            
-        return response
-
+# CORS + OPTIONS preflight handled before FastAPI routing (pure ASGI, see cors.py)
 # Add our custom middleware - this MUST be added LAST so it runs FIRST
 app.add_middleware(CORSOptionsMiddleware)
 
@@ -99,6 +82,13 @@ def health_check():
         "last_quota_error": LAST_QUOTA_ERROR,
     }
 
+@app.get("/metrics", tags=["Health"])
+def read_metrics():
+    """
+    In-process counters and latency summaries (e.g. automatic code repairs).
+    """
+    return metrics.snapshot()
+
 # Standard entry point for running the app
 if __name__ == "__main__":
     import os
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# The agent and database modules read these at import time
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+# Cheap bcrypt cost for the auth tests
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{Path(tempfile.mkdtemp()) / 'test.db'}")
+
+# Modules import each other absolutely, as when run from datagem_backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from google.genai import types as genai_types
+
+#
+# Stand-ins for the google.genai client: scripted model streams and an
+# in-memory cachedContents API.
+#
+
+
+class FakeCaches:
+    def __init__(self, ttl_seconds: float = 3600, fail: bool = False):
+        self.ttl_seconds = ttl_seconds
+        self.fail = fail
+        self.created = []
+        self.updated = []
+
+    def _resource(self, name):
+        expire_time = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        return SimpleNamespace(name=name, expire_time=expire_time, usage_metadata=None)
+
+    def create(self, model, config):
+        if self.fail:
+            raise RuntimeError("400 Cached content is too small")
+        self.created.append((model, config))
+        return self._resource(f"cachedContents/{len(self.created)}")
+
+    def update(self, name, config):
+        self.updated.append(name)
+        self.ttl_seconds = 3600
+        return self._resource(name)
+
+
+def function_call(name: str, **args) -> genai_types.Part:
+    """A scripted function-call part (put it in a step instead of a text chunk)."""
+    return genai_types.Part(function_call=genai_types.FunctionCall(name=name, args=args))
+
+
+class FakeModels:
+    """
+    Replays one scripted step per call: a list of text chunks (or parts,
+    see function_call()), or an exception to raise.
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = []
+
+    def generate_content_stream(self, model, contents, config):
+        self.calls.append(SimpleNamespace(model=model, contents=contents, config=config))
+        step = self.script.pop(0)
+
+        def stream():
+            if isinstance(step, Exception):
+                raise step
+            for chunk in step:
+                part = chunk if isinstance(chunk, genai_types.Part) else genai_types.Part(text=chunk)
+                yield genai_types.GenerateContentResponse(candidates=[genai_types.Candidate(
+                    content=genai_types.Content(role="model", parts=[part])
+                )])
+
+        return stream()
+
+
+class FakeClient:
+    def __init__(self, script=(), caches=None):
+        self.models = FakeModels(script)
+        self.caches = caches or FakeCaches()
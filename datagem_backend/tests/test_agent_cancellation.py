@@ -0,0 +1,66 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from chat import agent as agent_module
+from chat import intent, response_cache
+from database import write_behind
+from fakes import FakeClient
+
+
+def test_cancel_during_final_save_does_not_save_a_truncated_copy(monkeypatch):
+    saved = []
+    final_save_reached = asyncio.Event()
+
+    async def save_chat_message(db, user_id, role, content, conversation_id=None):
+        saved.append((role, content))
+        if role == "model":
+            final_save_reached.set()
+            await asyncio.Event().wait()  # the durable ack never arrives before the cancel
+
+    monkeypatch.setattr(write_behind, "save_chat_message", save_chat_message)
+    monkeypatch.setattr(intent, "is_conversational", lambda prompt: True)
+    monkeypatch.setattr(intent, "LOCAL_RESPONDER", None)
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", False)
+
+    agent = agent_module.DataAnalystAgent(db=None, user=SimpleNamespace(id=1))
+    agent.client = FakeClient(script=[["Hello ", "there"]])
+    truncated = []
+    monkeypatch.setattr(agent, "_save_truncated", truncated.append)
+
+    async def run_turn():
+        async def consume():
+            async for _ in agent.stream_response("hello"):
+                pass
+
+        task = asyncio.create_task(consume())
+        await final_save_reached.wait()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run_turn())
+
+    assert saved == [("user", "hello"), ("model", "Hello there")]
+    assert truncated == []
+
+
+def test_truncated_save_without_write_behind_runs_off_the_event_loop(monkeypatch):
+    saved = []
+
+    def save_chat_message(db, user_id, role, content, conversation_id=None):
+        saved.append((threading.current_thread() is threading.main_thread(), role, content))
+
+    monkeypatch.setattr(agent_module.crud, "save_chat_message", save_chat_message)
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_ENABLED", False)
+    agent = agent_module.DataAnalystAgent(db=None, user=SimpleNamespace(id=1))
+
+    async def cancelled_turn():
+        agent._save_truncated("partial")
+
+    # asyncio.run waits for the executor before returning
+    asyncio.run(cancelled_turn())
+
+    assert saved == [(False, "model", "partial" + agent_module.TRUNCATED_MARKER)]
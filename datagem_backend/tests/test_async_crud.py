@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import uuid
+
+from database import async_crud, async_database, crud, database, migrations, models as db_models
+
+
+def _user_with_messages(count: int) -> int:
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        user = db_models.User(email=f"{uuid.uuid4().hex[:12]}@datagem.ai", hashed_password="x")
+        db.add(user)
+        db.commit()
+        for n in range(count):
+            crud.save_chat_message(db, user_id=user.id, role="user" if n % 2 == 0 else "model", content=f"message {n}")
+        return user.id
+
+
+def test_async_session_returns_what_the_sync_crud_returns():
+    user_id = _user_with_messages(5)
+    with database.SessionLocal() as db:
+        expected = [m.id for m in crud.get_chat_history(db, user_id=user_id, limit=3)]
+
+    async def fetch():
+        async with async_database.AsyncSessionLocal() as db:
+            messages = await async_crud.call("get_chat_history", db, user_id=user_id, limit=3)
+            return [m.id for m in messages]
+
+    assert asyncio.run(fetch()) == expected
+
+
+def test_sync_session_runs_in_a_worker_thread(monkeypatch):
+    threads = []
+
+    def get_chat_history(db, user_id, limit=50, conversation_id=None):
+        threads.append(threading.current_thread())
+        return ["row"]
+
+    monkeypatch.setattr(crud, "get_chat_history", get_chat_history)
+
+    async def fetch():
+        with database.SessionLocal() as db:
+            return await async_crud.call("get_chat_history", db, user_id=1)
+
+    assert asyncio.run(fetch()) == ["row"]
+    assert threads and threads[0] is not threading.main_thread()
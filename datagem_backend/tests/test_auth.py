@@ -0,0 +1,85 @@
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from auth import security
+from database import crud, database, user_cache, models as db_models
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _signup(client, password="pw-123456"):
+    email = f"{uuid.uuid4().hex[:12]}@datagem.ai"
+    response = client.post("/auth/signup", json={"email": email, "password": password, "full_name": "Test User"})
+    assert response.status_code == 200, response.text
+    return email, response.json()["access_token"]
+
+
+def test_me_returns_the_user_the_token_belongs_to(client):
+    first_email, _ = _signup(client)
+    second_email, second_token = _signup(client)
+
+    response = client.get("/auth/me", headers={"Authorization": f"Bearer {second_token}"})
+
+    assert response.status_code == 200
+    assert response.json()["email"] == second_email != first_email
+
+
+def test_login_issues_a_token_accepted_by_me(client):
+    email, _ = _signup(client)
+    response = client.post("/auth/login", json={"email": email, "password": "pw-123456"})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    assert client.get("/auth/me", headers={"Authorization": f"Bearer {token}"}).json()["email"] == email
+
+
+def test_wrong_password_and_bad_token_are_rejected(client):
+    email, _ = _signup(client)
+    assert client.post("/auth/login", json={"email": email, "password": "nope"}).status_code == 401
+    assert client.get("/auth/me", headers={"Authorization": "Bearer session_1"}).status_code == 401
+    assert client.get("/auth/me").status_code == 401
+
+
+def _stored_password(email):
+    with database.SessionLocal() as db:
+        return crud.get_user_by_email(db, email).hashed_password
+
+
+def test_signup_stores_a_bcrypt_hash(client):
+    email, _ = _signup(client)
+    stored = _stored_password(email)
+    assert security.is_password_hash(stored)
+    assert "pw-123456" not in stored
+
+
+def test_plain_password_account_is_upgraded_on_login(client):
+    email = f"{uuid.uuid4().hex[:12]}@datagem.ai"
+    with database.SessionLocal() as db:
+        crud.create_user(db, db_models.User(email=email, hashed_password="legacy-pw", full_name="Legacy"))
+
+    assert client.post("/auth/login", json={"email": email, "password": "wrong"}).status_code == 401
+    assert client.post("/auth/login", json={"email": email, "password": "legacy-pw"}).status_code == 200
+    assert security.is_password_hash(_stored_password(email))
+    # ...and the hash works from then on
+    assert client.post("/auth/login", json={"email": email, "password": "legacy-pw"}).status_code == 200
+
+
+def test_me_loads_an_uncached_user_without_the_sync_crud(client, monkeypatch):
+    email, token = _signup(client)
+    user_cache.USER_CACHE.clear()
+
+    def blocking_lookup(*args, **kwargs):
+        raise AssertionError("sync lookup on the event loop")
+
+    monkeypatch.setattr(crud, "get_user_by_email", blocking_lookup)
+    monkeypatch.setattr(crud, "get_cached_user_by_email", blocking_lookup)
+
+    response = client.get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.json()["email"] == email
@@ -0,0 +1,115 @@
+import pytest
+
+from chat import agent as agent_module
+from chat import context_cache
+from fakes import FakeCaches, FakeClient
+
+
+DATASET = [{"region": "north", "sales": 10}, {"region": "south", "sales": 20}]
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(context_cache, "CONTEXT_CACHE", context_cache.ContextCache())
+
+
+def make_agent(client, dataset=DATASET):
+    agent = agent_module.DataAnalystAgent(db=None, user=None, dataset=dataset)
+    agent.client = client
+    return agent
+
+
+def get(cache, client, key_index=0, model="gemini-test", contents=()):
+    return cache.get_or_create(client, key_index, model, "system", [], list(contents))
+
+
+def test_cache_is_created_once_and_reused():
+    client = FakeClient()
+    cache = context_cache.CONTEXT_CACHE
+    first = get(cache, client)
+    second = get(cache, client)
+    assert first == second == "cachedContents/1"
+    assert len(client.caches.created) == 1
+    assert cache.hits == 1
+
+
+def test_changed_prefix_or_key_gets_its_own_cache():
+    client = FakeClient()
+    cache = context_cache.CONTEXT_CACHE
+    base = get(cache, client)
+    other_dataset = get(cache, client, contents=[{"role": "user", "parts": [{"text": "other schema"}]}])
+    rotated_key = get(cache, client, key_index=1)
+    assert len({base, other_dataset, rotated_key}) == 3
+
+
+def test_cache_ttl_is_extended_before_it_expires():
+    client = FakeClient(caches=FakeCaches(ttl_seconds=60))
+    cache = context_cache.CONTEXT_CACHE
+    name = get(cache, client)
+    assert get(cache, client) == name
+    assert client.caches.updated == [name]
+    assert len(client.caches.created) == 1
+    # Extended to a full TTL, so the next lookup is a plain hit
+    assert get(cache, client) == name
+    assert client.caches.updated == [name]
+
+
+def test_failed_create_falls_back_and_is_not_retried_immediately():
+    client = FakeClient(caches=FakeCaches(fail=True))
+    cache = context_cache.CONTEXT_CACHE
+    assert get(cache, client) is None
+    client.caches.fail = False
+    assert get(cache, client) is None
+    assert client.caches.created == []
+
+
+def test_one_cache_per_dataset_and_model_across_modes():
+    client = FakeClient()
+    agent = make_agent(client)
+    configs = {mode: agent._tool_generation_config(mode, "gemini-test") for mode in ("ANY", "AUTO", "NONE")}
+    assert len(client.caches.created) == 1
+    assert {cfg.cached_content for cfg in configs.values()} == {"cachedContents/1"}
+    assert configs["ANY"].tool_config.function_calling_config.mode == "ANY"
+    assert configs["NONE"].tool_config.function_calling_config.mode == "NONE"
+    assert configs["AUTO"].tool_config is None
+    # The cached prefix carries no per-step settings
+    _, create_config = client.caches.created[0]
+    assert create_config.tool_config is None
+
+    agent._tool_generation_config("ANY", "gemini-other")
+    make_agent(client)._tool_generation_config("ANY", "gemini-test")
+    assert len(client.caches.created) == 2
+
+
+def test_stale_cache_is_dropped_and_the_step_retried_inline():
+    client = FakeClient(script=[RuntimeError("404 CachedContent not found"), ["answer"]])
+    agent = make_agent(client)
+    agent._schema_in_prefix = True
+
+    parts = list(agent._stream_model_step([{"role": "user", "parts": [{"text": "q"}]}], "AUTO"))
+
+    assert [part.text for part in parts] == ["answer"]
+    cached_call, retry = client.models.calls
+    assert cached_call.config.cached_content == "cachedContents/1"
+    assert retry.config.cached_content is None
+    assert retry.config.system_instruction
+    # The prompt relied on the cached schema, so the retry carries it inline
+    assert "Dataset schema for df" in retry.contents[0]["parts"][0]["text"]
+    assert context_cache.CONTEXT_CACHE._entries == {}
+
+
+def test_rejected_tool_config_sends_forced_steps_inline():
+    rejection = RuntimeError(
+        "400 INVALID_ARGUMENT: CachedContent can not be used with GenerateContent request "
+        "setting system_instruction, tools or tool_config."
+    )
+    client = FakeClient(script=[rejection, ["first"], ["second"]])
+    agent = make_agent(client)
+
+    list(agent._stream_model_step([{"role": "user", "parts": [{"text": "q"}]}], "ANY"))
+    list(agent._stream_model_step([{"role": "user", "parts": [{"text": "q"}]}], "AUTO"))
+
+    rejected, forced_retry, auto_step = client.models.calls
+    assert rejected.config.cached_content and forced_retry.config.cached_content is None
+    assert auto_step.config.cached_content == "cachedContents/1"
+    assert len(client.caches.created) == 1
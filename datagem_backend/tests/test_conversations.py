@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+
+import main
+from chat.chat import ANONYMOUS_EMAIL
+from database import crud, database, models as db_models
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _start(client, title: str) -> int:
+    response = client.post("/chat/conversations", json={"title": title})
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+def _save(conversation_id: int | None, content: str) -> None:
+    with database.SessionLocal() as db:
+        user = crud.get_user_by_email(db, ANONYMOUS_EMAIL)
+        crud.save_chat_message(db, user_id=user.id, role="user", content=content, conversation_id=conversation_id)
+
+
+def test_history_is_scoped_to_a_conversation(client):
+    first, second = _start(client, "churn"), _start(client, "revenue")
+    _save(first, "churn question")
+    _save(second, "revenue question")
+    _save(None, "question outside any conversation")
+
+    def contents(**params):
+        return [m["content"] for m in client.get("/chat/history", params=params).json()["messages"]]
+
+    assert contents(conversation_id=first) == ["churn question"]
+    assert contents(conversation_id=second) == ["revenue question"]
+    assert "question outside any conversation" in contents()
+    assert "churn question" not in contents()
+
+
+def test_new_message_moves_its_conversation_to_the_top(client):
+    older, newer = _start(client, "older"), _start(client, "newer")
+    with database.SessionLocal() as db:
+        db.execute(
+            update(db_models.Conversation)
+            .where(db_models.Conversation.id.in_([older, newer]))
+            .values(updated_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        )
+        db.commit()
+    _save(older, "back to this one")
+
+    listed = [c["id"] for c in client.get("/chat/conversations").json()]
+
+    assert listed.index(older) < listed.index(newer)
+
+
+def test_unknown_conversation_is_not_found(client):
+    assert client.get("/chat/history", params={"conversation_id": 999_999}).status_code == 404
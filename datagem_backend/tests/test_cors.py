@@ -0,0 +1,64 @@
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from cors import CORSOptionsMiddleware, OriginMatcher
+
+ALLOWLIST = "https://app.example.com,*.vercel.app,http://localhost:*,http://10.0.0.0/8"
+
+
+def _client() -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CORSOptionsMiddleware, allowlist=ALLOWLIST, fallback_origin="https://fallback.example.com")
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for n in range(3):
+                yield f"chunk {n}\n"
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    return TestClient(app)
+
+
+def test_origin_allowlist_entries():
+    is_allowed = OriginMatcher(ALLOWLIST)
+
+    assert is_allowed("https://app.example.com")
+    assert is_allowed("https://preview-42.vercel.app")
+    assert is_allowed("http://localhost:5173")
+    assert is_allowed("http://10.1.2.3:8080")
+    assert not is_allowed("https://10.1.2.3")  # scheme must match the range
+    assert not is_allowed("http://192.168.1.5:3000")
+    assert not is_allowed("https://evil.example.com")
+    assert not is_allowed("")
+
+
+def test_streamed_response_gets_cors_headers_for_an_allowed_origin():
+    response = _client().get("/stream", headers={"Origin": "http://localhost:3000"})
+
+    assert response.text == "chunk 0\nchunk 1\nchunk 2\n"
+    assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
+    assert response.headers["access-control-allow-credentials"] == "true"
+    assert response.headers["x-accel-buffering"] == "no"
+    assert "Origin" in response.headers["vary"]
+
+
+def test_other_origins_get_no_cors_headers():
+    response = _client().get("/stream", headers={"Origin": "https://evil.example.com"})
+
+    assert response.status_code == 200
+    assert "access-control-allow-origin" not in response.headers
+
+
+def test_preflight_is_answered_before_routing():
+    client = _client()
+
+    allowed = client.options("/not-a-route", headers={"Origin": "https://app.example.com"})
+    other = client.options("/stream", headers={"Origin": "https://evil.example.com"})
+
+    assert allowed.status_code == 200
+    assert allowed.headers["access-control-allow-origin"] == "https://app.example.com"
+    assert "POST" in allowed.headers["access-control-allow-methods"]
+    assert other.headers["access-control-allow-origin"] == "https://fallback.example.com"
@@ -0,0 +1,65 @@
+import uuid
+
+from sqlalchemy import event, select
+
+from database import blob_store, crud, database, migrations, models as db_models
+
+
+def _new_user(db) -> int:
+    user = db_models.User(email=f"{uuid.uuid4().hex[:12]}@datagem.ai", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return user.id
+
+
+def test_save_chat_message_does_not_reload_the_row_after_commit():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        user_id = _new_user(db)
+        selects = []
+
+        def count_selects(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith("SELECT"):
+                selects.append(statement)
+
+        engines = [e for e in (database.engine, database.writer_engine) if e is not None]
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", count_selects)
+        try:
+            crud.save_chat_message(db, user_id=user_id, role="user", content="how many rows?")
+        finally:
+            for engine in engines:
+                event.remove(engine, "before_cursor_execute", count_selects)
+
+    assert selects == []
+
+
+def test_saving_a_stored_payload_again_only_refreshes_its_blob():
+    migrations.ensure_schema(database.engine)
+    content = "PLOT_IMG_BASE64:" + uuid.uuid4().hex * 1000
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with database.SessionLocal() as db:
+        user_id = _new_user(db)
+        crud.save_chat_message(db, user_id=user_id, role="model", content=content)
+        first = db.get(db_models.MessageBlob, blob_store.blob_id(content)).last_used_at
+
+    # A second session that has never seen the blob, like a concurrent writer
+    with database.SessionLocal() as db:
+        engines = [e for e in (database.engine, database.writer_engine) if e is not None]
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", record)
+        try:
+            crud.save_chat_message(db, user_id=user_id, role="model", content=content)
+        finally:
+            for engine in engines:
+                event.remove(engine, "before_cursor_execute", record)
+        blobs = db.scalars(select(db_models.MessageBlob).where(db_models.MessageBlob.id == blob_store.blob_id(content))).all()
+
+    assert not any("FROM message_blobs" in statement for statement in statements)
+    assert len(blobs) == 1
+    assert blob_store.blob_text(blobs[0]) == content
+    assert blobs[0].last_used_at >= first
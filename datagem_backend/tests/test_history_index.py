@@ -0,0 +1,71 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+from chat import agent as agent_module
+from database import crud, database, history_index, migrations, models as db_models
+
+
+def _messages(*texts):
+    return [SimpleNamespace(id=i + 1, content=text) for i, text in enumerate(texts)]
+
+
+def test_search_ranks_the_matching_message_first():
+    key = history_index.scope(10_001)
+    history_index.build_user_index(key, _messages(
+        "Plot monthly revenue for 2023",
+        "Which region had the highest churn rate?",
+        "Show the revenue table again",
+    ))
+
+    assert history_index.search(key, "churn by region", top_k=2) == [2]
+    assert history_index.search(key, "revenue", top_k=5, exclude={1}) == [3]
+
+
+def test_index_keeps_only_the_newest_messages():
+    index = history_index._UserIndex(max_messages=2)
+    index.add(1, "churn analysis")
+    index.add(2, "revenue forecast")
+    index.add(3, "revenue by region")
+
+    assert list(index.doc_lengths) == [2, 3]
+    assert "churn" not in index.postings
+    assert index.total_length == sum(index.doc_lengths.values())
+
+
+def test_least_recently_used_scopes_are_dropped(monkeypatch):
+    monkeypatch.setattr(history_index, "HISTORY_INDEX_MAX_SCOPES", 2)
+    history_index.clear()
+    first, second, third = (history_index.scope(10_002, c) for c in (1, 2, 3))
+    history_index.build_user_index(first, _messages("alpha"))
+    history_index.build_user_index(second, _messages("beta"))
+    history_index.search(first, "alpha")  # first is now the most recently used
+    history_index.build_user_index(third, _messages("gamma"))
+
+    assert history_index.is_indexed(first)
+    assert not history_index.is_indexed(second)
+    assert history_index.is_indexed(third)
+
+
+def test_history_context_recalls_an_old_relevant_turn_within_the_budget(monkeypatch):
+    monkeypatch.setattr(agent_module, "HISTORY_RECENT_MESSAGES", 2)
+    monkeypatch.setattr(agent_module, "HISTORY_TOKEN_BUDGET", 60)
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        user = db_models.User(email=f"{uuid.uuid4().hex[:12]}@datagem.ai", hashed_password="x")
+        db.add(user)
+        db.commit()
+        texts = ["The churn rate peaked in March at 7%."]
+        texts += [f"Unrelated note {n}: " + "filler words " * 30 for n in range(5)]
+        texts += ["Thanks!", "What drove churn in March?"]
+        for n, text in enumerate(texts):
+            crud.save_chat_message(db, user_id=user.id, role="model" if n % 2 == 0 else "user", content=text)
+
+        agent = agent_module.DataAnalystAgent(db=db, user=SimpleNamespace(id=user.id))
+        context = asyncio.run(agent.build_history_context("What drove churn in March?"))
+
+    sent = [part["text"] for turn in context for part in turn["parts"]]
+    assert sent[0] == texts[0]  # the old relevant turn, oldest first
+    assert "Thanks!" in sent
+    assert all(not text.startswith("Unrelated") for text in sent)
+    assert sum(agent_module._estimate_tokens(text) for text in sent) <= 60
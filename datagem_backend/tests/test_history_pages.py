@@ -0,0 +1,82 @@
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from database import crud, database, migrations, models as db_models
+
+
+def _user(db) -> int:
+    user = db_models.User(email=f"{uuid.uuid4().hex[:12]}@datagem.ai", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return user.id
+
+
+def _messages(db, user_id: int, count: int, timestamp: datetime | None = None) -> list[int]:
+    ids = []
+    for n in range(count):
+        message = db_models.ChatHistory(user_id=user_id, role="user", content=f"message {n}")
+        if timestamp is not None:
+            message.timestamp = timestamp
+        db.add(message)
+        db.flush()
+        ids.append(message.id)
+    db.commit()
+    return ids
+
+
+def _all_pages(db, user_id: int, limit: int) -> list[list[int]]:
+    pages, before = [], None
+    while True:
+        page = [m.id for m in crud.get_chat_history_page(db, user_id=user_id, before=before, limit=limit)]
+        if not page:
+            return pages
+        pages.append(page)
+        before = page[-1]
+
+
+def test_pages_cover_every_message_once_even_with_equal_timestamps():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        user_id = _user(db)
+        # Messages saved in the same instant are ordered by id
+        ids = _messages(db, user_id, 7, timestamp=datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+        pages = _all_pages(db, user_id, limit=3)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [message_id for page in pages for message_id in page] == ids[::-1]
+
+
+def test_page_size_equal_to_the_message_count():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        user_id = _user(db)
+        ids = _messages(db, user_id, 4)
+
+        assert _all_pages(db, user_id, limit=4) == [ids[::-1]]
+
+
+def test_cursor_of_another_users_message_returns_nothing():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        owner, other = _user(db), _user(db)
+        foreign_id = _messages(db, other, 1)[0]
+        _messages(db, owner, 2)
+
+        assert crud.get_chat_history_page(db, user_id=owner, before=foreign_id) == []
+
+
+def test_page_query_uses_the_user_timestamp_index():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        plan = db.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM chat_history "
+            "WHERE user_id = 1 AND conversation_id IS NULL AND (timestamp, id) < ('2024-01-01', 10) "
+            "ORDER BY timestamp DESC, id DESC LIMIT 50"
+        )).all()
+
+    details = " ".join(row[-1] for row in plan)
+    assert "ix_chat_history_user_timestamp" in details
+    assert "TEMP B-TREE" not in details
@@ -0,0 +1,50 @@
+import asyncio
+from types import SimpleNamespace
+
+from chat import agent as agent_module
+from chat import intent
+from database import write_behind
+from fakes import FakeClient
+
+DATASET = [{"region": "north", "sales": 10, "units": 1, "price": 2.5, "month": 1, "year": 2023}]
+
+
+def test_greetings_and_capability_questions_are_conversational():
+    assert intent.is_conversational("Hello!")
+    assert intent.is_conversational("what can you do?")
+    assert not intent.is_conversational("what can you do with this dataset's sales column?")
+    assert not intent.is_conversational("plot sales by region")
+
+
+def test_local_responder_fills_in_the_dataset():
+    responder = intent.LocalResponder()
+
+    answer = responder.respond("What can you do?", DATASET)
+
+    assert answer.startswith("I'm DataGem")
+    assert "1 rows and 6 columns (region, sales, units, price, month, ...)" in answer
+    assert "Upload a CSV" in responder.respond("hi", None)
+
+
+def test_local_responder_leaves_unknown_prompts_to_the_model():
+    assert intent.LocalResponder().respond("which region sells the most?", DATASET) is None
+
+
+def test_greeting_is_answered_without_calling_the_model(monkeypatch):
+    saved = []
+
+    async def save_chat_message(db, user_id, role, content, conversation_id=None):
+        saved.append(role)
+
+    monkeypatch.setattr(write_behind, "save_chat_message", save_chat_message)
+    agent = agent_module.DataAnalystAgent(db=None, user=SimpleNamespace(id=1), dataset=DATASET)
+    agent.client = FakeClient(script=[])
+
+    async def collect():
+        return [event async for event in agent.stream_response("hello")]
+
+    events = asyncio.run(collect())
+
+    assert agent.client.models.calls == []
+    assert "Hi! I'm DataGem" in events[0]["delta"]
+    assert saved == ["user", "model"]
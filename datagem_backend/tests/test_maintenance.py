@@ -0,0 +1,103 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from database import blob_store, crud, database, maintenance, migrations, models as db_models
+
+
+def _store_blob(db, content: str, last_used_at: datetime | None) -> str:
+    blob = blob_store.new_blob(content)
+    blob.last_used_at = last_used_at
+    blob_store.save_blobs(db, [blob])
+    db.commit()
+    return blob.id
+
+
+def test_recently_used_unreferenced_blob_is_kept():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        old = _store_blob(db, "old payload " * 1000, datetime.now(timezone.utc) - timedelta(days=1))
+        legacy = _store_blob(db, "legacy payload " * 1000, None)
+        # Like a message still queued by the write-behind writer: its blob is
+        # stored or refreshed, but no row refers to it yet
+        fresh = _store_blob(db, "fresh payload " * 1000, datetime.now(timezone.utc))
+
+        maintenance.delete_unreferenced_blobs(db, grace_minutes=60)
+
+        assert db.get(db_models.MessageBlob, old) is None
+        assert db.get(db_models.MessageBlob, legacy) is None
+        assert db.get(db_models.MessageBlob, fresh) is not None
+
+
+def test_saving_a_stored_blob_refreshes_its_last_use():
+    migrations.ensure_schema(database.engine)
+    content = "reused payload " * 1000
+    with database.SessionLocal() as db:
+        blob_id = _store_blob(db, content, datetime.now(timezone.utc) - timedelta(days=1))
+        blob_store.save_blobs(db, [blob_store.new_blob(content)])
+        db.commit()
+
+        maintenance.delete_unreferenced_blobs(db, grace_minutes=60)
+
+        assert db.get(db_models.MessageBlob, blob_id) is not None
+
+
+def _user(db) -> db_models.User:
+    user = db_models.User(email=f"{uuid.uuid4().hex[:12]}@datagem.ai", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return user
+
+
+def _history(db, user_id: int, conversation_id: int | None) -> list[tuple]:
+    messages = db.scalars(
+        select(db_models.ChatHistory)
+        .where(*crud.history_scope(user_id, conversation_id))
+        .order_by(db_models.ChatHistory.timestamp, db_models.ChatHistory.id)
+    ).all()
+    return [(m.role, crud.get_message_content(db, m), m.timestamp) for m in messages]
+
+
+def test_archived_conversation_restores_with_full_content(monkeypatch, tmp_path):
+    monkeypatch.setattr(maintenance, "HISTORY_ARCHIVE_DIR", str(tmp_path))
+    migrations.ensure_schema(database.engine)
+    plot = "PLOT_IMG_BASE64:" + uuid.uuid4().hex * 1000
+    with database.SessionLocal() as db:
+        user = _user(db)
+        conversation = crud.create_conversation(db, db_models.Conversation(user_id=user.id, title="churn"))
+        crud.save_chat_message(db, user.id, "user", "plot churn by month", conversation.id)
+        crud.save_chat_message(db, user.id, "model", "Here it is\n" + plot, conversation.id)
+        before = _history(db, user.id, conversation.id)
+
+        assert maintenance.archive_conversation(db, user, conversation) == 2
+        assert db.get(db_models.Conversation, conversation.id) is None
+        assert _history(db, user.id, conversation.id) == []
+
+        (path,) = (tmp_path / f"user_{user.id}").iterdir()
+        assert maintenance.restore_archive(db, str(path)) == 2
+
+        restored = db.scalars(
+            select(db_models.Conversation).where(db_models.Conversation.user_id == user.id)
+        ).one()
+        assert restored.title == "churn"
+        assert _history(db, user.id, restored.id) == before
+        # Restored messages are searchable again
+        assert crud.search_chat_messages(db, user_id=user.id, query="churn month")
+
+
+def test_compacted_payload_is_still_readable():
+    migrations.ensure_schema(database.engine)
+    plot = "PLOT_IMG_BASE64:" + uuid.uuid4().hex * 10
+    with database.SessionLocal() as db:
+        user = _user(db)
+        # Small enough to stay inline when saved
+        message = crud.save_chat_message(db, user.id, "model", "Chart\n" + plot)
+
+        changed = maintenance.compact_old_payloads(db, cutoff=datetime.now(timezone.utc) + timedelta(days=1))
+
+        stored = db.get(db_models.ChatHistory, message.id)
+        assert changed >= 1
+        assert stored.blob_id is not None
+        assert "PLOT_IMG_BASE64" not in stored.content
+        assert crud.get_message_content(db, stored) == "Chart\n" + plot
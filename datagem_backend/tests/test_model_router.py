@@ -0,0 +1,57 @@
+from chat import model_router
+
+ROUTING = {
+    **model_router.DEFAULT_ROUTING,
+    "phases": {"code": {"models": ["fast", "backup"], "latency_slo_ms": 1000}},
+    "min_samples": 3,
+    "slo_window_seconds": 600,
+}
+
+
+def _router(**overrides) -> model_router.ModelRouter:
+    return model_router.ModelRouter({**ROUTING, **overrides})
+
+
+def test_model_over_its_latency_slo_falls_back():
+    router = _router()
+    for _ in range(3):
+        router.record("code", "fast", 2.5)
+
+    assert router.pick("code") == "backup"
+
+
+def test_model_within_its_slo_is_kept():
+    router = _router()
+    for _ in range(3):
+        router.record("code", "fast", 0.4)
+
+    assert router.pick("code") == "fast"
+
+
+def test_slow_model_is_tried_again_once_its_samples_expire(monkeypatch):
+    router = _router()
+    now = 1_000_000.0
+    monkeypatch.setattr(model_router.time, "time", lambda: now)
+    for _ in range(3):
+        router.record("code", "fast", 2.5)
+    assert router.pick("code") == "backup"
+
+    now += 601
+    assert router.pick("code") == "fast"
+
+
+def test_throttled_model_is_avoided_until_the_cooldown_ends(monkeypatch):
+    router = _router(throttle_cooldown_seconds=60)
+    now = 1_000_000.0
+    monkeypatch.setattr(model_router.time, "time", lambda: now)
+    router.mark_throttled("fast")
+    assert router.pick("code") == "backup"
+
+    now += 61
+    assert router.pick("code") == "fast"
+
+
+def test_excluded_model_is_skipped_unless_it_is_the_only_one():
+    router = _router()
+    assert router.pick("code", exclude={"fast"}) == "backup"
+    assert router.pick("code", exclude={"fast", "backup"}) == "fast"
@@ -0,0 +1,47 @@
+from chat import output_condenser
+
+
+def _table(rows: int) -> str:
+    lines = ["| region | sales |", "|---|---|"]
+    lines += [f"| r{n} | {n * 10} |" for n in range(rows)]
+    return "\n".join(lines)
+
+
+def test_short_output_is_unchanged():
+    output = "mean sales: 42.0\n" + _table(3)
+    assert output_condenser.condense(output) == output
+
+
+def test_output_is_split_into_segments():
+    output = "Summary\n" + _table(2) + "\nPLOT_IMG_BASE64:" + "A" * 400 + "\n--- Warnings ---\nFutureWarning: x"
+    kinds = [kind for kind, _ in output_condenser.parse_segments(output)]
+    assert kinds == ["text", "table", "image", "warning"]
+
+
+def test_long_table_keeps_header_head_and_tail_rows():
+    condensed = output_condenser.condense(_table(500), budget=200)
+
+    lines = condensed.splitlines()
+    assert lines[:3] == ["| region | sales |", "|---|---|", "| r0 | 0 |"]
+    assert "| r499 | 4990 |" in lines
+    assert any("rows omitted" in line for line in lines)
+    assert lines[-1] == "(500 rows in total)"
+    assert output_condenser._tokens(condensed) <= 250
+
+
+def test_plot_becomes_a_placeholder():
+    condensed = output_condenser.condense("Done\nPLOT_IMG_BASE64:" + "A" * 40_000)
+    assert condensed == "Done\n[image 1: plot rendered for the user (29 KB), omitted]"
+
+
+def test_repeated_warnings_are_collapsed():
+    output = "result: 1\n--- Warnings ---\n" + "\n".join(["FutureWarning: use observed=True"] * 50)
+    condensed = output_condenser.condense(output)
+    assert condensed == "result: 1\n--- Warnings ---\nFutureWarning: use observed=True (x50)"
+
+
+def test_text_after_a_huge_table_survives():
+    # Truncating at a fixed length used to cut off what came after the table
+    output = _table(2000) + "\nCorrelation between price and sales: 0.87"
+    condensed = output_condenser.condense(output, budget=300)
+    assert condensed.endswith("Correlation between price and sales: 0.87")
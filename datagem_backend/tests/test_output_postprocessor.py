@@ -0,0 +1,27 @@
+import pytest
+
+from chat import output_postprocessor
+
+
+@pytest.mark.parametrize("prompt", [
+    "show the trending products",
+    "plot revenue by shoulder season",
+])
+def test_keywords_inside_other_words_do_not_ask_for_interpretation(prompt):
+    assert not output_postprocessor.wants_interpretation(prompt)
+
+
+@pytest.mark.parametrize("prompt", [
+    "what is the sales trend?",
+    "show the trends by month",
+    "what should we focus on",
+    "explain the top 5 rows",
+])
+def test_whole_keywords_ask_for_interpretation(prompt):
+    assert output_postprocessor.wants_interpretation(prompt)
+
+
+def test_table_for_trending_question_is_answered_directly():
+    output = "| product | sales |\n|---|---|\n| a | 10 |\n| b | 7 |"
+    answer = output_postprocessor.render_direct_answer("top trending products", [("print(df)", output)])
+    assert answer is not None
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import profiles, models as db_models
+from database.async_database import to_async_url
+from database.database import Base
+
+
+@pytest.fixture
+def engines(tmp_path):
+    url = f"sqlite:///{tmp_path / 'profiles.db'}"
+    engine = create_engine(url)
+    profiles.configure_engine(engine)
+    Base.metadata.create_all(engine)
+    writer = create_engine(url, **profiles.writer_engine_options(url))
+    profiles.configure_engine(writer)
+    async_url = to_async_url(url)
+    async_engine = create_async_engine(async_url)
+    profiles.configure_engine(async_engine.sync_engine)
+    async_writer = create_async_engine(async_url, **profiles.writer_engine_options(async_url, kind="async"))
+    profiles.configure_engine(async_writer.sync_engine)
+    yield engine, writer, async_engine, async_writer
+    engine.dispose()
+    writer.dispose()
+
+
+def _user(email: str) -> db_models.User:
+    return db_models.User(email=email, hashed_password="x")
+
+
+def test_sync_and_async_writers_share_one_connection(engines):
+    _, writer, _, async_writer = engines
+
+    async def async_connection():
+        async with async_writer.connect() as conn:
+            raw = await conn.get_raw_connection()
+            # aiosqlite connection -> its sqlite3 connection
+            return raw.driver_connection._conn._connection
+
+    with writer.connect() as conn:
+        sync_connection = conn.connection.driver_connection._connection
+    assert asyncio.run(async_connection()) is sync_connection
+
+
+def test_transaction_reads_its_own_writes_after_writing(engines):
+    engine, writer, _, _ = engines
+    make_session = sessionmaker(bind=engine, autoflush=False, class_=profiles.session_class(writer))
+    with make_session() as db:
+        assert db.scalar(select(func.count()).select_from(db_models.User)) == 0
+        db.add(_user("own-write@datagem.ai"))
+        db.flush()
+        assert db.scalar(select(func.count()).select_from(db_models.User)) == 1
+        db.rollback()
+        assert db.scalar(select(func.count()).select_from(db_models.User)) == 0
+
+
+def test_thread_writer_waits_for_async_writer_without_blocking_the_loop(engines):
+    engine, writer, async_engine, async_writer = engines
+    make_session = sessionmaker(bind=engine, autoflush=False, class_=profiles.session_class(writer))
+    make_async_session = async_sessionmaker(
+        async_engine, autoflush=False, sync_session_class=profiles.session_class(async_writer.sync_engine)
+    )
+    order = []
+
+    def thread_write():
+        with make_session() as db:
+            db.add(_user("thread@datagem.ai"))
+            db.commit()
+        order.append("thread committed")
+
+    async def main():
+        async with make_async_session() as db:
+            db.add(_user("async@datagem.ai"))
+            await db.flush()
+            thread = threading.Thread(target=thread_write)
+            thread.start()
+            # The loop keeps running while the thread queues for the writer
+            for _ in range(5):
+                await asyncio.sleep(0.01)
+            order.append("async committing")
+            await db.commit()
+        await asyncio.to_thread(thread.join)
+        await async_writer.dispose()
+        await async_engine.dispose()
+
+    asyncio.run(main())
+    assert order == ["async committing", "thread committed"]
+    with sessionmaker(bind=engine)() as db:
+        assert db.scalar(select(func.count()).select_from(db_models.User)) == 2
+
+
+def test_single_writer_rejects_other_journal_modes(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiles, "SQLITE_JOURNAL_MODE", "DELETE")
+    with pytest.raises(ValueError):
+        profiles.writer_engine_options(f"sqlite:///{tmp_path / 'delete.db'}")
+
+
+def test_sync_writer_refuses_the_event_loop_thread(engines):
+    engine, writer, _, _ = engines
+    make_session = sessionmaker(bind=engine, autoflush=False, class_=profiles.session_class(writer))
+
+    async def write_on_the_loop():
+        with make_session() as db:
+            db.add(_user("loop@datagem.ai"))
+            db.commit()
+
+    with pytest.raises(RuntimeError, match="event loop"):
+        asyncio.run(write_on_the_loop())
+
+
+def test_shared_writer_connection_refuses_per_engine_settings(engines):
+    _, writer, _, _ = engines
+    with writer.connect() as conn:
+        with pytest.raises(AttributeError):
+            conn.connection.driver_connection.isolation_level = None
@@ -0,0 +1,25 @@
+import copy
+
+from chat import response_cache
+
+
+def _dataset(rows: int = 1000) -> list[dict]:
+    return [{"region": f"r{i % 7}", "sales": i * 1.5, "units": i} for i in range(rows)]
+
+
+def test_fingerprint_is_stable_for_equal_content():
+    dataset = _dataset()
+    assert response_cache.dataset_fingerprint(dataset) == response_cache.dataset_fingerprint(copy.deepcopy(dataset))
+
+
+def test_fingerprint_changes_with_any_row():
+    dataset = _dataset()
+    before = response_cache.dataset_fingerprint(dataset)
+    for index in (1, 333, 998):
+        changed = copy.deepcopy(dataset)
+        changed[index]["units"] += 1
+        assert response_cache.dataset_fingerprint(changed) != before
+
+
+def test_fingerprint_without_dataset():
+    assert response_cache.dataset_fingerprint(None) == response_cache.dataset_fingerprint([]) == "none"
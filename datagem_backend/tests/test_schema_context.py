@@ -0,0 +1,56 @@
+from chat import schema_context
+
+
+def _wide_dataset(rows: int = 20) -> list[dict]:
+    dataset = []
+    for i in range(rows):
+        row = {f"metric_{n}": i * n for n in range(60)}
+        row.update({"Region": f"r{i % 3}", "AnnualSalary": 40_000 + i * 1000, "hours_studied": i % 9})
+        dataset.append(row)
+    return dataset
+
+
+def test_wide_dataset_lists_only_the_relevant_columns():
+    index = schema_context.SchemaIndex(_wide_dataset())
+
+    selected = index.select_columns("average annual salary by region", top_k=3)
+
+    assert set(selected) >= {"Region", "AnnualSalary"}
+    assert len(selected) == 3
+
+
+def test_misspelled_and_multi_word_column_names_are_matched():
+    index = schema_context.SchemaIndex(_wide_dataset())
+    scores = dict(zip(index.columns, index.score_columns("does salry depend on hours studied?")))
+
+    assert scores["AnnualSalary"] > 0
+    assert scores["hours_studied"] > scores["AnnualSalary"]  # whole name mentioned
+    assert scores["metric_1"] == 0
+
+
+def test_selected_columns_keep_dataset_order():
+    index = schema_context.SchemaIndex(_wide_dataset())
+    assert index.select_columns("hours studied and region", top_k=2) == ["Region", "hours_studied"]
+
+
+def test_narrow_dataset_lists_every_column():
+    index = schema_context.SchemaIndex([{"a": 1, "b": "x"}, {"a": 2, "b": "y"}])
+    description = index.describe("anything", top_k=40)
+
+    assert "All columns: a (num 1–2), b (text, 2+ uniq)" in description
+    assert "omitted" not in description
+    assert "Numeric columns: a" in description
+
+
+def test_describe_counts_the_omitted_columns():
+    index = schema_context.SchemaIndex(_wide_dataset())
+    description = index.describe("salary by region", top_k=5)
+
+    assert "Relevant columns:" in description
+    assert f"- {len(index.columns) - 5} other columns omitted" in description
+
+
+def test_index_is_shared_per_fingerprint():
+    dataset = _wide_dataset()
+    assert schema_context.index_for(dataset, "fp-1") is schema_context.index_for(dataset, "fp-1")
+    assert schema_context.index_for(dataset, "fp-2") is not schema_context.index_for(dataset, "fp-1")
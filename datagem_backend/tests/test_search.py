@@ -0,0 +1,64 @@
+import uuid
+
+from database import crud, database, migrations, models as db_models, search
+
+
+def _user_with(db, *contents: str) -> tuple[int, list[int]]:
+    user = db_models.User(email=f"{uuid.uuid4().hex[:12]}@datagem.ai", hashed_password="x")
+    db.add(user)
+    db.commit()
+    ids = [crud.save_chat_message(db, user_id=user.id, role="user", content=content).id for content in contents]
+    return user.id, ids
+
+
+def test_query_terms_drop_question_words():
+    assert search.query_terms("Where did I compute churn by region?") == ["compute", "churn", "region"]
+    assert search.query_terms('churn" OR owner:u1') == ["churn", "owner", "u1"]
+
+
+def test_best_match_comes_first_with_a_highlighted_snippet():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        user_id, (other, churn, both) = _user_with(
+            db,
+            "Revenue grew 12% in the north region",
+            "Churn is about 4% overall, similar in every region",
+            "Churn by region: churn is highest in the north region",
+        )
+
+        rows = crud.search_chat_messages(db, user_id=user_id, query="churn by region")
+
+    assert [row.id for row in rows] == [both, churn]
+    assert "<mark>" in rows[0].snippet and "</mark>" in rows[0].snippet
+
+
+def test_any_word_matches_when_no_message_has_every_word():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        user_id, (revenue, churn) = _user_with(db, "Revenue by quarter", "Churn is about 4%")
+
+        rows = crud.search_chat_messages(db, user_id=user_id, query="churn revenue forecast")
+
+    assert {row.id for row in rows} == {revenue, churn}
+
+
+def test_other_users_messages_are_not_found():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        owner, _ = _user_with(db, "seasonality of sales")
+        _user_with(db, "seasonality of returns")
+
+        rows = crud.search_chat_messages(db, user_id=owner, query="seasonality")
+
+    assert [row.snippet for row in rows] == ["<mark>seasonality</mark> of sales"]
+
+
+def test_edited_message_is_reindexed():
+    migrations.ensure_schema(database.engine)
+    with database.SessionLocal() as db:
+        user_id, (message_id,) = _user_with(db, "histogram of ages")
+        db.get(db_models.ChatHistory, message_id).content = "boxplot of ages"
+        db.commit()
+
+        assert crud.search_chat_messages(db, user_id=user_id, query="histogram") == []
+        assert [row.id for row in crud.search_chat_messages(db, user_id=user_id, query="boxplot")] == [message_id]
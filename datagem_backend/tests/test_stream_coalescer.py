@@ -0,0 +1,54 @@
+import asyncio
+
+from chat import stream_coalescer, stream_events
+
+
+async def _collect(events, **kwargs):
+    return [event async for event in stream_coalescer.coalesce(events, **kwargs)]
+
+
+def test_adjacent_text_is_merged_and_other_events_flush():
+    async def source():
+        for delta in ("Hel", "lo", " world"):
+            yield stream_events.text(delta)
+        yield stream_events.code("c1", "print(1)")
+        yield stream_events.text("done")
+
+    events = asyncio.run(_collect(source(), window_ms=1000))
+    assert [e["type"] for e in events] == ["text", "code", "text"]
+    assert events[0]["delta"] == "Hello world"
+
+
+def test_slow_client_holds_back_the_source():
+    produced = []
+
+    async def source():
+        for i in range(1000):
+            produced.append(i)
+            yield stream_events.code(f"c{i}", "x")
+
+    async def run():
+        stream = stream_coalescer.coalesce(source(), window_ms=10)
+        await stream.__anext__()
+        # The client stalls; the pump may only read ahead up to the queue bound
+        await asyncio.sleep(0.05)
+        read_ahead = len(produced)
+        await stream.aclose()
+        return read_ahead
+
+    read_ahead = asyncio.run(run())
+    assert read_ahead <= stream_coalescer.STREAM_COALESCE_QUEUE_EVENTS + 2
+
+
+def test_source_errors_reach_the_consumer():
+    async def source():
+        yield stream_events.text("partial")
+        raise RuntimeError("boom")
+
+    async def run():
+        try:
+            await _collect(source(), window_ms=10)
+        except RuntimeError as e:
+            return str(e)
+
+    assert asyncio.run(run()) == "boom"
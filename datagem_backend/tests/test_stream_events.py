@@ -0,0 +1,46 @@
+import json
+
+from chat import stream_events
+
+TOOL_OUTPUT = "\n".join([
+    "Top regions",
+    "| region | sales |",
+    "|---|---|",
+    "| north | 10 |",
+    "| south | 7 |",
+    "PLOT_IMG_BASE64:" + "A" * 300,
+])
+
+
+def test_text_format_renders_the_markdown_stream():
+    event = stream_events.tool_output("call_1", "run_python_code", "42")
+
+    assert stream_events.to_markdown(stream_events.text("Hi")) == "Hi"
+    assert stream_events.to_markdown(event) == "\n**Code Output:**\n```\n42\n```\n\n"
+    assert stream_events.to_markdown(stream_events.heartbeat(3.0)) == ""
+    assert stream_events.to_markdown(stream_events.done()) == ""
+
+
+def test_ndjson_splits_tool_output_into_typed_events():
+    rendered = stream_events.to_ndjson(stream_events.tool_output("call_1", "run_python_code", TOOL_OUTPUT))
+    events = [json.loads(line) for line in rendered.splitlines()]
+
+    assert [event["type"] for event in events] == ["tool_output", "table", "image"]
+    assert events[0]["text"] == "Top regions"
+    assert events[1]["columns"] == ["region", "sales"]
+    assert events[1]["rows"] == [["north", "10"], ["south", "7"]]
+    assert events[2]["data"] == "A" * 300
+    assert all(event["call_id"] == "call_1" for event in events)
+
+
+def test_sse_frames_name_the_event_type():
+    rendered = stream_events.to_sse(stream_events.status("executing", "Running", tool="run_python_code"))
+    assert rendered.startswith("event: status\ndata: {")
+    assert rendered.endswith("\n\n")
+
+
+def test_format_is_negotiated_from_body_then_accept_header():
+    assert stream_events.negotiate_format("ndjson", "text/event-stream") == "ndjson"
+    assert stream_events.negotiate_format(None, "text/event-stream") == "sse"
+    assert stream_events.negotiate_format(None, "application/x-ndjson, */*") == "ndjson"
+    assert stream_events.negotiate_format("xml", "*/*") == "text"
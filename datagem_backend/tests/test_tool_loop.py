@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from chat import agent as agent_module
+from chat import response_cache
+from fakes import FakeClient, function_call
+
+DTYPES_CODE = "print(df.dtypes)"
+DTYPES_OUTPUT = "region     object\nsales     float64\ndtype: object"
+PLOT_CODE = "plt.title('Sales by region')\nplt.bar(df.region, df.sales)"
+PLOT_OUTPUT = "PLOT_IMG_BASE64:iVBORw0KGgo"
+
+lock = threading.Lock()
+
+
+def _agent(monkeypatch, script, outputs):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", False)
+    agent = agent_module.DataAnalystAgent(db=None, user=SimpleNamespace(id=1))
+    agent.client = FakeClient(script=script)
+    agent._use_context_cache = False
+    executed = []
+
+    async def no_history(query):
+        return []
+
+    def execute_tool(tool_name, tool_args):
+        executed.append(tool_args["code"])
+        return outputs[tool_args["code"]]
+
+    monkeypatch.setattr(agent, "build_history_context", no_history)
+    monkeypatch.setattr(agent, "_execute_tool", execute_tool)
+    return agent, executed
+
+
+def _run(agent, prompt):
+    async def collect():
+        return [event async for event, is_model_text in agent._run_tool_loop(prompt, prompt) if is_model_text]
+
+    return "".join(event["delta"] for event in asyncio.run(collect()))
+
+
+def test_inspection_step_does_not_end_the_turn(monkeypatch):
+    agent, executed = _agent(
+        monkeypatch,
+        script=[
+            [function_call("run_python_code", code=DTYPES_CODE)],
+            [function_call("run_python_code", code=PLOT_CODE)],
+            ["Sales are highest in the north."],
+        ],
+        outputs={DTYPES_CODE: DTYPES_OUTPUT, PLOT_CODE: PLOT_OUTPUT},
+    )
+
+    answer = _run(agent, "plot sales by region")
+
+    assert executed == [DTYPES_CODE, PLOT_CODE]
+    assert answer == "Sales are highest in the north."
+    assert len(agent.client.models.calls) == 3
+    # Chained steps may still call tools, so they go to the code model
+    code_model = agent_module.model_router.ROUTER.pick("code")
+    assert [call.model for call in agent.client.models.calls[:2]] == [code_model, code_model]
+
+
+def test_last_tool_step_answers_from_its_output(monkeypatch):
+    monkeypatch.setattr(agent_module, "AGENT_MAX_TOOL_STEPS", 2)
+    agent, executed = _agent(
+        monkeypatch,
+        script=[[function_call("run_python_code", code=PLOT_CODE)]],
+        outputs={PLOT_CODE: PLOT_OUTPUT},
+    )
+
+    answer = _run(agent, "plot sales by region")
+
+    assert executed == [PLOT_CODE]
+    assert "Sales by region" in answer
+    assert len(agent.client.models.calls) == 1
+
+
+def _parallel_agent(monkeypatch, codes, running, peak):
+    agent, _ = _agent(monkeypatch, script=[[function_call("run_python_code", code=c) for c in codes]], outputs={})
+
+    def execute_tool(tool_name, tool_args):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        # Later calls finish first
+        time.sleep(0.02 * (len(codes) - codes.index(tool_args["code"])))
+        with lock:
+            running[0] -= 1
+        return f"result of {tool_args['code']}"
+
+    monkeypatch.setattr(agent, "_execute_tool", execute_tool)
+    return agent
+
+
+def test_parallel_calls_are_limited_and_answered_in_call_order(monkeypatch):
+    monkeypatch.setattr(agent_module, "AGENT_MAX_TOOL_STEPS", 2)
+    monkeypatch.setattr(agent_module, "TOOL_MAX_PARALLEL", 2)
+    codes = [f"print({n})" for n in range(4)]
+    running, peak = [0], [0]
+    agent = _parallel_agent(monkeypatch, codes, running, peak)
+    agent.client.models.script.append(["Done."])
+
+    assert _run(agent, "compare the four groups") == "Done."
+    assert peak[0] == 2
+    responses = agent.client.models.calls[1].contents[-1].parts
+    assert [part.function_response.response["output"] for part in responses] == [f"result of {c}" for c in codes]
+
+
+def test_tool_limit_is_per_turn(monkeypatch):
+    monkeypatch.setattr(agent_module, "AGENT_MAX_TOOL_STEPS", 2)
+    monkeypatch.setattr(agent_module, "TOOL_MAX_PARALLEL", 1)
+    running, peak = [0], [0]
+    agents = [_parallel_agent(monkeypatch, [f"print('{t}', {n})" for n in range(2)], running, peak) for t in "ab"]
+    for agent in agents:
+        agent.client.models.script.append(["Done."])
+
+    async def both_turns():
+        async def turn(agent):
+            return [event async for event, _ in agent._run_tool_loop("compare", "compare")]
+
+        await asyncio.gather(*(turn(agent) for agent in agents))
+
+    asyncio.run(both_turns())
+    # One call at a time within each turn, but the turns don't wait for each other
+    assert peak[0] == 2
+
+
+def test_tool_output_goes_back_as_a_function_response(monkeypatch):
+    agent, _ = _agent(
+        monkeypatch,
+        script=[
+            [function_call("run_python_code", code=DTYPES_CODE)],
+            ["The dataset has a text region column and numeric sales."],
+        ],
+        outputs={DTYPES_CODE: DTYPES_OUTPUT},
+    )
+
+    _run(agent, "describe the columns")
+
+    first, second = agent.client.models.calls
+    # The second call continues the same conversation instead of a new prompt
+    assert second.contents[:len(first.contents)] == first.contents
+    call, response = second.contents[len(first.contents):]
+    assert call.role == "model"
+    assert call.parts[0].function_call.args == {"code": DTYPES_CODE}
+    assert response.role == "user"
+    assert response.parts[0].function_response.name == "run_python_code"
+    assert DTYPES_OUTPUT in response.parts[0].function_response.response["output"]
@@ -0,0 +1,19 @@
+from chat import tools
+
+
+def test_handled_error_printed_by_the_program_is_not_a_failure():
+    code = (
+        "try:\n"
+        "    1 / 0\n"
+        "except ZeroDivisionError:\n"
+        "    print('Error: division by zero, using 0 instead')\n"
+    )
+    result = tools.run_python_code(code)
+    assert result.startswith("Error: division by zero")
+    assert not tools.is_execution_failure(result)
+
+
+def test_crash_is_a_failure():
+    result = tools.run_python_code("1 / 0")
+    assert tools.is_execution_failure(result)
+    assert "ZeroDivisionError" in tools.trim_traceback(result)
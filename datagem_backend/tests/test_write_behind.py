@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from database import write_behind
+
+
+class FakeInserts:
+    """Stands in for WriteBehindQueue._insert_async: records batches, optionally slow or failing."""
+
+    def __init__(self, failures: int = 0):
+        self.batches = []
+        self.failures = failures
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.release.set()
+        self._next_id = 0
+
+    async def __call__(self, messages, blobs):
+        self.started.set()
+        await self.release.wait()
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        for message in messages:
+            self._next_id += 1
+            message.id = self._next_id
+        self.batches.append([message.content for message in messages])
+
+
+def _queue(inserts: FakeInserts, durable_ack: bool = False) -> write_behind.WriteBehindQueue:
+    queue = write_behind.WriteBehindQueue(
+        async_session_factory=object(), sync_session_factory=None, flush_interval=0.01, durable_ack=durable_ack
+    )
+    queue._insert_async = inserts
+    return queue
+
+
+def test_messages_queued_together_are_inserted_in_one_batch():
+    async def main():
+        inserts = FakeInserts()
+        queue = _queue(inserts)
+        queue.start()
+        for n in range(5):
+            queue.enqueue(1, "user", f"message {n}")
+        await queue.read_barrier()
+        await queue.stop()
+        return inserts.batches
+
+    assert asyncio.run(main()) == [[f"message {n}" for n in range(5)]]
+
+
+def test_read_barrier_waits_for_a_flush_in_progress():
+    async def main():
+        inserts = FakeInserts()
+        inserts.release.clear()
+        queue = _queue(inserts)
+        queue.start()
+        queue.enqueue(1, "user", "hello")
+        # The batch has left the queue but is not committed yet
+        await inserts.started.wait()
+        barrier = asyncio.create_task(queue.read_barrier())
+        await asyncio.sleep(0.05)
+        waited = not barrier.done()
+        inserts.release.set()
+        await barrier
+        batches = list(inserts.batches)
+        await queue.stop()
+        return waited, batches
+
+    waited, batches = asyncio.run(main())
+    assert waited
+    assert batches == [["hello"]]
+
+
+def test_failed_flush_is_retried():
+    async def main():
+        inserts = FakeInserts(failures=1)
+        queue = _queue(inserts)
+        queue.start()
+        queue.enqueue(1, "user", "retry me")
+        await queue.read_barrier()
+        await queue.stop()
+        return inserts.batches
+
+    assert asyncio.run(main()) == [["retry me"]]
+
+
+def test_durable_save_reports_a_failed_flush():
+    async def main():
+        queue = _queue(FakeInserts(failures=1), durable_ack=True)
+        queue.start()
+        try:
+            with pytest.raises(RuntimeError):
+                await queue.save(1, "user", "lost")
+        finally:
+            await queue.stop()
+
+    asyncio.run(main())